@@ -0,0 +1,757 @@
+"""
+掲示板生成処理のベンチマーク。APIクレジットを使わずに、ローカルのスタブサーバーで計測する。
+
+    python benchmark.py pipeline          # 取得〜集約〜書き出しの各段階 (100〜100,000便)
+    python benchmark.py render            # HTML書き出しの処理時間とピークRSS
+    python benchmark.py model             # 辞書3段コピーとFlightモデルの時間・メモリ比較
+    python benchmark.py boards            # 出発便のみと、出発便+到着便を同じ実行で生成した場合の比較
+    python benchmark.py timestamps        # 時刻の変換: 従来の1件ずつの変換、メモ、NumPyでの一括変換の比較
+    python benchmark.py serve             # スタブサーバーだけを起動する (手動での確認用)
+
+--json PATH を指定すると、結果をコミット間で比較できるJSONとして書き出す (例: --json benchmark_results.json)。
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional
+from urllib.parse import urlparse, parse_qs
+
+RENDER_SIZES = [100, 1000, 10000, 50000]
+MODEL_SIZES = [10000, 50000]
+PIPELINE_SIZES = [100, 1000, 10000, 100000]
+BOARDS_SIZES = [1000, 10000]
+TIMESTAMP_SIZES = [10000, 100000]
+
+
+# --- 合成ペイロード ---
+
+# (IATA, 都市名, 空港名)。最後の2件は翻訳が未登録の行き先
+DESTINATIONS = [
+    ("ITM", "Itami", "Osaka International"), ("CTS", "Chitose", "New Chitose"),
+    ("FUK", "Fukuoka", "Fukuoka"), ("OKA", "Naha", "Naha"), ("KOJ", "Kagoshima", "Kagoshima"),
+    ("HIJ", "Hiroshima", "Hiroshima"), ("ICN", "Seoul", "Incheon International"),
+    ("TPE", "Taipei", "Taiwan Taoyuan International"), ("HNL", "Honolulu", "Honolulu International"),
+    ("LHR", "London", "Heathrow"), ("JFK", "New York", "John F Kennedy International"),
+    ("XQZ", "Atlantis", "Atlantis Field"), ("QQQ", None, "Nowhere Strip"),
+]
+OPERATING_AIRLINES = ["JL", "NH", "BC", "7G", "HD", "6J", "KE", "CI", "UA", "BA"]
+CODESHARE_AIRLINES = ["AA", "BA", "QF", "CX", "AY", "IB", "UA", "LH", "NZ", "SQ", "TG", "EK"]
+
+
+def fixture_start() -> datetime:
+    """
+    合成データの最初の定刻 (現在時刻の1時間前)。掲示板のページは MAIN_GRACE_MINUTES より前の便を載せないため、
+    固定の日付にするとほとんどの便が書き出されず、書き出しの計測にならない。
+    時刻は board_now() と同じく、JSTの壁時計に +00:00 を付けた形で扱う。
+    """
+    generate_flights = import_generator()
+    return generate_flights.board_now().replace(second=0, microsecond=0) - timedelta(hours=1)
+
+
+def api_timestamp(t: datetime) -> str:
+    """AviationStackと同じ形式の時刻文字列"""
+    return t.strftime("%Y-%m-%dT%H:%M:00+00:00")
+
+
+def generate_payload(count: int, seed: int = 0, start: Optional[datetime] = None) -> List[Dict[str, Any]]:
+    """
+    AviationStackの flights エンドポイントと同じ形のレコードを count 件作成する。
+    定刻は start (省略時は fixture_start()) から24時間の範囲に散らばる。
+    1便あたり0〜4件のコードシェア便、欠航・遅延・出発済み、ゲート未定などを一定の割合で含む。
+    同じ seed と start からは常に同じペイロードが得られる。
+    """
+    start = start or fixture_start()
+    rnd = random.Random(seed)
+    records: List[Dict[str, Any]] = []
+    while len(records) < count:
+        iata, city, airport = rnd.choice(DESTINATIONS)
+        scheduled_at = start + timedelta(minutes=rnd.randrange(24 * 60))
+        scheduled = api_timestamp(scheduled_at)
+
+        status = rnd.choices(["scheduled", "active", "landed", "cancelled"], weights=[80, 8, 7, 5])[0]
+        estimated = None
+        if status != "cancelled" and rnd.random() < 0.8:
+            delay = rnd.choices([0, 3, 15, 45, 120], weights=[55, 15, 15, 10, 5])[0]
+            estimated = api_timestamp(scheduled_at + timedelta(minutes=delay))
+        gate = str(rnd.randint(1, 170)) if rnd.random() < 0.75 else None
+
+        operating = f"{rnd.choice(OPERATING_AIRLINES)}{rnd.randint(1, 999)}"
+        numbers = [(operating, None)]
+        for _ in range(rnd.choices([0, 1, 2, 3, 4], weights=[40, 25, 20, 10, 5])[0]):
+            numbers.append((f"{rnd.choice(CODESHARE_AIRLINES)}{rnd.randint(1000, 9999)}", operating))
+        # APIは運航便とコードシェア便を任意の順で返す
+        rnd.shuffle(numbers)
+
+        for number, operated_by in numbers:
+            records.append({
+                "flight_date": scheduled_at.strftime("%Y-%m-%d"),
+                "flight_status": status,
+                "departure": {
+                    "airport": "Tokyo International (Haneda)", "iata": "HND", "icao": "RJTT",
+                    "scheduled": scheduled, "estimated": estimated, "gate": gate,
+                },
+                "arrival": {"airport": airport, "city": city, "iata": iata, "scheduled": scheduled},
+                "airline": {"iata": number[:2]},
+                "flight": {
+                    "number": number[2:], "iata": number,
+                    "codeshared": {"flight_iata": operated_by.lower()} if operated_by else None,
+                },
+            })
+    return records[:count]
+
+
+# --- ローカルスタブサーバー ---
+
+def tiny_png(rgb: int) -> bytes:
+    """指定した色の1x1のPNG"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    pixel = bytes([0, rgb >> 16, (rgb >> 8) & 0xFF, rgb & 0xFF])
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(pixel)) + chunk(b"IEND", b""))
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    # 複数の掲示板のページ取得とロゴの取得が同時に接続しても、listenのキューがあふれないようにする
+    # (あふれるとSYNの再送で1秒単位の待ちが入り、計測結果が大きくぶれる)
+    request_queue_size = 128
+
+
+class StubServer:
+    """
+    合成ペイロードを limit / offset でページ分割して返す AviationStack のスタブ。
+    latency 秒の遅延と、error_rate の確率での HTTP 429 を再現できる。
+    /logos/ 以下では航空会社ロゴのCDNの代わりも務める (logo_base_url)。
+
+        with StubServer(generate_payload(1000)) as stub:
+            generate_flights.BASE_URL = stub.base_url
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], latency: float = 0.0, error_rate: float = 0.0,
+                 seed: int = 0, port: int = 0):
+        self.records = records
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.logo_count = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = StubHTTPServer(("127.0.0.1", port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                stub.handle(self)
+
+        return Handler
+
+    def handle(self, request: BaseHTTPRequestHandler):
+        url = urlparse(request.path)
+        if url.path.startswith("/logos/"):
+            self.send_logo(request, url.path[len("/logos/"):])
+            return
+
+        with self._lock:
+            self.request_count += 1
+            rate_limited = self._random.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+
+        if url.path != "/v1/flights":
+            self.send(request, 404, {"error": {"code": "not_found"}})
+            return
+        if rate_limited:
+            self.send(request, 429, {"error": {"code": "rate_limit_reached", "message": "stub"}},
+                      {"Retry-After": "1"})
+            return
+
+        query = parse_qs(url.query)
+        limit = int(query.get("limit", ["100"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        page = self.records[offset:offset + limit]
+        self.send(request, 200, {
+            "pagination": {"limit": limit, "offset": offset, "count": len(page), "total": len(self.records)},
+            "data": page,
+        })
+
+    @property
+    def logo_base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/logos/"
+
+    def send_logo(self, request: BaseHTTPRequestHandler, name: str):
+        """
+        /logos/<コード>.png に、コードごとに色の違う1x1のPNGを返す (AIRLINE_LOGO_BASE_URL の代わり)。
+        ロゴが無い場合の確認用に、Zで始まるコードは404を返す。logo_count に件数を数える。
+        """
+        with self._lock:
+            self.logo_count += 1
+        code = name[:-len(".png")] if name.endswith(".png") else ""
+        if len(code) != 2 or code.startswith("Z"):
+            request.send_response(404)
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+        body = tiny_png(zlib.crc32(code.encode("ascii")) & 0xFFFFFF)
+        request.send_response(200)
+        request.send_header("Content-Type", "image/png")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    @staticmethod
+    def send(request: BaseHTTPRequestHandler, status: int, payload: Dict[str, Any],
+             headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        request.wfile.write(body)
+
+    def __enter__(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# --- 計測 ---
+
+def import_generator():
+    """起動時の引数解析やログが計測に混ざらないよう、生成スクリプトを読み込む"""
+    sys.argv = sys.argv[:1]
+    import generate_flights
+    return generate_flights
+
+
+def make_flight_fields(count: int) -> List[Dict[str, Any]]:
+    """Flightの各フィールドに相当するダミーデータを作成する"""
+    remarks = [("予定", "scheduled"), ("遅延", "delayed"), ("欠航", "cancelled")]
+    base_time = fixture_start()
+    fields = []
+    for i in range(count):
+        remark, remark_type = remarks[i % len(remarks)]
+        scheduled_at = base_time + timedelta(minutes=(i * 7) % 1440)
+        fields.append({
+            'flight_id': f"{api_timestamp(scheduled_at)}|D{i}",
+            'sort_key': scheduled_at,
+            'scheduled_time': scheduled_at.strftime("%H:%M"),
+            'changed_time': "12:34" if remark_type == "delayed" else "",
+            'destination_ja': "大阪（伊丹）",
+            'destination_en': "Osaka(ITM)",
+            'destination_zh': "大阪（伊丹）",
+            'flight_number': f"JL{100 + i % 900}",
+            'airline_code': "JL",
+            'remark': remark,
+            'remark_type': remark_type,
+            'codeshares': [f"AA{5000 + i + j}" for j in range(i % 3)],
+            'gate': str(i % 150) if i % 4 else "",
+        })
+    return fields
+
+
+def make_display_flights(count: int) -> list:
+    """generate_html_file に渡す形式のダミーフライトを、finalize_flights と同じく定刻順に並べて作成する"""
+    from generate_flights import Flight
+
+    flights = []
+    for fields in make_flight_fields(count):
+        fields = dict(fields, codeshares=tuple(sorted(fields['codeshares'])))
+        flights.append(Flight(**fields))
+    flights.sort(key=lambda flight: flight.sort_key)
+    return flights
+
+
+def html_output_bytes(directory: str) -> int:
+    """directory 以下に書き出したHTML (ページ、言語別のページ、時間帯ごとの断片) の合計バイト数"""
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(directory) for name in names if name.endswith(".html"))
+
+
+def check_output_growth(results: List[Dict[str, Any]]):
+    """
+    便数が多いほど書き出すHTMLも大きくなることを確かめる。便がページから外れて書き出されない場合
+    (合成データの時刻が過去になっているなど) は、書き出しを計測できていないため失敗にする。
+    """
+    sizes = sorted((result['flights'], result['output_bytes']) for result in results
+                   if result.get('output_bytes') is not None)
+    for (smaller, smaller_bytes), (larger, larger_bytes) in zip(sizes, sizes[1:]):
+        if larger > smaller and larger_bytes <= smaller_bytes:
+            sys.exit(f"{larger}便の出力 ({larger_bytes}バイト) が{smaller}便の出力 ({smaller_bytes}バイト) より大きくありません。"
+                     "書き出しを計測できていません。")
+
+
+def timed(results: Dict[str, float], stage: str, func, *args, **kwargs):
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    results[stage] = time.perf_counter() - start
+    return value
+
+
+def configure_generator(generate_flights, stub: StubServer, tmp_dir: str):
+    """生成スクリプトの取得先をスタブに向け、キャッシュ・計測結果・ロゴの保存先を一時ディレクトリにする"""
+    generate_flights.BASE_URL = stub.base_url
+    generate_flights.AVIATION_STACK_KEY = "benchmark"
+    generate_flights.CACHE_DIR = os.path.join(tmp_dir, "cache")
+    generate_flights.CACHE_TTL_SECONDS = 0
+    generate_flights.METRICS_DIR = os.path.join(tmp_dir, "metrics")
+    generate_flights.AIRLINE_LOGO_BASE_URL = stub.logo_base_url
+    generate_flights.LOGO_CACHE = generate_flights.LogoCache(os.path.join(tmp_dir, "logos"))
+    # 計測対象はスタブの応答なので、リクエスト枠による待ち時間は除く
+    generate_flights.API_RATE_LIMITER = generate_flights.TokenBucket(1e9, 10 ** 9)
+
+
+def measure_pipeline(count: int, seed: int, latency: float, error_rate: float) -> Dict[str, Any]:
+    """
+    スタブサーバーに対して count 件のペイロードで各段階を計測する。
+    fetch (取得+逐次集約)、finalize (確定+ソート)、render (書き出し)、
+    および fetch_and_generate_html 全体 (end_to_end) の秒数を返す。
+    end_to_end 実行時の段階別の計測結果 (PipelineMetrics) も stage_seconds / counters として含める。
+    """
+    generate_flights = import_generator()
+
+    records = generate_payload(count, seed)
+    with tempfile.TemporaryDirectory() as tmp_dir, StubServer(records, latency, error_rate, seed) as stub:
+        configure_generator(generate_flights, stub, tmp_dir)
+
+        stages: Dict[str, float] = {}
+        params = {"access_key": "benchmark", "dep_iata": "HND"}
+        flights_data = None
+        output_bytes = None
+        error = None
+        try:
+            with generate_flights.create_session() as session:
+                aggregated, _ = timed(stages, "fetch", generate_flights.fetch_all_flights, session, "flights", params)
+        except generate_flights.ApiResponseError as e:
+            # error_rateで429を返した場合。各段階の計測は行わず、end_to_end (エラーページ生成) だけを計測する
+            error = f"HTTP {e.status_code}"
+        else:
+            flights_data = timed(stages, "finalize", generate_flights.finalize_flights, aggregated)
+            timed(stages, "render", generate_flights.generate_html_file, flights_data,
+                  output_path=os.path.join(tmp_dir, "render", "index.html"))
+            output_bytes = html_output_bytes(os.path.join(tmp_dir, "render"))
+
+        requests_before = stub.request_count
+        timed(stages, "end_to_end", generate_flights.fetch_and_generate_html,
+              output_path=os.path.join(tmp_dir, "e2e", "index.html"))
+        with open(os.path.join(tmp_dir, "metrics", "hnd.json"), encoding='utf-8') as f:
+            metrics = json.load(f)
+        return {
+            'records': count,
+            'flights': len(flights_data) if flights_data is not None else None,
+            'pages': stub.request_count - requests_before,
+            'error': error,
+            'seconds': stages,
+            'output_bytes': output_bytes,
+            'stage_seconds': metrics['stage_seconds'],
+            'counters': metrics['counters'],
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+def run_in_subprocess(*args: str) -> Dict[str, Any]:
+    """ピークRSSが前の計測の影響を受けないよう、1回の計測を別プロセスで実行する"""
+    # 標準出力には生成スクリプトのログも出るため、最終行のJSONだけを読む
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *args],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_pipeline(sizes: List[int], seed: int, latency: float, error_rate: float) -> List[Dict[str, Any]]:
+    print(f"{'records':>8} {'flights':>8} {'pages':>6} {'fetch':>8} {'finalize':>9} {'render':>8} {'e2e':>8} {'peak RSS MB':>12}")
+    results = []
+    for count in sizes:
+        result = run_in_subprocess("_pipeline-one", str(count), "--seed", str(seed),
+                                   "--latency", str(latency), "--error-rate", str(error_rate))
+        seconds = result['seconds']
+        if result['error']:
+            print(f"{count:>8} {'-':>8} {result['pages']:>6} {result['error']:>27} {seconds['end_to_end']:>8.3f} "
+                  f"{result['peak_rss_kb'] / 1024:>12.1f}")
+        else:
+            print(f"{count:>8} {result['flights']:>8} {result['pages']:>6} {seconds['fetch']:>8.3f} "
+                  f"{seconds['finalize']:>9.4f} {seconds['render']:>8.3f} {seconds['end_to_end']:>8.3f} "
+                  f"{result['peak_rss_kb'] / 1024:>12.1f}")
+        # end_to_end の段階別内訳 (ワーカースレッドの合計秒数)
+        print(" " * 9 + " ".join(f"{stage}={stage_seconds:.3f}" for stage, stage_seconds in result['stage_seconds'].items()))
+        results.append(result)
+    check_output_growth(results)
+    return results
+
+
+def measure_boards(count: int, seed: int, latency: float, boards: List[str]) -> Dict[str, Any]:
+    """
+    generate_boards で指定した向きの掲示板 (HNDのみ) を1回生成し、実時間とリクエスト数を返す。
+    スタブは絞り込みのパラメータを見ないため、出発便と到着便は同じペイロードを別々に取得・集約する。
+    """
+    generate_flights = import_generator()
+
+    records = generate_payload(count, seed)
+    with tempfile.TemporaryDirectory() as tmp_dir, StubServer(records, latency, 0.0, seed) as stub:
+        configure_generator(generate_flights, stub, tmp_dir)
+        directions = [generate_flights.BOARD_DIRECTIONS[name] for name in boards]
+        # 掲示板はカレントディレクトリに書き出されるため、一時ディレクトリに移動して計測する
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        try:
+            start = time.perf_counter()
+            results = generate_flights.generate_boards(["HND"], directions=directions)
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+        return {
+            'records': count,
+            'boards': boards,
+            'flights': {name: len(flights) if flights is not None else None for (_, name), flights in results.items()},
+            'requests': stub.request_count,
+            'seconds': elapsed,
+        }
+
+
+def run_boards(sizes: List[int], seed: int, latency: float) -> List[Dict[str, Any]]:
+    print(f"{'records':>8} {'boards':>21} {'requests':>9} {'seconds':>9} {'ratio':>6}")
+    results = []
+    for count in sizes:
+        baseline = None
+        for boards in ("departures", "departures,arrivals"):
+            result = run_in_subprocess("_boards-one", str(count), "--boards", boards, "--seed", str(seed),
+                                       "--latency", str(latency))
+            baseline = baseline or result['seconds']
+            print(f"{count:>8} {boards:>21} {result['requests']:>9} {result['seconds']:>9.3f} "
+                  f"{result['seconds'] / baseline:>6.2f}")
+            results.append(result)
+    return results
+
+
+def measure_render(count: int) -> Dict[str, float]:
+    """このプロセス内で count 件の書き出しを1回計測する"""
+    generate_flights = import_generator()
+
+    flights = make_display_flights(count)
+    rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "index.html")
+        start = time.perf_counter()
+        generate_flights.generate_html_file(flights, output_path=output_path)
+        elapsed = time.perf_counter() - start
+        output_bytes = html_output_bytes(tmp_dir)
+
+    rss_after_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'flights': count,
+        'seconds': elapsed,
+        'peak_rss_growth_kb': rss_after_kb - rss_before_kb,
+        'output_bytes': output_bytes,
+    }
+
+
+def run_render(sizes: List[int]) -> List[Dict[str, Any]]:
+    print(f"{'flights':>8} {'seconds':>9} {'us/flight':>10} {'peak RSS +KB':>13} {'output KB':>10}")
+    results = []
+    for count in sizes:
+        result = run_in_subprocess("_render-one", str(count))
+        print(f"{count:>8} {result['seconds']:>9.4f} {result['seconds'] / count * 1e6:>10.2f} "
+              f"{result['peak_rss_growth_kb']:>13} {result['output_bytes'] // 1024:>10}")
+        results.append(result)
+    check_output_growth(results)
+    return results
+
+
+def legacy_dict_pipeline(fields_list: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """比較用: 集約用の辞書 → 最終リストの辞書 → sort_keyを除いた辞書 の3段コピー"""
+    aggregated = {}
+    for i, fields in enumerate(fields_list):
+        aggregated[i] = dict(fields, codeshares=set(fields['codeshares']))
+
+    final_flights_data = []
+    for flight_data in aggregated.values():
+        codeshare_list = [c for c in flight_data['codeshares'] if c != flight_data['flight_number']]
+        final_flights_data.append({
+            'sort_key': flight_data['sort_key'],
+            'scheduled_time': flight_data['scheduled_time'],
+            'changed_time': flight_data['changed_time'],
+            'destination_ja': flight_data['destination_ja'],
+            'destination_en': flight_data['destination_en'],
+            'destination_zh': flight_data['destination_zh'],
+            'flight_number': flight_data['flight_number'],
+            'airline_code': flight_data['airline_code'],
+            'remark': flight_data['remark'],
+            'remark_type': flight_data['remark_type'],
+            'codeshare_flights': ', '.join(sorted(codeshare_list)),
+            'gate': flight_data['gate'],
+        })
+    final_flights_data.sort(key=lambda x: x['sort_key'])
+    display = [{k: v for k, v in flight.items() if k != 'sort_key'} for flight in final_flights_data]
+
+    # 描画時の .split(', ') による復元
+    for flight in display:
+        sorted(f.strip() for f in flight['codeshare_flights'].split(', ') if f.strip())
+    return display
+
+
+def flight_model_pipeline(fields_list: List[Dict[str, Any]]) -> list:
+    """Flightモデル: 集約から描画まで同じオブジェクトを使う"""
+    from generate_flights import Flight, finalize_flights
+
+    aggregated = {}
+    for i, fields in enumerate(fields_list):
+        flight = Flight(**dict(fields, codeshares=()))
+        for codeshare in fields['codeshares']:
+            flight.add_codeshare(codeshare)
+        aggregated[i] = flight
+    return finalize_flights(aggregated)
+
+
+def measure_model(pipeline, fields_list: List[Dict[str, Any]]) -> Dict[str, float]:
+    """処理時間と、tracemallocで見た結果の保持メモリ・ピークメモリを計測する"""
+    start = time.perf_counter()
+    pipeline(fields_list)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = pipeline(fields_list)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {'seconds': elapsed, 'retained_bytes': retained, 'peak_bytes': peak}
+
+
+def run_model(sizes: List[int]) -> List[Dict[str, Any]]:
+    import_generator()
+
+    print(f"{'flights':>8} {'model':>7} {'seconds':>9} {'us/flight':>10} {'retained B/flight':>18} {'peak B/flight':>14}")
+    results = []
+    for count in sizes:
+        fields_list = make_flight_fields(count)
+        for name, pipeline in (("dict", legacy_dict_pipeline), ("Flight", flight_model_pipeline)):
+            result = measure_model(pipeline, fields_list)
+            print(f"{count:>8} {name:>7} {result['seconds']:>9.4f} {result['seconds'] / count * 1e6:>10.2f} "
+                  f"{result['retained_bytes'] // count:>18} {result['peak_bytes'] // count:>14}")
+            results.append(dict(result, flights=count, model=name))
+    return results
+
+
+def make_timestamp_pairs(count: int, distinct: bool) -> List[tuple]:
+    """
+    集約ループが変換する (定刻, 予定時刻) の組を作る。distinct でなければペイロードどおり
+    (コードシェアや同じ分の便で同じ文字列が繰り返される)、distinct なら全件を別の秒・別の日にずらす。
+    """
+    pairs = []
+    # 実行ごとに結果が変わらないよう、日付を固定する
+    for i, record in enumerate(generate_payload(count, start=datetime(2026, 1, 1, tzinfo=timezone.utc))):
+        scheduled, estimated = record["departure"]["scheduled"], record["departure"]["estimated"]
+        if distinct:
+            shift = timedelta(days=i // 3600, seconds=i % 3600)
+            scheduled = (datetime.fromisoformat(scheduled) + shift).isoformat()
+            if estimated:
+                estimated = (datetime.fromisoformat(estimated) + shift).isoformat()
+        pairs.append((scheduled, estimated))
+    return pairs
+
+
+def legacy_timestamp_loop(pairs: List[tuple]) -> int:
+    """比較用: 1件ごとの fromisoformat と strftime、timedeltaでの遅延判定"""
+    delayed = 0
+    for scheduled_str, estimated_str in pairs:
+        scheduled = datetime.fromisoformat(scheduled_str.replace('Z', '+00:00'))
+        scheduled.strftime('%H:%M')
+        if estimated_str:
+            estimated = datetime.fromisoformat(estimated_str.replace('Z', '+00:00'))
+            int((estimated - scheduled).total_seconds() // 60)
+            if estimated > scheduled + timedelta(minutes=5):
+                estimated.strftime('%H:%M')
+                delayed += 1
+    return delayed
+
+
+def memo_timestamp_loop(pairs: List[tuple]) -> int:
+    """メモした変換結果のエポック秒とHH:MM表示を使う (aggregate_flight_records と同じ処理)"""
+    from generate_flights import parse_api_timestamp
+
+    delayed = 0
+    for scheduled_str, estimated_str in pairs:
+        scheduled = parse_api_timestamp(scheduled_str)
+        scheduled.hhmm
+        if estimated_str:
+            estimated = parse_api_timestamp(estimated_str)
+            delay_seconds = estimated.epoch - scheduled.epoch
+            delay_seconds // 60
+            if delay_seconds > 5 * 60:
+                estimated.hhmm
+                delayed += 1
+    return delayed
+
+
+def batch_timestamp_loop(pairs: List[tuple]) -> int:
+    """NumPyで全件をまとめて変換してから、メモを引く"""
+    from generate_flights import parse_api_timestamps
+
+    parse_api_timestamps([value for pair in pairs for value in pair if value])
+    return memo_timestamp_loop(pairs)
+
+
+def run_timestamps(sizes: List[int]) -> List[Dict[str, Any]]:
+    generate_flights = import_generator()
+    # 一括変換の効果だけを見るため、件数によらずNumPyの経路を使わせる
+    generate_flights.TIMESTAMP_VECTORIZE_THRESHOLD = 1
+    loops = [("legacy", legacy_timestamp_loop), ("memo", memo_timestamp_loop)]
+    if generate_flights.numpy is not None:
+        loops.append(("numpy", batch_timestamp_loop))
+    else:
+        print("numpy がないため、一括変換 (numpy) の計測は省略します。")
+
+    print(f"{'flights':>8} {'input':>9} {'unique':>7} {'path':>7} {'seconds':>9} {'us/flight':>10} {'speedup':>8}")
+    results = []
+    for count in sizes:
+        for input_name, distinct in (("payload", False), ("distinct", True)):
+            pairs = make_timestamp_pairs(count, distinct)
+            unique = len({value for pair in pairs for value in pair if value})
+            baseline = None
+            for name, loop in loops:
+                best = None
+                for _ in range(3):
+                    # 毎回メモを空にして、1回のペイロードの処理として計測する
+                    generate_flights._TIMESTAMP_MEMO.clear()
+                    start = time.perf_counter()
+                    loop(pairs)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                baseline = baseline or best
+                print(f"{count:>8} {input_name:>9} {unique:>7} {name:>7} {best:>9.4f} {best / count * 1e6:>10.2f} "
+                      f"{baseline / best:>7.2f}x")
+                results.append({'flights': count, 'input': input_name, 'unique_timestamps': unique,
+                                'path': name, 'seconds': best, 'speedup': baseline / best})
+    return results
+
+
+def write_results(path: str, command: str, args: argparse.Namespace, results: List[Dict[str, Any]]):
+    """コミット間で比較できるよう、実行環境と一緒に結果をJSONで書き出す"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    document = {
+        'command': command,
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'options': {k: v for k, v in vars(args).items() if k not in ("command", "json")},
+        'results': results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    print(f"結果を '{path}' に書き出しました。")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    def add_payload_options(subparser):
+        subparser.add_argument("--seed", type=int, default=0)
+        subparser.add_argument("--latency", type=float, default=0.05, help="スタブの1リクエストあたりの遅延秒数")
+        subparser.add_argument("--error-rate", type=float, default=0.0, help="スタブがHTTP 429を返す確率")
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="取得〜集約〜書き出しの各段階を計測する")
+    pipeline_parser.add_argument("--sizes", type=int, nargs="+", default=PIPELINE_SIZES)
+    pipeline_parser.add_argument("--json", help="結果を書き出すJSONファイル")
+    add_payload_options(pipeline_parser)
+
+    render_parser = subparsers.add_parser("render", help="HTML書き出しの処理時間とピークRSSを計測する")
+    render_parser.add_argument("--sizes", type=int, nargs="+", default=RENDER_SIZES)
+    render_parser.add_argument("--json", help="結果を書き出すJSONファイル")
+
+    model_parser = subparsers.add_parser("model", help="辞書3段コピーとFlightモデルの時間・メモリを比較する")
+    model_parser.add_argument("--sizes", type=int, nargs="+", default=MODEL_SIZES)
+    model_parser.add_argument("--json", help="結果を書き出すJSONファイル")
+
+    boards_parser = subparsers.add_parser("boards", help="出発便のみと、出発便+到着便を同じ実行で生成した場合を比較する")
+    boards_parser.add_argument("--sizes", type=int, nargs="+", default=BOARDS_SIZES)
+    boards_parser.add_argument("--json", help="結果を書き出すJSONファイル")
+    add_payload_options(boards_parser)
+
+    timestamps_parser = subparsers.add_parser("timestamps", help="時刻の変換の従来処理・メモ・NumPyでの一括変換を比較する")
+    timestamps_parser.add_argument("--sizes", type=int, nargs="+", default=TIMESTAMP_SIZES)
+    timestamps_parser.add_argument("--json", help="結果を書き出すJSONファイル")
+
+    serve_parser = subparsers.add_parser("serve", help="スタブサーバーを起動したままにする")
+    serve_parser.add_argument("--records", type=int, default=1000)
+    serve_parser.add_argument("--port", type=int, default=8765)
+    add_payload_options(serve_parser)
+
+    pipeline_one_parser = subparsers.add_parser("_pipeline-one")
+    pipeline_one_parser.add_argument("count", type=int)
+    add_payload_options(pipeline_one_parser)
+
+    boards_one_parser = subparsers.add_parser("_boards-one")
+    boards_one_parser.add_argument("count", type=int)
+    boards_one_parser.add_argument("--boards", default="departures")
+    add_payload_options(boards_one_parser)
+
+    render_one_parser = subparsers.add_parser("_render-one")
+    render_one_parser.add_argument("count", type=int)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        with StubServer(generate_payload(args.records, args.seed), args.latency, args.error_rate,
+                        args.seed, args.port) as stub:
+            print(f"スタブサーバーを起動しました: {stub.base_url}flights ({args.records}件)")
+            print(f"ロゴ: AIRLINE_LOGO_BASE_URL={stub.logo_base_url}")
+            threading.Event().wait()
+    elif args.command == "_pipeline-one":
+        print(json.dumps(measure_pipeline(args.count, args.seed, args.latency, args.error_rate)))
+    elif args.command == "_boards-one":
+        print(json.dumps(measure_boards(args.count, args.seed, args.latency, args.boards.split(","))))
+    elif args.command == "_render-one":
+        print(json.dumps(measure_render(args.count)))
+    else:
+        if args.command == "pipeline":
+            results = run_pipeline(args.sizes, args.seed, args.latency, args.error_rate)
+        elif args.command == "render":
+            results = run_render(args.sizes)
+        elif args.command == "boards":
+            results = run_boards(args.sizes, args.seed, args.latency)
+        elif args.command == "timestamps":
+            results = run_timestamps(args.sizes)
+        else:
+            results = run_model(args.sizes)
+        if args.json:
+            write_results(args.json, args.command, args, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,45 @@
 import os
+import re
+import collections
+import time
+import gzip
+import signal
+import contextlib
+import argparse
+import functools
+import threading
+import codecs
+import hashlib
+import base64
+import tempfile
+import shutil
+import bisect
+import cProfile
+import pstats
+import sqlite3
+import asyncio
 import requests
 import json
+from concurrent.futures import ThreadPoolExecutor
+from operator import attrgetter
 from datetime import datetime, timedelta, timezone
 import traceback
-from typing import List, Dict, Any
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote, urlsplit
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, TextIO, BinaryIO
+from requests.adapters import HTTPAdapter
+
+# Brotli圧縮版 (.br) の出力は brotli パッケージがある場合のみ行う
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 大量の時刻の一括変換 (parse_api_timestamps) は numpy パッケージがある場合のみdatetime64で行う
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # --- APIキーの安全な取得 ---
 AVIATION_STACK_KEY = os.environ.get("AVIATION_STACK_KEY")
@@ -17,469 +53,3251 @@ except (ImportError, KeyError):
 # --- 設定値 ---
 BASE_URL = "http://api.aviationstack.com/v1/"
 AIRPORT_CODE = "HND"  
+# まとめて生成する空港のリスト (カンマ区切りの環境変数、またはコマンドライン引数で指定)
+AIRPORT_CODES = [c.strip().upper() for c in os.environ.get("AIRPORT_CODES", AIRPORT_CODE).split(",") if c.strip()]
 
-# 航空会社ロゴのCDNベースURLをGoogle Flightsの公開CDNに切り替え
-AIRLINE_LOGO_BASE_URL = "https://www.gstatic.com/flights/airline_logos/32px/" 
+# 空港ごとの表示名とICAOコード (未登録の空港はIATAコードのみで表示する)
+AIRPORTS = {
+    "HND": {"name": "羽田空港", "icao": "RJTT"},
+    "NRT": {"name": "成田国際空港", "icao": "RJAA"},
+    "ITM": {"name": "大阪国際空港（伊丹）", "icao": "RJOO"},
+    "KIX": {"name": "関西国際空港", "icao": "RJBB"},
+    "NGO": {"name": "中部国際空港", "icao": "RJGG"},
+    "CTS": {"name": "新千歳空港", "icao": "RJCC"},
+    "FUK": {"name": "福岡空港", "icao": "RJFF"},
+    "OKA": {"name": "那覇空港", "icao": "ROAH"},
+}
+
+# 航空会社ロゴのCDNベースURLをGoogle Flightsの公開CDNに切り替え (ローカルのスタブで確認する場合は環境変数で差し替える)
+AIRLINE_LOGO_BASE_URL = os.environ.get("AIRLINE_LOGO_BASE_URL", "https://www.gstatic.com/flights/airline_logos/32px/")
+# 取得したロゴを内容のハッシュをファイル名にして保存するディレクトリ
+LOGO_CACHE_DIR = os.environ.get("AIRLINE_LOGO_CACHE_DIR", ".cache/airline_logos")
+# 取得できなかった (404など) ロゴを再取得するまでの秒数
+LOGO_RETRY_SECONDS = 7 * 24 * 60 * 60
 
 # タイムゾーン設定
 # JST（最終更新時刻の表示にのみ使用）
 JST = timezone(timedelta(hours=9)) 
-# 出力ファイル名
+# 出力ファイル名 (AIRPORT_CODEの掲示板。その他の空港は "<iata小文字>/index.html" に出力する)
 OUTPUT_HTML_FILE = "index.html"
+# 到着便の掲示板の出力ファイル名 (その他の空港は "<iata小文字>/arrivals.html")
+ARRIVALS_HTML_FILE = "arrivals.html"
+# 生成する掲示板 (departures: 出発便, arrivals: 到着便)。同じ実行の中で並列に取得し、同じ集約処理を通す
+BOARD_NAMES = [name.strip() for name in os.environ.get("FLIGHT_BOARDS", "departures,arrivals").split(",") if name.strip()]
+# 静的ホスティング向けに .gz (および brotli があれば .br) の圧縮済みファイルも出力する
+PRECOMPRESS_OUTPUT = True
+# 圧縮は一定の大きさずつ読みながら行い、ページ全体をメモリに載せない
+PRECOMPRESS_CHUNK_BYTES = 256 * 1024
+# brotliの品質。最高品質 (11) は数MBのHTMLで秒単位かかるため、圧縮率がほぼ同じで桁違いに速い9を使う
+BROTLI_QUALITY = 9
+# 掲示板のページには今からこの分数先 (時間帯の区切りまで切り上げ) までの便だけを載せ、
+# それ以降は SHARD_WINDOW_MINUTES ごとの断片ファイルに分けて、スクロールしたときに読み込む (0にすると分割しない)
+MAIN_WINDOW_MINUTES = int(os.environ.get("FLIGHT_MAIN_WINDOW_MINUTES", "120"))
+SHARD_WINDOW_MINUTES = int(os.environ.get("FLIGHT_SHARD_WINDOW_MINUTES", "60"))
+# 分割する場合、定刻 (遅延している便は予定時刻) がこの分数より前の便はページに載せない (飛行中の到着便は残す)
+MAIN_GRACE_MINUTES = int(os.environ.get("FLIGHT_MAIN_GRACE_MINUTES", "30"))
+# 行き先を表示する言語 (index.html で切り替える順)
+BOARD_LANGUAGES = ("ja", "en", "zh")
+# 行き先を1言語だけで表示する言語別のページ (index.ja.html, index.en.html, index.zh.html) も書き出す
+LANGUAGE_PAGES = os.environ.get("FLIGHT_LANGUAGE_PAGES", "1") == "1"
+# index.html での行き先の言語の切り替え方。"cells" は各セルの文字を書き換え、
+# "tbodies" は言語ごとに組み立てた表の本体 (tbody) の表示を切り替える (セルごとの書き換えが起きない)
+LANGUAGE_ROTATION = os.environ.get("FLIGHT_LANGUAGE_ROTATION", "cells")
+
+# --- ページ取得の設定 ---
+# 1ページあたりの取得件数 (AviationStackの上限は100件)
+PAGE_LIMIT = 100
+# 1空港あたりのページを並列取得する最大ワーカー数 (コネクションプールのサイズも兼ねる)
+MAX_FETCH_WORKERS = 4
+# 全空港で共有するAPIリクエスト枠 (トークンバケット): 1秒あたりの補充数と最大バースト数
+API_RATE_PER_SECOND = float(os.environ.get("AVIATION_STACK_RATE_PER_SECOND", "5"))
+API_RATE_BURST = int(os.environ.get("AVIATION_STACK_RATE_BURST", "5"))
+# 1ページあたりの最大試行回数と、再試行時のバックオフ基準秒数 (1秒, 2秒, 4秒...)
+FETCH_MAX_ATTEMPTS = 3
+FETCH_BACKOFF_SECONDS = 1.0
+# 1リクエストあたりのタイムアウト秒数
+REQUEST_TIMEOUT = 15
+
+# --- レスポンスキャッシュの設定 ---
+# AviationStackの生レスポンスを保存するディレクトリ
+CACHE_DIR = os.environ.get("FLIGHT_CACHE_DIR", ".cache/aviationstack")
+# この秒数以内のキャッシュはAPIを呼ばずにそのまま使う
+CACHE_TTL_SECONDS = int(os.environ.get("FLIGHT_CACHE_TTL_SECONDS", "600"))
+# キャッシュ全体の上限サイズ。超えた分は古いものから削除する
+CACHE_MAX_BYTES = int(os.environ.get("FLIGHT_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# --- 逐次パースの設定 ---
+# Content-Lengthがこのバイト数未満の応答は一括でデコードし、それ以外 (不明な場合を含む) は受信しながらパースする
+STREAM_THRESHOLD_BYTES = int(os.environ.get("FLIGHT_STREAM_THRESHOLD_BYTES", str(256 * 1024)))
+# 逐次パース時に1回で読み込むバイト数
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# --- 常駐モード (--daemon) の設定 ---
+# ポーリング間隔の下限と上限 (秒)
+DAEMON_MIN_INTERVAL_SECONDS = int(os.environ.get("DAEMON_MIN_INTERVAL_SECONDS", str(5 * 60)))
+DAEMON_MAX_INTERVAL_SECONDS = int(os.environ.get("DAEMON_MAX_INTERVAL_SECONDS", str(60 * 60)))
+# この分数以内に DAEMON_BUSY_FLIGHTS 便以上が出発する場合は最短間隔でポーリングする
+DAEMON_BUSY_WINDOW_MINUTES = 30
+DAEMON_BUSY_FLIGHTS = 10
+# この分数以内に出発便が1便も無い場合 (深夜など) は最長間隔でポーリングする
+DAEMON_IDLE_WINDOW_MINUTES = 3 * 60
+# 1日 (JST) あたりのAPIリクエスト上限。残り回数から間隔の下限を決める
+DAILY_REQUEST_BUDGET = int(os.environ.get("AVIATION_STACK_DAILY_BUDGET", "300"))
+
+# --- 時刻の変換の設定 ---
+# 変換結果をメモするAPIの時刻文字列の数の上限 (定刻は分単位なので1日分で高々1440通り。上限に達したら作り直す)
+TIMESTAMP_MEMO_SIZE = 16384
+# 0より大きくNumPyがある場合、集約の前に TIMESTAMP_BATCH_RECORDS 件ずつフライトをまとめ、
+# 未変換の時刻がこの件数以上あればdatetime64で一括変換する。datetimeの生成は1件ずつ残るため、
+# 同じ時刻が繰り返される通常のペイロードではメモだけの方が速く、既定では使わない (0)
+TIMESTAMP_VECTORIZE_THRESHOLD = int(os.environ.get("FLIGHT_TIMESTAMP_VECTORIZE_THRESHOLD", "0"))
+TIMESTAMP_BATCH_RECORDS = 8192
+
+# --- 配信モード (--serve) の設定 ---
+SERVE_HOST = os.environ.get("FLIGHT_SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.environ.get("FLIGHT_SERVE_PORT", "8000"))
+# 接続待ちキューの長さ。再起動直後に数千台の画面が一斉に再接続しても取りこぼさないようにする
+SERVE_BACKLOG = 2048
+# キープアライブ中の接続で、次のリクエストを待つ上限 (秒)
+SERVE_IDLE_TIMEOUT_SECONDS = 60
+# Server-Sent Eventsで接続維持のコメントを送る間隔と、1件の送信を待つ上限 (秒)。上限を超えた画面は切断する
+SSE_KEEPALIVE_SECONDS = 30
+SSE_SEND_TIMEOUT_SECONDS = 10
+# 画面の切断後、EventSourceが再接続するまでの待ち時間 (ミリ秒)
+SSE_RETRY_MILLISECONDS = 10000
+# 配信するファイルの拡張子とContent-Type。ここに無いファイル (履歴のデータベースやスクリプトなど) は配信しない
+SERVE_CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".json": "application/json",
+    ".css": "text/css; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".txt": "text/plain; charset=utf-8",
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".ico": "image/x-icon",
+}
+
+# --- 計測の設定 ---
+# 空港ごとの段階別の所要時間と件数を "<iata小文字>.json" として書き出すディレクトリ
+METRICS_DIR = os.environ.get("FLIGHT_METRICS_DIR", ".metrics")
+# "1" の場合、Prometheus (node_exporterのtextfileコレクタ) 向けの "<iata小文字>.prom" も書き出す
+METRICS_PROMETHEUS = os.environ.get("FLIGHT_METRICS_PROMETHEUS") == "1"
+# "1" の場合、集約とHTML生成をcProfileで計測し "<iata小文字>.prof" に書き出す (オーバーヘッドが大きいため通常は無効)
+PROFILE_HOT_PATHS = os.environ.get("FLIGHT_PROFILE") == "1"
+
+# --- 履歴の設定 ---
+# 取得したフライトを蓄積するSQLiteファイル (空文字にすると保存しない)
+HISTORY_DB_FILE = os.environ.get("FLIGHT_HISTORY_DB", "flight_history.sqlite3")
+# 遅延統計ページの出力先と、集計する日数
+STATS_HTML_FILE = "stats.html"
+STATS_WINDOW_DAYS = int(os.environ.get("FLIGHT_STATS_WINDOW_DAYS", "30"))
 
 # --- 複数空港を持つ主要都市のリスト (英語名) ---
 MULTI_AIRPORT_CITIES = [
     "Tokyo"
 ]
 # --- 都市名の多言語マッピングテーブル（主要な都市のみ） ---
-CITY_MAPPING = { "Tokyo": {"ja": "東京", "en": "Tokyo", "zh": "东京"}, "Itami": {"ja": "大阪（伊丹）", "en": "Osaka(ITM)", "zh": "大阪（伊丹）"}, "Chu-Bu Centrair International": {"ja": "名古屋", "en": "Nagoya", "zh": "名古屋"}, "Chitose": {"ja": "札幌", "en": "Sapporo", "zh": "札幌"}, "Fukuoka": {"ja": "福岡", "en": "Fukuoka", "zh": "福冈"}, "Naha": {"ja": "那覇", "en": "Naha", "zh": "那霸"}, "Shanghai Pudong International": {"ja": "上海（浦東）", "en": "Shanghai(PVG)", "zh": "上海(PVG)"}, "Beijing Capital International": {"ja": "北京", "en": "Beijing", "zh": "北京"}, "Gimpo Airport": {"ja": "ソウル（金浦）", "en": "Seoul(GMP)", "zh": "首尔(GMP)"}, "Seoul": {"ja": "ソウル（仁川）", "en": "Seoul(ICN)", "zh": "首尔(ICN)"}, "Honolulu International": {"ja": "ホノルル", "en": "Honolulu", "zh": "檀香山"},"Taipei Songshan": {"ja": "台北（松山）", "en": "Taipei(TSA)", "zh": "台北(TSA)"}, "Hong Kong International": {"ja": "香港", "en": "Hong Kong", "zh": "香港"}, "Singapore Changi": {"ja": "シンガポール", "en": "Singapore", "zh": "新加坡"}, "Suvarnabhumi International": {"ja": "バンコク", "en": "Bangkok", "zh": "曼谷"}, "Kuala Lumpur": {"ja": "クアラルンプール", "en": "Kuala Lumpur", "zh": "吉隆坡"}, "Ninoy Aquino International": {"ja": "マニラ", "en": "Manila", "zh": "马尼拉"}, "Jakarta": {"ja": "ジャカルタ", "en": "Jakarta", "zh": "雅加达"}, "Sydney Kingsford Smith Airport": {"ja": "シドニー", "en": "Sydney", "zh": "悉尼"}, "Heathrow": {"ja": "ロンドン", "en": "London", "zh": "伦敦"}, "Charles De Gaulle": {"ja": "パリ", "en": "Paris(CDG)", "zh": "巴黎(CDG)"}, "Frankfurt International Airport": {"ja": "フランクフルト", "en": "Frankfurt", "zh": "法兰克福"}, "Los Angeles International": {"ja": "ロサンゼルス", "en": "Los Angeles", "zh": "洛杉矶"}, "John F Kennedy International": {"ja": "ニューヨーク(JFK)", "en": "New York(JFK)", "zh": "纽约(JFK)"}, "Kansai International": {"ja": "大阪（関西）", "en": "Osaka(KIX)", "zh": "大阪（关西）"}, "Dubai": {"ja": "ドバイ", "en": "Dubai", "zh": "迪拜"}, "Istanbul Airport": {"ja": "イスタンブール", "en": "Istanbul", "zh": "伊斯坦布尔"}, "Guam": {"ja": "グアム", "en": "Guam", "zh": "关岛"}, "Noi Bai International": {"ja": "ハノイ", "en": "Hanoi", "zh": "河内"}, "Tan Son Nhat International": {"ja": "ホーチミン", "en": "Ho Chi Minh City", "zh": "胡志明市"}, "Milano Malpensa": {"ja": "ミラノ", "en": "Milan", "zh": "米兰"}, "Rome": {"ja": "ローマ", "en": "Rome", "zh": "罗马"}, "Kagoshima": {"ja": "鹿児島", "en": "Kagoshima", "zh": "鹿儿岛"}, "Komatsu": {"ja": "小松", "en": "Komatsu", "zh": "小松"}, "Wakkanai": {"ja": "稚内", "en": "Wakkanai", "zh": "稚内"}, "Memanbetsu": {"ja": "女満別", "en": "Memanbetsu", "zh": "女满别"}, "Asahikawa": {"ja": "旭川", "en": "Asahikawa", "zh": "旭川"}, "Aomori": {"ja": "青森", "en": "Aomori", "zh": "青森"}, "Akita": {"ja": "秋田", "en": "Akita", "zh": "秋田"}, "Kobe": {"ja": "神戸", "en": "Kobe", "zh": "神户"}, "Tokushima": {"ja": "徳島", "en": "Tokushima", "zh": "德岛"}, "Dallas/Fort Worth International": {"ja": "ダラス/フォートワース", "en": "Dallas(DFW)", "zh": "德岛"}, } 
+CITY_MAPPING = { "Tokyo": {"ja": "東京", "en": "Tokyo", "zh": "东京"}, "Itami": {"ja": "大阪（伊丹）", "en": "Osaka(ITM)", "zh": "大阪（伊丹）"}, "Chu-Bu Centrair International": {"ja": "名古屋", "en": "Nagoya", "zh": "名古屋"}, "Chitose": {"ja": "札幌", "en": "Sapporo", "zh": "札幌"}, "Fukuoka": {"ja": "福岡", "en": "Fukuoka", "zh": "福冈"}, "Naha": {"ja": "那覇", "en": "Naha", "zh": "那霸"}, "Shanghai Pudong International": {"ja": "上海（浦東）", "en": "Shanghai(PVG)", "zh": "上海(PVG)"}, "Beijing Capital International": {"ja": "北京", "en": "Beijing", "zh": "北京"}, "Gimpo Airport": {"ja": "ソウル（金浦）", "en": "Seoul(GMP)", "zh": "首尔(GMP)"}, "Seoul": {"ja": "ソウル（仁川）", "en": "Seoul(ICN)", "zh": "首尔(ICN)"}, "Honolulu International": {"ja": "ホノルル", "en": "Honolulu", "zh": "檀香山"},"Taipei Songshan": {"ja": "台北（松山）", "en": "Taipei(TSA)", "zh": "台北(TSA)"}, "Hong Kong International": {"ja": "香港", "en": "Hong Kong", "zh": "香港"}, "Singapore Changi": {"ja": "シンガポール", "en": "Singapore", "zh": "新加坡"}, "Suvarnabhumi International": {"ja": "バンコク", "en": "Bangkok", "zh": "曼谷"}, "Kuala Lumpur": {"ja": "クアラルンプール", "en": "Kuala Lumpur", "zh": "吉隆坡"}, "Ninoy Aquino International": {"ja": "マニラ", "en": "Manila", "zh": "马尼拉"}, "Jakarta": {"ja": "ジャカルタ", "en": "Jakarta", "zh": "雅加达"}, "Sydney Kingsford Smith Airport": {"ja": "シドニー", "en": "Sydney", "zh": "悉尼"}, "Heathrow": {"ja": "ロンドン", "en": "London", "zh": "伦敦"}, "Charles De Gaulle": {"ja": "パリ", "en": "Paris(CDG)", "zh": "巴黎(CDG)"}, "Frankfurt International Airport": {"ja": "フランクフルト", "en": "Frankfurt", "zh": "法兰克福"}, "Los Angeles International": {"ja": "ロサンゼルス", "en": "Los Angeles", "zh": "洛杉矶"}, "John F Kennedy International": {"ja": "ニューヨーク(JFK)", "en": "New York(JFK)", "zh": "纽约(JFK)"}, "Kansai International": {"ja": "大阪（関西）", "en": "Osaka(KIX)", "zh": "大阪（关西）"}, "Dubai": {"ja": "ドバイ", "en": "Dubai", "zh": "迪拜"}, "Istanbul Airport": {"ja": "イスタンブール", "en": "Istanbul", "zh": "伊斯坦布尔"}, "Guam": {"ja": "グアム", "en": "Guam", "zh": "关岛"}, "Noi Bai International": {"ja": "ハノイ", "en": "Hanoi", "zh": "河内"}, "Tan Son Nhat International": {"ja": "ホーチミン", "en": "Ho Chi Minh City", "zh": "胡志明市"}, "Milano Malpensa": {"ja": "ミラノ", "en": "Milan", "zh": "米兰"}, "Rome": {"ja": "ローマ", "en": "Rome", "zh": "罗马"}, "Kagoshima": {"ja": "鹿児島", "en": "Kagoshima", "zh": "鹿儿岛"}, "Komatsu": {"ja": "小松", "en": "Komatsu", "zh": "小松"}, "Wakkanai": {"ja": "稚内", "en": "Wakkanai", "zh": "稚内"}, "Memanbetsu": {"ja": "女満別", "en": "Memanbetsu", "zh": "女满别"}, "Asahikawa": {"ja": "旭川", "en": "Asahikawa", "zh": "旭川"}, "Aomori": {"ja": "青森", "en": "Aomori", "zh": "青森"}, "Akita": {"ja": "秋田", "en": "Akita", "zh": "秋田"}, "Kobe": {"ja": "神戸", "en": "Kobe", "zh": "神户"}, "Tokushima": {"ja": "徳島", "en": "Tokushima", "zh": "德岛"}, "Dallas/Fort Worth International": {"ja": "ダラス/フォートワース", "en": "Dallas(DFW)", "zh": "达拉斯"}, } 
+# --- 到着空港のIATAコードをキーにした多言語名のデータファイル (初回の参照時に読み込む) ---
+AIRPORT_DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "airports.json")
 # ----------------
 
 print("--- SCRIPT STARTED SUCCESSFULLY ---")
 
-# --- HTML生成関数 ---
+# --- データモデル ---
 
-def generate_html_file(flights_data: List[Dict[str, str]]):
-    """フライトデータからHTMLコンテンツを生成し、ファイルに書き出す"""
-    
-    # 最終更新時刻はJSTで表示する
-    current_time_jst = datetime.now(JST).strftime('%Y/%m/%d %H:%M:%S JST')
-    
-    table_rows = ""
-    # ゲート情報追加によりcolspanを6に変更
-    if not flights_data:
-        table_rows = '<tr><td colspan="6" style="text-align: center; color: gray; padding: 20px;">現在、出発予定のフライト情報はありません。</td></tr>'
-    else:
-        for flight in flights_data:
-            remark_class = ""
-            if flight['remark_type'] == 'delayed':
-                remark_class = "remark-delayed"
-            elif flight['remark_type'] == 'cancelled':
-                remark_class = "remark-canceled"
-            elif flight['remark_type'] == 'active':
-                remark_class = "remark-active" 
-            
-            # CDNからロゴ画像のURLを生成 (運航会社)
-            main_logo_url = f"{AIRLINE_LOGO_BASE_URL}{flight['airline_code']}.png"
+class Flight:
+    """
+    コードシェア便をまとめた1便分の表示データ。
+    集約・ソート・HTML生成まで同じオブジェクトを使い回し、辞書のコピーを作らない。
+    destination_* は相手空港の名前で、到着便の掲示板では出発地を入れる。
+    """
+    __slots__ = (
+        'flight_id', 'sort_key', 'scheduled_time', 'changed_time',
+        'destination_ja', 'destination_en', 'destination_zh',
+        'flight_number', 'airline_code', 'codeshares',
+        'remark', 'remark_type', 'gate', 'delay_minutes',
+    )
 
-            # 変更時刻セルに適用するCSSクラス
-            changed_time_cell_class = "changed-time-cell" if flight['changed_time'] and flight['changed_time'] not in ["欠航"] else "changed-time-cell-empty"
-            
-            # すべてのコードシェア便を表示する
-            codeshare_html = ""
-            codeshare_flights = [f.strip() for f in flight['codeshare_flights'].split(', ') if f.strip()]
-            
-            for cs_flight in sorted(codeshare_flights):
-                cs_airline_code = cs_flight[:2].upper()
-                cs_logo_url = f"{AIRLINE_LOGO_BASE_URL}{cs_airline_code}.png"
-                codeshare_html += f"""
-                    <div class="codeshare-item">
-                        <img src="{cs_logo_url}" alt="{cs_airline_code} Logo" class="airline-logo codeshare-logo">
-                        <span class="codeshare-flight-number">{cs_flight}</span>
-                    </div>
-                """
-            
-            table_rows += f"""
-                <tr>
-                    <td class="time-cell">{flight['scheduled_time']}</td>
-                    <td class="{changed_time_cell_class}">
-                        {flight['changed_time']}
-                    </td>
-                    <td class="destination-cell" 
-                        data-ja="{flight['destination_ja']}"
-                        data-en="{flight['destination_en']}"
-                        data-zh="{flight['destination_zh']}">
-                        {flight['destination_ja']}
-                    </td>
-                    <td class="flight-group-cell">
-                        <div class="main-flight-item">
-                            <img src="{main_logo_url}" alt="{flight['airline_code']} Logo" class="airline-logo">
-                            <span class="main-flight-number">{flight['flight_number']}</span>
-                        </div>
-                        {codeshare_html}
-                    </td>
-                    <td class="gate-cell">
-                        {flight['gate']} 
-                    </td>
-                    <td class="remark-cell {remark_class}">
-                        {flight['remark']}
-                    </td>
-                </tr>
-            """
+    def __init__(self, sort_key: datetime, scheduled_time: str, changed_time: str,
+                 destination_ja: str, destination_en: str, destination_zh: str,
+                 flight_number: str, airline_code: str,
+                 remark: str, remark_type: str, gate: str,
+                 codeshares: Tuple[str, ...] = (), flight_id: str = "", delay_minutes: Optional[int] = None):
+        # 更新をまたいで同じ便を指す識別子 (定刻|相手空港のIATA)。差分ファイルと表の行 (data-id) で使う
+        self.flight_id = flight_id
+        self.sort_key = sort_key
+        self.scheduled_time = scheduled_time
+        self.changed_time = changed_time
+        self.destination_ja = destination_ja
+        self.destination_en = destination_en
+        self.destination_zh = destination_zh
+        self.flight_number = flight_number
+        self.airline_code = airline_code
+        # 1便あたり数件しかないため、集合ではなくタプルで保持する
+        self.codeshares = codeshares
+        self.remark = remark
+        self.remark_type = remark_type
+        self.gate = gate
+        # 予定時刻と定刻の差 (分)。予定時刻が無い便と欠航便はNone。履歴の遅延統計にだけ使い、表示には使わない
+        self.delay_minutes = delay_minutes
 
-    # HTMLテンプレート (画像デザインに合わせた白背景・黒文字デザイン)
-    html_content = f"""
+    def add_codeshare(self, flight_number: str):
+        """運航便自身と重複を除いてコードシェア便名を追加する"""
+        if flight_number != self.flight_number and flight_number not in self.codeshares:
+            self.codeshares += (flight_number,)
+
+    def finalize(self):
+        """コードシェア便名から運航便自身を除き、表示順に並べ替える"""
+        self.codeshares = tuple(sorted(c for c in self.codeshares if c != self.flight_number))
+
+
+class BoardDirection:
+    """
+    掲示板の向き (出発便/到着便)。APIの絞り込みに使うパラメータ、自空港側の時刻・ゲートを読むフィールド、
+    相手空港 (行き先/出発地) を読むフィールドと、表示の文言を持つ。集約とHTML生成はこれだけを見て両方の掲示板を扱う。
+    """
+    __slots__ = ('name', 'query_param', 'time_field', 'place_field', 'excluded_statuses',
+                 'output_file', 'title', 'heading', 'place_label', 'empty_row')
+
+    def __init__(self, name: str, query_param: str, time_field: str, place_field: str,
+                 excluded_statuses: Tuple[str, ...], output_file: str,
+                 title: str, heading: str, place_label: str, empty_message: str):
+        self.name = name
+        self.query_param = query_param
+        self.time_field = time_field
+        self.place_field = place_field
+        # 掲示板から外すステータス (出発便は出発済み以降、到着便は着陸済み)
+        self.excluded_statuses = excluded_statuses
+        self.output_file = output_file
+        self.title = title
+        self.heading = heading
+        self.place_label = place_label
+        # ゲート情報追加によりcolspanを6に変更
+        self.empty_row = f'<tr><td colspan="6" style="text-align: center; color: gray; padding: 20px;">{empty_message}</td></tr>'
+
+
+DEPARTURES = BoardDirection('departures', 'dep_iata', 'departure', 'arrival', ('active', 'landed'), OUTPUT_HTML_FILE,
+                            "出発便掲示板", "国内・国際線 出発案内", "行き先", "現在、出発予定のフライト情報はありません。")
+ARRIVALS = BoardDirection('arrivals', 'arr_iata', 'arrival', 'departure', ('landed',), ARRIVALS_HTML_FILE,
+                          "到着便掲示板", "国内・国際線 到着案内", "出発地", "現在、到着予定のフライト情報はありません。")
+BOARD_DIRECTIONS = {direction.name: direction for direction in (DEPARTURES, ARRIVALS)}
+
+
+# --- 行き先の解決 ---
+
+class DestinationResolver:
+    """
+    到着空港の多言語名を解決する。
+    IATAコードの索引 (AIRPORT_DATA_FILE) を優先し、無ければ都市名 (CITY_MAPPING) で引く。
+    索引は最初の参照時に一度だけ読み込み、同じ行き先の結果はメモ化する。
+    どちらにも無い行き先は英語名で代用し、misses に件数を記録する。
+    """
+
+    def __init__(self, data_file: str, city_mapping: Dict[str, Dict[str, str]]):
+        self.data_file = data_file
+        self.city_mapping = city_mapping
+        self.misses: collections.Counter = collections.Counter()
+        self._by_iata: Optional[Dict[str, Dict[str, str]]] = None
+        self._by_city: Optional[Dict[str, Dict[str, str]]] = None
+        self._memo: Dict[tuple, Tuple[Tuple[str, str, str], bool]] = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._by_iata is not None:
+                return
+            try:
+                with open(self.data_file, encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"空港データ '{self.data_file}' を読み込めませんでした: {e}. 都市名の対応表のみを使用します。")
+                data = {}
+            self._by_city = {**self.city_mapping, **data.get('cities', {})}
+            self._by_iata = data.get('airports', {})
+
+    def resolve(self, iata: Optional[str], city: Optional[str], airport_name: Optional[str]) -> Tuple[str, str, str]:
+        """行き先の (日本語, 英語, 中国語) 名を返す"""
+        memo_key = (iata, city, airport_name)
+        resolved = self._memo.get(memo_key)
+        if resolved is None:
+            if self._by_iata is None:
+                self._load()
+            resolved = self._resolve(iata, city, airport_name)
+            self._memo[memo_key] = resolved
+
+        names, missed = resolved
+        if missed:
+            with self._lock:
+                self.misses[f"{names[1]} ({iata or '-'})"] += 1
+        return names
+
+    def _resolve(self, iata: Optional[str], city: Optional[str], airport_name: Optional[str]) -> Tuple[Tuple[str, str, str], bool]:
+        mapped_names = self._by_iata.get(iata) if iata else None
+        if mapped_names is not None:
+            return (mapped_names['ja'], mapped_names['en'], mapped_names['zh']), False
+
+        iata_suffix = ""
+        if city:
+            base_en = city
+            if base_en in MULTI_AIRPORT_CITIES and iata and base_en not in ["Tokyo", "Osaka", "Nagoya"]:
+                iata_suffix = f" ({iata})"
+        else:
+            base_en = airport_name or 'N/A'
+
+        mapped_names = self._by_city.get(base_en.split('(')[0].strip())
+        if mapped_names is None:
+            # 翻訳が無い場合は英語名を3言語すべてに使う
+            return (base_en + iata_suffix,) * 3, True
+        return (mapped_names['ja'] + iata_suffix, mapped_names['en'] + iata_suffix, mapped_names['zh'] + iata_suffix), False
+
+    def report_misses(self):
+        """翻訳が見つからなかった行き先を件数の多い順に表示する"""
+        if not self.misses:
+            return
+        summary = ", ".join(f"{name} x{count}" for name, count in self.misses.most_common())
+        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] 翻訳が未登録の行き先 ({len(self.misses)}件): {summary}")
+        self.misses.clear()
+
+
+# 全空港・全ワーカーで共有する
+DESTINATION_RESOLVER = DestinationResolver(AIRPORT_DATA_FILE, CITY_MAPPING)
+
+
+# --- パイプラインの計測 ---
+
+class PipelineMetrics:
+    """
+    1つの掲示板 (空港と向きの組) の生成処理について、段階ごとの所要時間と件数を集計する。
+    段階は入れ子にでき、内側の段階にいる間は外側の段階の時間を数えない (各段階の秒数は排他的)。
+    ページは並列に取得するため、秒数は全スレッドの合計で、実時間は wall_seconds に記録する。
+    スレッドごとに別々に集計し、書き出すときにまとめるので、計測中はロックを取らない。
+    """
+    STAGES = ('fetch', 'decode', 'aggregate', 'sort', 'render', 'write')
+    # 0件でも出力する件数 (flights_in = flights_excluded + flights_skipped + codeshares_merged + flights_out)
+    COUNTERS = ('pages', 'api_requests', 'cache_hits', 'stale_cache_hits',
+                'flights_in', 'flights_excluded', 'flights_skipped', 'codeshares_merged', 'flights_out',
+                'boards_written', 'boards_failed', 'logos_fetched')
+
+    def __init__(self, airport_code: Optional[str] = None, enabled: bool = True, profile: bool = False,
+                 board: str = DEPARTURES.name):
+        self.airport_code = airport_code
+        self.board = board
+        self.enabled = enabled
+        self.profile = enabled and profile
+        self.started_at = time.time()
+        self.wall_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+        self._local = threading.local()
+        self._thread_states: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def _state(self) -> Dict[str, Any]:
+        state = getattr(self._local, 'state', None)
+        if state is None:
+            state = {'seconds': dict.fromkeys(self.STAGES, 0.0), 'counters': collections.Counter(),
+                     'stack': [], 'profiler': None}
+            self._local.state = state
+            with self._lock:
+                self._thread_states.append(state)
+        return state
+
+    def _enter(self, stage: str):
+        state = self._state()
+        stack = state['stack']
+        now = time.perf_counter()
+        if stack:
+            outer = stack[-1]
+            state['seconds'][outer[0]] += now - outer[1]
+        stack.append([stage, now])
+
+    def _leave(self):
+        state = self._local.state
+        stack = state['stack']
+        now = time.perf_counter()
+        stage, entered = stack.pop()
+        state['seconds'][stage] += now - entered
+        if stack:
+            stack[-1][1] = now
+
+    def stage(self, stage: str):
+        """with文の間を指定した段階の時間として数える"""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._stage(stage)
+
+    @contextlib.contextmanager
+    def _stage(self, stage: str):
+        self._enter(stage)
+        try:
+            yield
+        finally:
+            self._leave()
+
+    def timed_iter(self, stage: str, iterable: Iterable) -> Iterable:
+        """イテレータから次の要素を取り出す時間を指定した段階として数える (逐次パースや行の生成用)"""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(stage, iterable)
+
+    def _timed_iter(self, stage: str, iterable: Iterable) -> Iterator:
+        iterator = iter(iterable)
+        while True:
+            self._enter(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self._leave()
+            yield item
+
+    def count(self, name: str, n: int = 1):
+        if self.enabled and n:
+            self._state()['counters'][name] += n
+
+    def profiled(self):
+        """PROFILE_HOT_PATHS が有効な場合、with文の間をスレッドごとのcProfileで計測する"""
+        if not self.profile:
+            return contextlib.nullcontext()
+        return self._profiled()
+
+    @contextlib.contextmanager
+    def _profiled(self):
+        state = self._state()
+        if state['profiler'] is None:
+            state['profiler'] = cProfile.Profile()
+        try:
+            state['profiler'].enable()
+        except ValueError:
+            # 他のプロファイラが動いている場合 (Python 3.12以降は同時に1つまで) は計測しない
+            yield
+            return
+        try:
+            yield
+        finally:
+            state['profiler'].disable()
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self._started
+
+    @property
+    def label(self) -> str:
+        """ログと出力ファイル名に使う名前 (出発便は空港コードのみ、それ以外は "<空港コード>.<向き>")"""
+        return self.airport_code if self.board == DEPARTURES.name else f"{self.airport_code}.{self.board}"
+
+    def seconds(self) -> Dict[str, float]:
+        totals = dict.fromkeys(self.STAGES, 0.0)
+        for state in self._thread_states:
+            for stage, seconds in state['seconds'].items():
+                totals[stage] += seconds
+        return totals
+
+    def counters(self) -> Dict[str, int]:
+        totals = dict.fromkeys(self.COUNTERS, 0)
+        for state in self._thread_states:
+            for name, n in state['counters'].items():
+                totals[name] = totals.get(name, 0) + n
+        return totals
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'airport': self.airport_code,
+            'board': self.board,
+            'started_at': datetime.fromtimestamp(self.started_at, JST).strftime('%Y/%m/%d %H:%M:%S JST'),
+            'wall_seconds': self.wall_seconds,
+            'error': self.error,
+            'stage_seconds': self.seconds(),
+            'counters': self.counters(),
+        }
+
+    def to_prometheus(self) -> str:
+        """node_exporterのtextfileコレクタ向けのテキスト形式"""
+        airport = f'airport="{self.airport_code}",board="{self.board}"'
+        lines = [
+            "# HELP flight_board_stage_seconds Seconds spent in each stage of the last run, summed over worker threads.",
+            "# TYPE flight_board_stage_seconds gauge",
+        ]
+        lines += [f'flight_board_stage_seconds{{{airport},stage="{stage}"}} {seconds:.6f}'
+                  for stage, seconds in self.seconds().items()]
+        lines += [
+            "# HELP flight_board_records Record counts of the last run.",
+            "# TYPE flight_board_records gauge",
+        ]
+        lines += [f'flight_board_records{{{airport},counter="{name}"}} {value}'
+                  for name, value in self.counters().items()]
+        lines += [
+            "# HELP flight_board_run_seconds Wall-clock seconds of the last run.",
+            "# TYPE flight_board_run_seconds gauge",
+            f"flight_board_run_seconds{{{airport}}} {self.wall_seconds or 0:.6f}",
+            "# HELP flight_board_run_success Whether the last run produced a board (1) or failed with an error page or a write error (0).",
+            "# TYPE flight_board_run_success gauge",
+            f"flight_board_run_success{{{airport}}} {0 if self.error else 1}",
+            "# HELP flight_board_last_run_timestamp_seconds Unix time the last run started.",
+            "# TYPE flight_board_last_run_timestamp_seconds gauge",
+            f"flight_board_last_run_timestamp_seconds{{{airport}}} {self.started_at:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def dump_profile(self, path: str) -> bool:
+        """スレッドごとのプロファイルを1つにまとめて書き出す。計測していなければFalseを返す"""
+        profilers = [state['profiler'] for state in self._thread_states if state['profiler'] is not None]
+        if not profilers:
+            return False
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        ensure_parent_dir(path)
+        stats.dump_stats(path)
+        return True
+
+
+# 計測しない呼び出し (ベンチマークや単体での利用) の既定値
+NO_METRICS = PipelineMetrics(enabled=False)
+
+
+def write_metrics(metrics: PipelineMetrics):
+    """計測結果をMETRICS_DIRに書き出し、段階ごとの秒数をログに出す"""
+    summary = " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in metrics.seconds().items())
+    print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] {metrics.label}: 計測結果 {summary} (全体 {metrics.wall_seconds:.3f}s)")
+
+    base_path = os.path.join(METRICS_DIR, metrics.label.lower())
+    try:
+        with atomic_open(base_path + ".json") as f:
+            json.dump(metrics.to_dict(), f, ensure_ascii=False, indent=2)
+        if METRICS_PROMETHEUS:
+            with atomic_open(base_path + ".prom") as f:
+                f.write(metrics.to_prometheus())
+        if metrics.dump_profile(base_path + ".prof"):
+            print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] {metrics.label}: プロファイルを '{base_path}.prof' に書き出しました。")
+    except OSError as e:
+        print(f"計測結果の書き込みエラー: {e}")
+
+
+# --- HTMLテンプレート (画像デザインに合わせた白背景・黒文字デザイン) ---
+# 静的な部分はモジュール読み込み時に一度だけ組み立て、書き出し時はそのまま流し込む
+# ({airport_name} と {airport_codes}、掲示板の向きの文言は、空港と向きの組ごとに一度だけ置換する)
+# ({page_lang} はページごとに、そのページで最初に表示する言語に置換する)
+
+BOARD_HTML_HEAD = """
 <!DOCTYPE html>
-<html lang="ja">
+<html lang="{page_lang}">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>羽田空港 出発便掲示板</title>
+    <title>{airport_name} {board_title}</title>
     <link rel="preconnect" href="https://fonts.googleapis.com">
     <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
     <link href="https://fonts.googleapis.com/css2?family=BIZ+UDPGothic&display=swap" rel="stylesheet">
+    <link href="{logos_css}" rel="stylesheet">
     <style>
-        /* CSSの波括弧は全て二重({{, }})にしてNameErrorを回避 */
-        body {{ font-family: 'BIZ UDPGothic', 'Meiryo', 'ヒラギノ角ゴ Pro W3', sans-serif; margin: 0; background-color: #e6e6e6; color: #333; }}
-        .board-container {{ background-color: #fff; padding: 20px 30px; box-shadow: 0 4px 10px rgba(0,0,0,0.2); max-width: 1000px; margin: 30px auto; border-radius: 6px; }}
-        h1 {{ text-align: center; color: #004d99; margin-bottom: 5px; font-size: 1.8em; }}
-        h2 {{ text-align: center; color: #666; font-size: 1.1em; margin-top: 5px; margin-bottom: 25px; }}
-        table {{ width: 100%; border-collapse: collapse; margin-top: 15px; font-size: 1.1em; table-layout: fixed; }}
-        th, td {{ padding: 10px 8px; border-bottom: 1px solid #ddd; text-align: left; vertical-align: middle; }} 
-        th {{ background-color: #f0f0f0; color: #333; font-weight: bold; border-top: 2px solid #004d99; }}
-        td {{ color: #111; }}
+        /* このテンプレートはプレースホルダーを str.replace で置換するだけなので、CSSの波括弧はそのまま書ける (format には通さない) */
+        body { font-family: 'BIZ UDPGothic', 'Meiryo', 'ヒラギノ角ゴ Pro W3', sans-serif; margin: 0; background-color: #e6e6e6; color: #333; }
+        .board-container { background-color: #fff; padding: 20px 30px; box-shadow: 0 4px 10px rgba(0,0,0,0.2); max-width: 1000px; margin: 30px auto; border-radius: 6px; }
+        h1 { text-align: center; color: #004d99; margin-bottom: 5px; font-size: 1.8em; }
+        h2 { text-align: center; color: #666; font-size: 1.1em; margin-top: 5px; margin-bottom: 25px; }
+        table { width: 100%; border-collapse: collapse; margin-top: 15px; font-size: 1.1em; table-layout: fixed; }
+        th, td { padding: 10px 8px; border-bottom: 1px solid #ddd; text-align: left; vertical-align: middle; } 
+        th { background-color: #f0f0f0; color: #333; font-weight: bold; border-top: 2px solid #004d99; }
+        td { color: #111; }
         
         /* 最終行の罫線を太くする */
-        tbody tr:last-child td {{ border-bottom: 2px solid #004d99; }}
+        tbody tr:last-child td { border-bottom: 2px solid #004d99; }
 
         /* --- 列幅の調整 (6列構成) --- */
-        th:nth-child(1), td:nth-child(1) {{ width: 10%; text-align: center; font-size: 1.2em; }} /* 定刻 */
-        th:nth-child(2), td:nth-child(2) {{ width: 10%; text-align: center; font-size: 1.2em; }} /* 変更時刻 */
-        th:nth-child(3), td:nth-child(3) {{ width: 30%; }} /* 行き先 */
-        th:nth-child(4), td:nth-child(4) {{ width: 25%; }} /* 便名 (幅を広く) */
-        th:nth-child(5), td:nth-child(5) {{ width: 10%; font-size: 1.2em; text-align: center; }} /* ゲート */
-        th:nth-child(6), td:nth-child(6) {{ width: 15%; font-size: 1em; text-align: center; }} /* 備考 */
+        th:nth-child(1), td:nth-child(1) { width: 10%; text-align: center; font-size: 1.2em; } /* 定刻 */
+        th:nth-child(2), td:nth-child(2) { width: 10%; text-align: center; font-size: 1.2em; } /* 変更時刻 */
+        th:nth-child(3), td:nth-child(3) { width: 30%; } /* 行き先 */
+        th:nth-child(4), td:nth-child(4) { width: 25%; } /* 便名 (幅を広く) */
+        th:nth-child(5), td:nth-child(5) { width: 10%; font-size: 1.2em; text-align: center; } /* ゲート */
+        th:nth-child(6), td:nth-child(6) { width: 15%; font-size: 1em; text-align: center; } /* 備考 */
 
         /* --- 時刻と備考の調整 --- */
-        .time-cell {{ color: #333; font-weight: bold; }}
-        .changed-time-cell {{ color: #c00; font-weight: bold; }} /* 変更時刻は赤字 */
-        .changed-time-cell-empty {{ color: #ccc; }}
+        .time-cell { color: #333; font-weight: bold; }
+        .changed-time-cell { color: #c00; font-weight: bold; } /* 変更時刻は赤字 */
+        .changed-time-cell-empty { color: #ccc; }
         
         /* ゲート番号 */
-        .gate-cell {{ 
+        .gate-cell { 
             font-weight: bold; 
             color: #004d99; 
             text-align: center !important; 
             font-size: 1.3em; 
-        }}
+        }
         
         /* 備考欄のステータス色 */
-        .remark-delayed {{ color: #c00; font-weight: bold; }}
-        .remark-canceled {{ color: #c00; font-weight: bold; }}
-        .remark-active {{ color: #008000; font-weight: bold; }}
-        .remark-cell {{ font-weight: bold; }}
+        .remark-delayed { color: #c00; font-weight: bold; }
+        .remark-canceled { color: #c00; font-weight: bold; }
+        .remark-active { color: #008000; font-weight: bold; }
+        .remark-cell { font-weight: bold; }
         
         /* --- 便名グループ（運航便名とコードシェア便名）の整形 --- */
-        .flight-group-cell {{ 
+        .flight-group-cell { 
             display: flex; 
             flex-direction: column; 
             justify-content: center; /* 縦方向の中央揃え */
             gap: 2px; /* アイテム間の縦方向の間隔 */
-        }}
+        }
 
-        .main-flight-item, .codeshare-item {{ 
+        .main-flight-item, .codeshare-item { 
             display: flex; 
             align-items: center; 
             gap: 6px; 
             white-space: nowrap;
-        }}
+        }
         
-        .main-flight-item {{ 
+        .main-flight-item { 
             font-weight: bold; 
             color: #004d99; 
             font-size: 1em; 
-        }}
+        }
         
-        .codeshare-item {{
+        .codeshare-item {
             font-size: 0.85em; /* コードシェア便名は小さく */
             color: #777;
-        }}
+        }
 
         /* --- ロゴ --- */
-        .airline-logo {{ width: 20px; height: 20px; border-radius: 4px; object-fit: contain; flex-shrink: 0; }}
-        .codeshare-logo {{ width: 16px; height: 16px; }} /* コードシェア便のロゴはさらに小さく */
+        /* 画像は logos.css で航空会社ごとのクラス (logo-XX) に埋め込む */
+        .airline-logo { display: inline-block; width: 20px; height: 20px; border-radius: 4px; background: center / contain no-repeat; flex-shrink: 0; }
+        .codeshare-logo { width: 16px; height: 16px; } /* コードシェア便のロゴはさらに小さく */
 
         /* --- その他 --- */
-        .update-info {{ font-size: 0.85em; text-align: right; color: #777; margin-bottom: 15px; }}
+        .update-info { font-size: 0.85em; text-align: right; color: #777; margin-bottom: 15px; }
+        .shard-sentinel td { text-align: center; color: gray; padding: 20px; }
+        .stale-info { font-size: 0.85em; text-align: right; color: #c00; font-weight: bold; margin-top: -10px; margin-bottom: 15px; }
     </style>
-    <meta http-equiv="refresh" content="300"> 
 </head>
 <body>
 
 <div class="board-container">
-    <h1>国内・国際線 出発案内</h1>
-    <h2>羽田空港 (HND/RJTT)</h2>
-    <p class="update-info">最終更新日時: {current_time_jst}</p>
+    <h1>{board_heading}</h1>
+    <h2>{airport_name} ({airport_codes})</h2>
+    <p class="update-info">最終更新日時: """
+
+BOARD_HTML_TABLE_HEAD = """
 
     <table>
         <thead>
             <tr>
                 <th>定刻</th>
                 <th>変更時刻</th>
-                <th>行き先</th>
+                <th>{place_label}</th>
                 <th>便名</th>
                 <th>ゲート</th>
                 <th>備考</th>
             </tr>
         </thead>
-        <tbody>
-            {table_rows}
+        <tbody id="flight-rows" data-version="{version}" data-generated="{generated}" data-delta="{delta_url}"{lang_attribute}>
+            """
+
+# 言語ごとの表の本体を切り替えるページで、2言語目以降の本体を始める部分
+BOARD_HTML_LANGUAGE_TBODY = """
+        </tbody>
+        <tbody data-lang="{language}" hidden>
+            """
+
+BOARD_HTML_TAIL = """
         </tbody>
     </table>
 </div>
 
 <script>
     // 行き先を5秒ごとに日本語、英語、中国語で切り替えるJavaScript
+    // 言語ごとの表の本体 (tbody[data-lang]) があるページでは表示する本体を、それ以外では各セルの文字を切り替える。
+    // 1言語だけのページ (index.en.html など) では切り替えない
     const languages = ["ja", "en", "zh"];
     let currentLangIndex = 0;
-    const cells = document.querySelectorAll(".destination-cell");
+    let shownLang = languages[0];
+    const tbody = document.getElementById("flight-rows");
+    const rowGroups = Array.from(document.querySelectorAll("#flight-rows, tbody[data-lang]"));
 
-    function updateLanguage() {{
-        const currentLang = languages[currentLangIndex];
-        
-        cells.forEach(cell => {{
-            const text = cell.getAttribute(`data-${{currentLang}}`);
-            if (text) {{
+    function applyLanguage(cells) {
+        cells.forEach(cell => {
+            const text = cell.getAttribute(`data-${shownLang}`);
+            if (text) {
                 cell.textContent = text;
-            }}
-        }});
+            }
+        });
+    }
+
+    function updateLanguage() {
+        shownLang = languages[currentLangIndex];
+        if (rowGroups.length > 1) {
+            rowGroups.forEach(group => {
+                group.hidden = group.dataset.lang !== shownLang;
+            });
+        } else {
+            // 差分で差し替えた行も対象にするため、毎回セルを取り直す
+            applyLanguage(document.querySelectorAll(".destination-cell"));
+        }
         
         currentLangIndex = (currentLangIndex + 1) % languages.length;
-    }}
+    }
+
+    if (rowGroups.length > 1 || !tbody.dataset.lang) {
+        updateLanguage(); 
+        setInterval(updateLanguage, 5000); 
+    }
+
+    // 差分ファイルを60秒ごとに条件付きリクエストで確認し、変わった行だけを差し替える
+    const DELTA_POLL_MS = 60000;
+    let boardVersion = tbody.dataset.version;
+    let boardGenerated = Number(tbody.dataset.generated);
+    let deltaEtag = null;
+    let deltaLastModified = null;
+
+    function parseRow(html) {
+        const container = document.createElement("tbody");
+        container.innerHTML = html.trim();
+        return container.firstElementChild;
+    }
+
+    function applyRows(group, delta) {
+        // 言語ごとの表の本体があるページの差分では、行のHTML断片が言語ごとに分かれている
+        const rowHtml = item => typeof item.html === "string" ? item.html : item.html[group.dataset.lang];
+        const rows = new Map();
+        group.querySelectorAll("tr[data-id]").forEach(row => rows.set(row.dataset.id, row));
+
+        delta.removed.forEach(id => {
+            const row = rows.get(id);
+            if (row) {
+                row.remove();
+                rows.delete(id);
+            }
+        });
+        delta.changed.forEach(item => {
+            const row = rows.get(item.id);
+            if (row) {
+                row.replaceWith(parseRow(rowHtml(item)));
+            }
+        });
+        if (delta.added.length) {
+            // 「フライト情報はありません」の行を消してから、定刻順の位置に挿入する
+            group.querySelectorAll("tr:not([data-id]):not(.shard-sentinel)").forEach(row => row.remove());
+        }
+        const sentinel = group.querySelector(".shard-sentinel");
+        delta.added.forEach(item => {
+            const row = rows.get(item.id);
+            if (row) {
+                // 差分より新しい断片ファイルから読み込み済みの行
+                row.replaceWith(parseRow(rowHtml(item)));
+                return;
+            }
+            if (sentinel && item.t >= sentinel.dataset.t) {
+                // まだ読み込んでいない時間帯の便は、その断片を読み込むときに入る
+                return;
+            }
+            const next = Array.from(group.querySelectorAll("tr[data-id]")).find(row => row.dataset.t > item.t);
+            group.insertBefore(parseRow(rowHtml(item)), next || sentinel);
+        });
+        if (delta.empty_row) {
+            group.innerHTML = delta.empty_row;
+        }
+    }
+
+    function applyDelta(delta) {
+        rowGroups.forEach(group => applyRows(group, delta));
+        applyLanguage(tbody.querySelectorAll(".destination-cell"));
 
-    updateLanguage(); 
-    setInterval(updateLanguage, 5000); 
+        document.querySelector(".update-info").textContent = `最終更新日時: ${delta.updated_at}`;
+        const staleInfo = document.querySelector(".stale-info");
+        if (staleInfo) {
+            staleInfo.remove();
+        }
+        if (delta.stale_info) {
+            const notice = document.createElement("p");
+            notice.className = "stale-info";
+            notice.textContent = delta.stale_info;
+            document.querySelector(".update-info").after(notice);
+        }
+
+        boardVersion = delta.version;
+        boardGenerated = delta.generated;
+        tbody.dataset.version = delta.version;
+    }
+
+    async function pollDelta() {
+        const headers = {};
+        if (deltaEtag) {
+            headers["If-None-Match"] = deltaEtag;
+        }
+        if (deltaLastModified) {
+            headers["If-Modified-Since"] = deltaLastModified;
+        }
+        let response;
+        try {
+            response = await fetch(tbody.dataset.delta, { headers, cache: "no-store" });
+        } catch (e) {
+            return;
+        }
+        if (response.status === 304 || !response.ok) {
+            return;
+        }
+        deltaEtag = response.headers.get("ETag");
+        deltaLastModified = response.headers.get("Last-Modified");
+
+        handleDelta(await response.json());
+    }
+
+    function handleDelta(delta) {
+        // 古い差分 (CDNのキャッシュなど) や、すでに反映済みの差分は無視する
+        if (delta.version === boardVersion || delta.generated <= boardGenerated) {
+            return;
+        }
+        if (delta.base_version !== boardVersion) {
+            // 間の差分を取りこぼしたため、ページ全体を読み直す
+            location.reload();
+            return;
+        }
+        applyDelta(delta);
+    }
+
+    let pollTimer = setInterval(pollDelta, DELTA_POLL_MS);
+
+    // 配信モード (--serve) ではServer-Sent Eventsで差分を受け取る。
+    // 静的ホスティングなどで接続できない場合は、ポーリングを続ける
+    if (window.EventSource) {
+        const events = new EventSource(tbody.dataset.delta.replace(/\\.delta\\.json$/, ".events"));
+        events.addEventListener("open", () => {
+            clearInterval(pollTimer);
+            pollTimer = null;
+        });
+        events.addEventListener("delta", event => handleDelta(JSON.parse(event.data)));
+        events.addEventListener("error", () => {
+            if (events.readyState === EventSource.CLOSED && pollTimer === null) {
+                pollTimer = setInterval(pollDelta, DELTA_POLL_MS);
+            }
+        });
+    }
+
+    // 以降の時間帯の便は、表の最後の番兵の行が画面に近づいたときに断片ファイルから読み込む
+    const shardObserver = new IntersectionObserver(entries => {
+        entries.forEach(entry => {
+            if (entry.isIntersecting) {
+                loadShard(entry.target);
+            }
+        });
+    }, { rootMargin: "600px" });
+
+    function observeSentinel(group) {
+        const sentinel = group.querySelector(".shard-sentinel");
+        if (sentinel) {
+            shardObserver.observe(sentinel);
+        }
+    }
+
+    async function loadShard(sentinel) {
+        shardObserver.unobserve(sentinel);
+        let response;
+        try {
+            response = await fetch(sentinel.dataset.shard, { cache: "no-cache" });
+        } catch (e) {
+            setTimeout(() => shardObserver.observe(sentinel), 10000);
+            return;
+        }
+        if (!response.ok) {
+            // ページが古く、続きの時間帯がもう存在しない
+            location.reload();
+            return;
+        }
+        // 言語ごとの表の本体があるページでは、番兵のある本体にその言語の断片を読み込む
+        const group = sentinel.parentElement;
+        const container = document.createElement("tbody");
+        container.innerHTML = (await response.text()).trim();
+        // 差分で挿入済みの行は重複させない
+        const loaded = new Set(Array.from(group.querySelectorAll("tr[data-id]"), row => row.dataset.id));
+        Array.from(container.children).forEach(row => {
+            if (!row.dataset.id || !loaded.has(row.dataset.id)) {
+                sentinel.before(row);
+            }
+        });
+        sentinel.remove();
+        applyLanguage(group.querySelectorAll(".destination-cell"));
+        observeSentinel(group);
+    }
+
+    rowGroups.forEach(observeSentinel);
 </script>
 
 </body>
 </html>
 """
-    
-    try:
-        with open(OUTPUT_HTML_FILE, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] HTMLファイル '{OUTPUT_HTML_FILE}' を正常に生成しました。")
-    except Exception as e:
-        print(f"HTMLファイル生成エラー: {e}")
 
+BOARD_EMPTY_ROW = DEPARTURES.empty_row
 
-def generate_error_html(title: str, details: str):
-    """エラー発生時にエラー情報を書き込んだHTMLファイルを生成する"""
-    current_time_jst = datetime.now(JST).strftime('%Y/%m/%d %H:%M:%S JST')
-    
-    html_content = f"""
-<!DOCTYPE html>
-<html lang="ja">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>エラーが発生しました</title>
-    <style>
-        body {{ font-family: monospace; white-space: pre-wrap; margin: 20px; background-color: #fee; color: #c00; border: 1px solid #f99; padding: 20px; }}
-        pre {{ background-color: #fff; padding: 15px; border: 1px dashed #c00; overflow-x: auto; }}
-    </style>
-</head>
-<body>
-    <h1>データ取得エラー: {title}</h1>
-    <p>フライト情報の取得中に深刻なエラーが発生しました。詳細は以下のログを確認してください。</p>
-    <p>最終試行時刻: {current_time_jst}</p>
-    <h2>詳細:</h2>
-    <pre>{details}</pre>
-</body>
-</html>
-"""
-    try:
-        with open(OUTPUT_HTML_FILE, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] エラーHTMLファイル '{OUTPUT_HTML_FILE}' を生成しました。")
-    except Exception as e:
-        print(f"HTMLファイル生成エラー: {e}")
 
+# --- HTML生成関数 ---
+
+def airport_output_path(airport_code: str, direction: BoardDirection = DEPARTURES) -> str:
+    """
+    空港と向きごとの出力先パス。AIRPORT_CODEはカレントディレクトリ、それ以外は空港別のディレクトリに、
+    出発便は OUTPUT_HTML_FILE、到着便は ARRIVALS_HTML_FILE の名前で出力する。
+    """
+    if airport_code == AIRPORT_CODE:
+        return direction.output_file
+    return os.path.join(airport_code.lower(), "index.html" if direction is DEPARTURES else direction.output_file)
 
-# --- API呼び出しとデータ処理関数 ---
 
-def fetch_and_generate_html():
+def language_output_path(output_path: str, language: Optional[str]) -> str:
     """
-    AviationStack APIからデータを取得し、HTMLファイルを生成します。
+    言語別のページの出力先 (index.html なら index.en.html。言語がNoneならそのまま)。
+    言語別の行を入れる断片・差分のファイル名も、このパスから feed_path などで決まる。
     """
-    if not AVIATION_STACK_KEY:
-        print("致命的エラー: AviationStackのAPIキーが設定されていません。")
-        generate_error_html("Secrets設定エラー", "APIキーが環境変数/シークレットに設定されていません。GitHub ActionsのワークフローYAMLファイルまたはシークレット設定を確認してください。")
-        return
+    if language is None:
+        return output_path
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}.{language}{ext}"
 
-    endpoint = "flights"
-    
-    params = {
-        "access_key": AVIATION_STACK_KEY,
-        "dep_iata": AIRPORT_CODE, 
-    }
-    
-    # ログ出力はJSTを維持
-    print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] AviationStackリクエスト開始: {BASE_URL + endpoint}...")
 
-    try:
-        response = requests.get(BASE_URL + endpoint, params=params, timeout=15)
-        
-        if response.status_code == 429:
-            retry_after = response.headers.get('Retry-After', '不明な時間')
-            error_msg = f"API制限超過 (HTTP 429)。{retry_after}後に再試行してください。\n詳細: {response.text}"
-            generate_error_html("APIレート制限エラー (429)", error_msg)
-            return
-            
-        if response.status_code != 200:
-            error_details = response.text 
-            generate_error_html(f"APIエラー: HTTP {response.status_code}", error_details)
-            return
-        
-        data = response.json()
-        
-        aggregated_flights: Dict[tuple, Dict[str, Any]] = {}
+def board_pages(output_path: str) -> List[Tuple[str, List[Optional[str]]]]:
+    """
+    掲示板のページと、そのページに載せる行の言語の組。言語がNoneの行は3言語をdata属性に持ち、
+    ページ内のスクリプトがセルの文字を切り替える。LANGUAGE_ROTATION が "tbodies" の場合、
+    index.html には言語ごとの表の本体を全て載せ、表示する本体を切り替える。
+    """
+    pages = [(output_path, list(BOARD_LANGUAGES) if LANGUAGE_ROTATION == "tbodies" else [None])]
+    if LANGUAGE_PAGES:
+        pages += [(language_output_path(output_path, language), [language]) for language in BOARD_LANGUAGES]
+    return pages
 
-        for flight in data.get('data', []):
-            
-            # 出発済み（active）および着陸済み（landed）のフライトを除外する
-            status = flight['flight_status']
-            if status in ['active', 'landed']:
-                continue 
-            
-            try:
-                # 1. 識別キーの作成と時刻の処理
-                scheduled_time_str = flight['departure']['scheduled']
-                estimated_time_str = flight['departure'].get('estimated')
-                
-                # ISO 8601形式文字列をdatetimeオブジェクトに変換 (UTC時刻)
-                scheduled_datetime_utc = datetime.fromisoformat(scheduled_time_str.replace('Z', '+00:00'))
-                
-                arrival_iata = flight['arrival'].get('iata')
-                flight_key = (scheduled_time_str, arrival_iata)
 
-                # 2. 便名とコードシェアの処理
-                current_flight_number = flight['flight']['iata'].upper() 
-                is_operating_carrier = not flight['flight'].get('codeshared')
-                
-                if flight_key not in aggregated_flights:
-                    
-                    # 3. 行先情報の処理
-                    destination_iata = arrival_iata
-                    destination_city_en = flight['arrival'].get('city')
-                    
-                    iata_suffix = ""
-                    if destination_city_en:
-                        base_en = destination_city_en
-                        if base_en in MULTI_AIRPORT_CITIES and destination_iata and base_en not in ["Tokyo", "Osaka", "Nagoya"]:
-                             iata_suffix = f" ({destination_iata})"
-                    else:
-                        base_en = flight['arrival'].get('airport') or 'N/A'
-                        
-                    mapped_names = CITY_MAPPING.get(base_en.split('(')[0].strip(), {"ja": base_en, "en": base_en, "zh": base_en})
-
-                    destination_ja = mapped_names['ja'] + iata_suffix
-                    destination_en = mapped_names['en'] + iata_suffix
-                    destination_zh = mapped_names['zh'] + iata_suffix
-
-                    # 4. 定刻と変更時刻の計算 (JSTへの変換を削除し、UTC時刻をそのまま整形)
-                    
-                    # scheduled_time_jst = scheduled_datetime_utc.astimezone(JST).strftime('%H:%M') # 削除
-                    scheduled_time_utc = scheduled_datetime_utc.strftime('%H:%M') # UTC時刻をHH:MM形式に整形
+def board_row_languages(pages: List[Tuple[str, List[Optional[str]]]]) -> List[Optional[str]]:
+    """ページ全体で組み立てる行の言語 (重複なし)"""
+    return list(dict.fromkeys(language for _, languages in pages for language in languages))
 
-                    changed_time_utc = "" # 初期値は空欄
-                    
-                    # 5. ゲート情報の取得
-                    gate_number = flight['departure'].get('gate')
-                    display_gate = gate_number if gate_number else "" 
 
-                    # 6. ステータスと備考の処理 
-                    remark_display = "予定"
-                    remark_type = status
-                    
-                    if status == 'cancelled':
-                        remark_display = "欠航"
-                        remark_type = "cancelled"
-                        
-                    elif estimated_time_str:
-                        # estimated_time_strが存在する場合、UTC時刻として使用
-                        estimated_datetime_utc = datetime.fromisoformat(estimated_time_str.replace('Z', '+00:00'))
-                        
-                        # 定刻より5分以上遅れているか判定 (UTC時刻同士で比較)
-                        if estimated_datetime_utc > scheduled_datetime_utc + timedelta(minutes=5):
-                            # changed_time_jst = estimated_datetime_utc.astimezone(JST).strftime('%H:%M') # 削除
-                            changed_time_utc = estimated_datetime_utc.strftime('%H:%M') # UTC時刻をHH:MM形式に整形
-                            remark_display = "遅延"
-                            remark_type = "delayed"
-
-                    aggregated_flights[flight_key] = {
-                        'sort_key': scheduled_datetime_utc, 
-                        'flight_number': current_flight_number if is_operating_carrier else 'TBD', 
-                        'airline_code': flight['flight']['iata'][:2].upper(),
-                        'codeshares': set(), 
-                        'destination_ja': destination_ja,
-                        'destination_en': destination_en,
-                        'destination_zh': destination_zh,
-                        # UTC時刻を使用
-                        'scheduled_time': scheduled_time_utc,
-                        'changed_time': changed_time_utc, 
-                        'remark': remark_display,
-                        'remark_type': remark_type,
-                        'gate': display_gate, 
-                    }
-
-                # 既存のフライトキーの場合、コードシェア情報を追加
-                current_agg = aggregated_flights[flight_key]
-
-                # 運航会社が確定していない場合、現在の便名が運航会社であれば更新
-                if is_operating_carrier and current_agg['flight_number'] == 'TBD':
-                    current_agg['flight_number'] = current_flight_number
-                    current_agg['airline_code'] = current_flight_number[:2].upper()
-                
-                # コードシェア便名リストの収集
-                if current_flight_number != current_agg['flight_number']:
-                    current_agg['codeshares'].add(current_flight_number)
-                
+@functools.lru_cache(maxsize=None)
+def board_html_head(airport_code: str, direction: BoardDirection = DEPARTURES) -> str:
+    """空港名と向きの文言を埋め込んだHTMLの先頭部分 (空港と向きの組ごとに一度だけ組み立てる)"""
+    head = BOARD_HTML_HEAD.replace("{board_title}", direction.title).replace("{board_heading}", direction.heading)
+    airport = AIRPORTS.get(airport_code)
+    if airport is None:
+        return head.replace("{airport_name}", airport_code).replace("{airport_codes}", airport_code)
+    return (head
+            .replace("{airport_name}", airport['name'])
+            .replace("{airport_codes}", f"{airport_code}/{airport['icao']}"))
 
-            except Exception as e:
-                print(f"フライトデータの処理中にエラーが発生しました: {e}. スキップします。")
-                traceback.print_exc()
-                continue
 
-        # 6. 最終リストの作成とソート
-        final_flights_data = []
-        for flight_data in aggregated_flights.values():
-            
-            # 備考欄から削除し、codeshare_flightsキーに格納
-            codeshare_list = [
-                c for c in flight_data['codeshares'] 
-                if c != flight_data['flight_number'] # 運航便自身を除く
-            ]
-            
-            final_flights_data.append({
-                'sort_key': flight_data['sort_key'],
-                'scheduled_time': flight_data['scheduled_time'],
-                'changed_time': flight_data['changed_time'],
-                'destination_ja': flight_data['destination_ja'],
-                'destination_en': flight_data['destination_en'],
-                'destination_zh': flight_data['destination_zh'],
-                'flight_number': flight_data['flight_number'],
-                'airline_code': flight_data['airline_code'], 
-                'remark': flight_data['remark'],
-                'remark_type': flight_data['remark_type'],
-                'codeshare_flights': ', '.join(sorted(codeshare_list)), 
-                'gate': flight_data['gate'],
-            })
-
-        # 時系列でのソート（UTC時刻を使用）
-        final_flights_data.sort(key=lambda x: x['sort_key']) 
-
-        # ソートキーを削除してHTML生成関数に渡す
-        display_flights_data = [
-            {k: v for k, v in flight.items() if k != 'sort_key'}
-            for flight in final_flights_data
-        ]
-        
-        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] {len(display_flights_data)}件のフライト情報を取得しました。")
-        generate_html_file(display_flights_data)
+def ensure_parent_dir(output_path: str):
+    """出力先のディレクトリが無ければ作成する"""
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
 
-    except requests.exceptions.RequestException as e:
-        error_trace = traceback.format_exc()
-        print(f"致命的なリクエストエラーが発生しました: {e}")
-        generate_error_html("リクエスト/接続エラー", str(e) + "\n\n" + error_trace)
-        return
 
-    except Exception as e:
-        error_trace = traceback.format_exc()
-        print(f"予期せぬエラー: {e}")
-        generate_error_html("予期せぬスクリプトエラー", str(e) + "\n\n" + error_trace)
+# プロセスのumask。読み出すには一度書き換える必要があり、その間に他のスレッドが作ったファイルにも影響するため、
+# ワーカースレッドを起動する前の読み込み時に一度だけ読んでおく
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+@contextlib.contextmanager
+def atomic_open(output_path: str, mode: str = 'w'):
+    """
+    同じディレクトリの一時ファイルに書き込み、正常に閉じられた時点でリネームして置き換える。
+    書き込み途中のファイルが公開されたり、失敗時に既存のファイルが壊れたりしない。
+    """
+    ensure_parent_dir(output_path)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as f:
+            yield f
+            # mkstempは0600で作成するため、通常のファイルと同じパーミッションに揃える
+            os.fchmod(f.fileno(), 0o666 & ~UMASK)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def write_precompressed(output_path: str):
+    """
+    書き出したファイルの .gz (brotliがあれば .br も) を作成する。
+    PRECOMPRESS_CHUNK_BYTES ずつ読んで圧縮するため、ファイルの大きさによらずメモリの使用量は一定に収まる。
+    """
+    if not PRECOMPRESS_OUTPUT:
         return
+    with open(output_path, 'rb') as src, atomic_open(output_path + ".gz", 'wb') as f:
+        # mtimeを固定し、内容が同じなら圧縮結果も同じバイト列になるようにする
+        with gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=f, mtime=0) as gz:
+            shutil.copyfileobj(src, gz, PRECOMPRESS_CHUNK_BYTES)
+    if brotli is not None:
+        with open(output_path, 'rb') as src, atomic_open(output_path + ".br", 'wb') as f:
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            for chunk in iter(lambda: src.read(PRECOMPRESS_CHUNK_BYTES), b''):
+                f.write(compressor.process(chunk))
+            f.write(compressor.finish())
+
+
+def manifest_path(output_path: str) -> str:
+    return output_path + ".manifest.json"
+
+
+def feed_path(output_path: str) -> str:
+    """HTMLと同じディレクトリに置くフライト一覧のJSON (index.html なら flights.json、それ以外は <名前>.flights.json)"""
+    directory, name = os.path.split(output_path)
+    stem = os.path.splitext(name)[0]
+    return os.path.join(directory, "flights.json" if stem == "index" else f"{stem}.flights.json")
+
+
+def delta_path(output_path: str) -> str:
+    """直前のフライト一覧からの差分ファイル (flights.json に対して flights.delta.json)"""
+    return feed_path(output_path)[:-len(".json")] + ".delta.json"
+
+
+def logos_css_path(output_path: str) -> str:
+    """掲示板に載る航空会社のロゴをまとめたCSS (index.html なら logos.css、それ以外は <名前>.logos.css)"""
+    directory, name = os.path.split(output_path)
+    stem = os.path.splitext(name)[0]
+    return os.path.join(directory, "logos.css" if stem == "index" else f"{stem}.logos.css")
+
+
+def board_content_hash(flights_data: List[Flight], stale_since: Optional[float], airport_code: str,
+                       direction: BoardDirection = DEPARTURES) -> str:
+    """
+    掲示板の内容を表すハッシュ。最終更新日時は含めないため、フライトに変化が無ければ同じ値になる。
+    テンプレートも含めるので、HTML/CSSを変更した場合は再生成される。
+    ページと断片ファイルの境目は現在時刻で決まるため含めない (時刻が進んだだけでは書き直さず、
+    フライトが変わって書き直すときにその時点の境目で分け直す)。
+    言語別のページと言語の切り替え方の設定を変えた場合は書き直される。
+    """
+    digest = hashlib.sha256()
+    for template in (board_html_head(airport_code, direction), BOARD_HTML_TABLE_HEAD, BOARD_HTML_LANGUAGE_TBODY,
+                     direction.place_label, BOARD_HTML_TAIL):
+        digest.update(template.encode('utf-8'))
+    digest.update(json.dumps([stale_since, LANGUAGE_PAGES, LANGUAGE_ROTATION, BOARD_LANGUAGES]).encode('utf-8'))
+    for flight in flights_data:
+        # 表示に使わない delay_minutes は含めない (予定時刻が1分動いただけで書き換えないように)
+        digest.update(json.dumps(
+            [flight.sort_key.isoformat()] + [getattr(flight, name) for name in Flight.__slots__ if name not in ('sort_key', 'delay_minutes')],
+            ensure_ascii=False,
+        ).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def shard_window_start(t: datetime) -> datetime:
+    """tを含む時間帯 (0時からSHARD_WINDOW_MINUTESごとの区切り) の開始時刻"""
+    minutes = t.hour * 60 + t.minute
+    return t.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(minutes=minutes - minutes % SHARD_WINDOW_MINUTES)
+
+
+def main_window_end(now: datetime) -> Optional[datetime]:
+    """掲示板のページに載せる範囲の終わり (分割しない場合はNone)"""
+    if SHARD_WINDOW_MINUTES <= 0:
+        return None
+    return shard_window_start(now + timedelta(minutes=MAIN_WINDOW_MINUTES)) + timedelta(minutes=SHARD_WINDOW_MINUTES)
+
+
+def main_window_start(now: datetime) -> Optional[datetime]:
+    """掲示板のページに載せる範囲の始まり (分割しない場合はNone)"""
+    if SHARD_WINDOW_MINUTES <= 0:
+        return None
+    return now - timedelta(minutes=MAIN_GRACE_MINUTES)
+
+
+def is_pending(flight: Flight, main_from: datetime) -> bool:
+    """main_from 以降に出発 (到着) する予定か。飛行中の到着便と、予定時刻が main_from 以降の遅延便も含める"""
+    if flight.remark_type == 'active':
+        return True
+    return flight.sort_key + timedelta(minutes=max(flight.delay_minutes or 0, 0)) >= main_from
+
+
+def shard_path(output_path: str, window_start: datetime) -> str:
+    """時間帯ごとの断片ファイル (flights.json と同じ名前の付け方で flights.shard-<開始時刻>.html)"""
+    return feed_path(output_path)[:-len(".json")] + f".shard-{window_start.strftime('%Y%m%dT%H%M')}.html"
+
+
+def split_shards(flights_data: List[Flight], main_from: Optional[datetime],
+                 main_until: Optional[datetime]) -> Tuple[List[Flight], List[Tuple[datetime, List[Flight]]]]:
+    """
+    ソート済みのフライトを、ページに載せる分と時間帯ごとの断片に分ける。
+    ページには main_from 以降に出発 (到着) する予定の便から main_until より前の便までを載せる。
+    断片は main_until から最後の便までの時間帯 (便の無い時間帯も含む) についてだけ作る。
+    古いページが今回作らなかった時間帯を読み込もうとした場合は、ページ内のスクリプトがページを読み直す。
+    """
+    if main_until is None or not flights_data:
+        return flights_data, []
+    main_flights = [flight for flight in flights_data if flight.sort_key < main_until and is_pending(flight, main_from)]
+
+    window = timedelta(minutes=SHARD_WINDOW_MINUTES)
+    shards = []
+    window_start = main_until
+    index = bisect.bisect_left([flight.sort_key for flight in flights_data], main_until)
+    while index < len(flights_data):
+        window_end = window_start + window
+        start_index = index
+        while index < len(flights_data) and flights_data[index].sort_key < window_end:
+            index += 1
+        shards.append((window_start, flights_data[start_index:index]))
+        window_start = window_end
+    return main_flights, shards
+
+
+def shard_sentinel_row(output_path: str, window_start: datetime) -> str:
+    """次の時間帯を読み込むための番兵の行。ページ内のスクリプトが画面に近づいたときに差し替える"""
+    return (f'\n                <tr class="shard-sentinel" data-t="{window_start.isoformat()}" '
+            f'data-shard="{os.path.basename(shard_path(output_path, window_start))}">'
+            f'<td colspan="6">{window_start.strftime("%H:%M")}以降の便を読み込んでいます…</td></tr>\n            ')
+
+
+def write_shards(output_path: str, shards: List[Tuple[datetime, List[Flight]]], languages: List[Optional[str]] = (None,),
+                 metrics: PipelineMetrics = NO_METRICS):
+    """
+    時間帯ごとの断片ファイル (表の行と、次の時間帯の番兵) を行の言語ごとに書き出し、今回の範囲外になった古い断片
+    (使わなくなった言語の断片を含む) を削除する。各便の行は、全言語分を1回のループでまとめて組み立てる。
+    行の組み立てはページと同じくrenderの段階として計測する。
+    """
+    written = set()
+    for index, (window_start, window_flights) in enumerate(shards):
+        paths = {language: shard_path(language_output_path(output_path, language), window_start) for language in languages}
+        with contextlib.ExitStack() as stack:
+            files = {language: stack.enter_context(atomic_open(path)) for language, path in paths.items()}
+            for rows in metrics.timed_iter('render', (render_table_rows(flight, languages) for flight in window_flights)):
+                for language, row in rows.items():
+                    files[language].write(row)
+            if index + 1 < len(shards):
+                for language, f in files.items():
+                    f.write(shard_sentinel_row(language_output_path(output_path, language), shards[index + 1][0]))
+        for path in paths.values():
+            write_precompressed(path)
+            written.add(os.path.basename(path))
+
+    directory = os.path.dirname(output_path) or "."
+    prefixes = tuple(os.path.basename(feed_path(language_output_path(output_path, language)))[:-len(".json")] + ".shard-"
+                     for language in (None,) + BOARD_LANGUAGES)
+    for name in os.listdir(directory):
+        if name.startswith(prefixes) and name.split(".html")[0] + ".html" not in written:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(directory, name))
+
+
+def read_manifest(output_path: str) -> Dict[str, Any]:
+    try:
+        with open(manifest_path(output_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(output_path: str, content_hash: Optional[str], flight_count: int):
+    """出力したHTMLの内容ハッシュをサイドカーのマニフェストに記録する"""
+    with atomic_open(manifest_path(output_path)) as f:
+        json.dump({
+            'content_hash': content_hash,
+            'flights': flight_count,
+            'generated_at': datetime.now(JST).strftime('%Y/%m/%d %H:%M:%S JST'),
+        }, f, ensure_ascii=False, indent=2)
+
+
+_LOGO_CODE = re.compile(r'[A-Z0-9]{2}')
+
+
+def logo_class(airline_code: str) -> str:
+    """航空会社のロゴのCSSクラス (CSSのクラス名に使えないコードの場合は空文字で、ロゴを表示しない)"""
+    return f"logo-{airline_code}" if _LOGO_CODE.fullmatch(airline_code) else ""
+
+
+def iter_codeshare_items(codeshares: Tuple[str, ...]) -> Iterator[str]:
+    """コードシェア便1件ごとのHTML断片を順に返す (便名は並べ替え済みであること)"""
+    for cs_flight in codeshares:
+        cs_airline_code = cs_flight[:2].upper()
+        yield f"""
+                    <div class="codeshare-item">
+                        <span class="airline-logo codeshare-logo {logo_class(cs_airline_code)}" role="img" aria-label="{cs_airline_code} Logo"></span>
+                        <span class="codeshare-flight-number">{cs_flight}</span>
+                    </div>
+                """
+
+
+_DESTINATION_NAMES = {language: attrgetter(f"destination_{language}") for language in BOARD_LANGUAGES}
+
+
+def render_row_parts(flight: Flight) -> Tuple[str, str]:
+    """
+    1便分の表の行のうち、行き先のセルより前と後のHTML断片。
+    行き先以外は言語によらず同じなので、言語ごとの行を作る場合も一度だけ組み立てる。
+    """
+    remark_class = ""
+    if flight.remark_type == 'delayed':
+        remark_class = "remark-delayed"
+    elif flight.remark_type == 'cancelled':
+        remark_class = "remark-canceled"
+    elif flight.remark_type == 'active':
+        remark_class = "remark-active" 
+    
+    # 変更時刻セルに適用するCSSクラス
+    changed_time_cell_class = "changed-time-cell" if flight.changed_time and flight.changed_time not in ["欠航"] else "changed-time-cell-empty"
+    
+    # すべてのコードシェア便を表示する
+    codeshare_html = "".join(iter_codeshare_items(flight.codeshares))
+    
+    # data-id は差分の適用先、data-t は追加された行を定刻順に挿入する位置の判定に使う
+    before = f"""
+                <tr data-id="{flight.flight_id}" data-t="{flight.sort_key.isoformat()}">
+                    <td class="time-cell">{flight.scheduled_time}</td>
+                    <td class="{changed_time_cell_class}">
+                        {flight.changed_time}
+                    </td>
+                    """
+    after = f"""
+                    <td class="flight-group-cell">
+                        <div class="main-flight-item">
+                            <span class="airline-logo {logo_class(flight.airline_code)}" role="img" aria-label="{flight.airline_code} Logo"></span>
+                            <span class="main-flight-number">{flight.flight_number}</span>
+                        </div>
+                        {codeshare_html}
+                    </td>
+                    <td class="gate-cell">
+                        {flight.gate} 
+                    </td>
+                    <td class="remark-cell {remark_class}">
+                        {flight.remark}
+                    </td>
+                </tr>
+            """
+    return before, after
+
+
+def destination_cell(flight: Flight, language: Optional[str]) -> str:
+    """行き先のセル。languageがNoneの場合は3言語をdata属性に持たせ、ページ内のスクリプトで切り替える"""
+    if language is None:
+        return f"""<td class="destination-cell" 
+                        data-ja="{flight.destination_ja}"
+                        data-en="{flight.destination_en}"
+                        data-zh="{flight.destination_zh}">
+                        {flight.destination_ja}
+                    </td>"""
+    return f"""<td class="destination-cell" lang="{language}">
+                        {_DESTINATION_NAMES[language](flight)}
+                    </td>"""
+
+
+def render_table_row(flight: Flight, language: Optional[str] = None) -> str:
+    """1便分の表の行 (<tr>) のHTML断片。差分ファイルにも同じ断片を入れる"""
+    before, after = render_row_parts(flight)
+    return before + destination_cell(flight, language) + after
+
+
+def render_table_rows(flight: Flight, languages: Iterable[Optional[str]]) -> Dict[Optional[str], str]:
+    """1便分の行を言語ごとに組み立てる (行き先のセル以外の断片は共通のものを使う)"""
+    before, after = render_row_parts(flight)
+    return {language: before + destination_cell(flight, language) + after for language in languages}
+
+
+def iter_table_rows(flights_data: List[Flight], empty_row: str = BOARD_EMPTY_ROW,
+                    languages: List[Optional[str]] = (None,)) -> Iterator[Dict[Optional[str], str]]:
+    """
+    表の行 (<tr>) のHTML断片を、1便ずつ言語ごとの辞書で返すジェネレータ。
+    文字列の連結を繰り返さないため、便数に対して処理時間とメモリが線形に収まる。
+    """
+    if not flights_data:
+        yield dict.fromkeys(languages, empty_row)
+        return
+
+    for flight in flights_data:
+        yield render_table_rows(flight, languages)
+
+
+def flight_feed_row(flight: Flight) -> Dict[str, Any]:
+    """flights.json に出力する1便分のデータ"""
+    return {
+        'id': flight.flight_id,
+        'scheduled': flight.sort_key.isoformat(),
+        'scheduled_time': flight.scheduled_time,
+        'changed_time': flight.changed_time,
+        'destination': {'ja': flight.destination_ja, 'en': flight.destination_en, 'zh': flight.destination_zh},
+        'flight_number': flight.flight_number,
+        'airline_code': flight.airline_code,
+        'codeshares': list(flight.codeshares),
+        'remark': flight.remark,
+        'remark_type': flight.remark_type,
+        'gate': flight.gate,
+    }
+
+
+def format_jst(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, JST).strftime('%Y/%m/%d %H:%M:%S JST')
+
+
+def stale_notice(stale_since: float) -> str:
+    return f"※ APIからの取得に失敗したため、{format_jst(stale_since)} 時点のデータを表示しています。"
+
+
+def write_board_pages(output_path: str, flights_data: List[Flight], stale_since: Optional[float] = None,
+                      airport_code: str = AIRPORT_CODE, metrics: PipelineMetrics = NO_METRICS, version: str = "",
+                      generated_at: Optional[float] = None, next_shard: Optional[datetime] = None,
+                      direction: BoardDirection = DEPARTURES):
+    """
+    掲示板のHTMLを、board_pages の全ページ (index.html と言語別のページ) へ1回のループで順に書き出す。
+    各便の行は全言語分をまとめて組み立て、その言語の行を載せる全ページに書き込む。
+    言語ごとの表の本体を切り替えるページの2言語目以降の本体は、一時ファイルに書いてから後ろに続ける。
+    stale_sinceが指定された場合は、その時刻に取得したキャッシュを表示している旨を明示する。
+    version (内容ハッシュ) と generated_at は、ページ内のスクリプトが差分ファイルを適用できるか判定するのに使う。
+    next_shardを指定した場合は、その時間帯の断片を読み込む番兵を表の本体の最後に置く。
+    行の組み立てはrender、ファイルへの書き込みはwriteの段階として計測する。
+    """
+    if generated_at is None:
+        generated_at = time.time()
+    # 最終更新時刻はJSTで表示する
+    current_time_jst = format_jst(generated_at)
+
+    stale_info = ""
+    if stale_since is not None:
+        stale_info = f'\n    <p class="stale-info">{stale_notice(stale_since)}</p>'
+
+    pages = board_pages(output_path)
+    head = board_html_head(airport_code, direction).replace("{logos_css}", os.path.basename(logos_css_path(output_path)))
+    with contextlib.ExitStack() as stack:
+        sinks: Dict[Optional[str], List[TextIO]] = {}
+        page_files = []
+        for path, languages in pages:
+            f = stack.enter_context(atomic_open(path))
+            # ページの言語は最初に表示する行の言語 (3言語をセルで切り替えるページは日本語)
+            f.write(head.replace("{page_lang}", languages[0] or BOARD_LANGUAGES[0]))
+            f.write(f"{current_time_jst}</p>{stale_info}")
+            f.write(BOARD_HTML_TABLE_HEAD.format(version=version, generated=f"{generated_at:.3f}",
+                                                 delta_url=os.path.basename(delta_path(path)),
+                                                 lang_attribute=f' data-lang="{languages[0]}"' if languages[0] else "",
+                                                 place_label=direction.place_label))
+            sinks.setdefault(languages[0], []).append(f)
+            spools = {}
+            for language in languages[1:]:
+                # 小さいうちはメモリ上に置き、大きくなったらディスクに書く
+                spools[language] = stack.enter_context(
+                    tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024, mode='w+', encoding='utf-8'))
+                sinks.setdefault(language, []).append(spools[language])
+            page_files.append((f, languages, spools))
+
+        with metrics.profiled():
+            # 続きの時間帯がある場合、ページに載せる便が無くても「フライト情報はありません」とは表示しない
+            if flights_data or next_shard is None:
+                for rows in metrics.timed_iter('render', iter_table_rows(flights_data, direction.empty_row, list(sinks))):
+                    for language, row in rows.items():
+                        for sink in sinks[language]:
+                            sink.write(row)
+
+        for f, languages, spools in page_files:
+            for language in languages:
+                if language in spools:
+                    f.write(BOARD_HTML_LANGUAGE_TBODY.format(language=language))
+                    spools[language].seek(0)
+                    shutil.copyfileobj(spools[language], f)
+                if next_shard is not None:
+                    f.write(shard_sentinel_row(language_output_path(output_path, language), next_shard))
+            f.write(BOARD_HTML_TAIL)
+
+
+def generate_html_file(flights_data: List[Flight], stale_since: Optional[float] = None,
+                       airport_code: str = AIRPORT_CODE, output_path: Optional[str] = None,
+                       metrics: PipelineMetrics = NO_METRICS, now: Optional[datetime] = None,
+                       direction: BoardDirection = DEPARTURES) -> bool:
+    """
+    フライトデータからHTMLを生成し、行ごとにファイルへ書き出す。
+    ページには直近の便だけを載せ、それ以降は時間帯ごとの断片ファイルに書き出す (初回表示を便数によらず小さく保つ)。
+    LANGUAGE_PAGES が有効なら、行き先を1言語だけで表示する言語別のページも同じループで書き出す。
+    前回と内容が変わらない場合は書き出さない (最終更新日時だけの差分でコミットや再デプロイが起きないようにする)。
+    ファイルを書き換えた場合はTrueを返す。書き出しに失敗した場合は metrics に boards_failed とエラーを記録してFalseを返す。
+    """
+    output_path = output_path or airport_output_path(airport_code, direction)
+    try:
+        with metrics.stage('write'):
+            now = now or board_now()
+            content_hash = board_content_hash(flights_data, stale_since, airport_code, direction)
+            pages = board_pages(output_path)
+            if (all(os.path.exists(path) for path, _ in pages)
+                    and read_manifest(output_path).get('content_hash') == content_hash):
+                print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] フライト情報に変更が無いため、'{output_path}' は更新しません。")
+                return False
+
+            main_from = main_window_start(now)
+            main_flights, shards = split_shards(flights_data, main_from, main_window_end(now))
+            next_shard = shards[0][0] if shards else None
+            # 一覧と差分にもページと同じ範囲の便だけを入れる (ページが外した過去の便を差分で追加し直さないように)
+            feed_flights = flights_data if main_from is None else [flight for flight in flights_data
+                                                                   if is_pending(flight, main_from)]
+
+            generated_at = time.time()
+            # ページから参照する断片を先に書き出しておく
+            write_shards(output_path, shards, board_row_languages(pages), metrics)
+            write_board_pages(output_path, main_flights, stale_since, airport_code, metrics, content_hash, generated_at,
+                              next_shard, direction)
+            for path, _ in pages:
+                write_precompressed(path)
+            # HTMLを先に置き換えてから差分を公開する (差分を見たページが読み直したときに新しいHTMLが返るように)
+            write_feed(output_path, feed_flights, content_hash, generated_at, stale_since, airport_code, direction)
+            write_manifest(output_path, content_hash, len(flights_data))
+        metrics.count('boards_written')
+        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] HTMLファイル '{output_path}' を正常に生成しました。")
+        return True
+    except Exception as e:
+        print(f"HTMLファイル生成エラー: {e}")
+        # 変更が無く書き出さなかった場合と区別できるよう、失敗として記録する
+        metrics.count('boards_failed')
+        if metrics.enabled:
+            metrics.error = f"HTML書き出しエラー: {e}"
+        return False
+
+
+def write_feed(output_path: str, flights_data: List[Flight], content_hash: str, generated_at: float,
+               stale_since: Optional[float], airport_code: str, direction: BoardDirection = DEPARTURES):
+    """
+    flights.json (ページと断片に載せる全便のデータ) と、直前の flights.json からの差分ファイルを書き出す。
+    差分には追加・変更された行のHTML断片と、削除された行のIDを入れる (範囲外になった便は削除として扱う)。
+    差分ファイルはページごとに書き出し、行の断片はそのページの言語で組み立てる
+    (言語ごとの表の本体を切り替えるページでは、言語をキーにした辞書にする)。
+    """
+    path = feed_path(output_path)
+    try:
+        with open(path, encoding='utf-8') as f:
+            previous = json.load(f)
+        previous_rows = {row['id']: row for row in previous['flights']}
+        base_version = previous.get('version')
+    except (OSError, ValueError, KeyError, TypeError):
+        previous_rows = {}
+        base_version = None
+
+    pages = board_pages(output_path)
+    languages = board_row_languages(pages)
+    rows = [flight_feed_row(flight) for flight in flights_data]
+    added = []
+    changed = []
+    # 直前の一覧が無い場合、差分を適用できるページは無い (ページは読み直す) ため行は入れない
+    for flight, row in (zip(flights_data, rows) if base_version is not None else ()):
+        previous_row = previous_rows.pop(row['id'], None)
+        if previous_row is None:
+            added.append(({'id': row['id'], 't': row['scheduled']}, render_table_rows(flight, languages)))
+        elif previous_row != row:
+            changed.append(({'id': row['id']}, render_table_rows(flight, languages)))
+
+    with atomic_open(path) as f:
+        json.dump({
+            'version': content_hash,
+            'airport': airport_code,
+            'board': direction.name,
+            'generated': round(generated_at, 3),
+            'stale_since': stale_since,
+            'flights': rows,
+        }, f, ensure_ascii=False, separators=(',', ':'))
+    write_precompressed(path)
+
+    for page_path, page_languages in pages:
+        def with_html(item: Dict[str, Any], html: Dict[Optional[str], str]) -> Dict[str, Any]:
+            if len(page_languages) == 1:
+                return dict(item, html=html[page_languages[0]])
+            return dict(item, html={language: html[language] for language in page_languages})
+
+        with atomic_open(delta_path(page_path)) as f:
+            json.dump({
+                'version': content_hash,
+                'base_version': base_version,
+                'generated': round(generated_at, 3),
+                'updated_at': format_jst(generated_at),
+                'stale_info': stale_notice(stale_since) if stale_since is not None else None,
+                'added': [with_html(item, html) for item, html in added],
+                'changed': [with_html(item, html) for item, html in changed],
+                'removed': list(previous_rows),
+                'empty_row': direction.empty_row if not flights_data else None,
+            }, f, ensure_ascii=False, separators=(',', ':'))
+        write_precompressed(delta_path(page_path))
+
+
+def generate_error_html(title: str, details: str, output_path: str = OUTPUT_HTML_FILE):
+    """エラー発生時にエラー情報を書き込んだHTMLファイルを生成する"""
+    current_time_jst = datetime.now(JST).strftime('%Y/%m/%d %H:%M:%S JST')
+    
+    html_content = f"""
+<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>エラーが発生しました</title>
+    <style>
+        body {{ font-family: monospace; white-space: pre-wrap; margin: 20px; background-color: #fee; color: #c00; border: 1px solid #f99; padding: 20px; }}
+        pre {{ background-color: #fff; padding: 15px; border: 1px dashed #c00; overflow-x: auto; }}
+    </style>
+</head>
+<body>
+    <h1>データ取得エラー: {title}</h1>
+    <p>フライト情報の取得中に深刻なエラーが発生しました。詳細は以下のログを確認してください。</p>
+    <p>最終試行時刻: {current_time_jst}</p>
+    <h2>詳細:</h2>
+    <pre>{details}</pre>
+</body>
+</html>
+"""
+    try:
+        # 言語別のページにも同じエラーを表示する
+        for path, _ in board_pages(output_path):
+            with atomic_open(path) as f:
+                f.write(html_content)
+            write_precompressed(path)
+        # 次回の取得に成功したときに必ず掲示板を書き直すよう、内容ハッシュを消しておく
+        write_manifest(output_path, None, 0)
+        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] エラーHTMLファイル '{output_path}' を生成しました。")
+    except Exception as e:
+        print(f"HTMLファイル生成エラー: {e}")
+
+
+# --- APIの時刻の変換 ---
+
+# 0時0分からの分数をインデックスにした "HH:MM" の表示 (strftimeを使わずに引く)
+_HHMM_LABELS = tuple(f"{minutes // 60:02d}:{minutes % 60:02d}" for minutes in range(24 * 60))
+
+
+class ApiTimestamp:
+    """
+    APIの時刻文字列1つ分の変換結果。
+    moment は並べ替えと出力に使うdatetime、epoch は遅延の判定に使うエポック秒 (整数)、
+    hhmm は文字列に書かれた時刻 (UTCに変換しない壁時計) の "HH:MM" 表示。
+    """
+    __slots__ = ('moment', 'epoch', 'hhmm')
+
+    def __init__(self, moment: datetime, epoch: int, hhmm: str):
+        self.moment = moment
+        self.epoch = epoch
+        self.hhmm = hhmm
+
+
+# 全空港・全掲示板のスレッドで共有する (辞書の1回の読み書きはGILで保護される)
+_TIMESTAMP_MEMO: Dict[str, ApiTimestamp] = {}
+
+
+def _remember_timestamp(value: str, parsed: ApiTimestamp) -> ApiTimestamp:
+    if len(_TIMESTAMP_MEMO) >= TIMESTAMP_MEMO_SIZE:
+        _TIMESTAMP_MEMO.clear()
+    _TIMESTAMP_MEMO[value] = parsed
+    return parsed
+
+
+def parse_api_timestamp(value: str) -> ApiTimestamp:
+    """
+    APIのISO 8601形式の時刻を変換する。
+    同じ文字列はコードシェア便や出発便・到着便の両方の掲示板で繰り返し現れるため、
+    文字列ごとに一度だけ変換し、TIMESTAMP_MEMO_SIZE 件まで結果を使い回す。
+    """
+    parsed = _TIMESTAMP_MEMO.get(value)
+    if parsed is not None:
+        return parsed
+    moment = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if moment.tzinfo is None:
+        # オフセットの無い時刻はUTCとして扱う (表示は文字列どおりの時刻のまま)
+        moment = moment.replace(tzinfo=timezone.utc)
+    return _remember_timestamp(value, ApiTimestamp(moment, int(moment.timestamp()), _HHMM_LABELS[moment.hour * 60 + moment.minute]))
+
+
+def parse_api_timestamps(values: Iterable[str]) -> List[ApiTimestamp]:
+    """
+    複数の時刻をまとめて変換する。未変換の文字列が TIMESTAMP_VECTORIZE_THRESHOLD 件以上あり、
+    NumPyが使える場合は、エポック秒と表示の時刻をdatetime64で一括計算してからメモを引く。
+    """
+    values = values if isinstance(values, list) else list(values)
+    if numpy is not None and TIMESTAMP_VECTORIZE_THRESHOLD > 0:
+        missing = [value for value in dict.fromkeys(values) if value not in _TIMESTAMP_MEMO]
+        # メモに収まらない件数を先に変換しても、引く前に消えてしまうので1件ずつに任せる
+        if TIMESTAMP_VECTORIZE_THRESHOLD <= len(missing) <= TIMESTAMP_MEMO_SIZE - len(_TIMESTAMP_MEMO):
+            _parse_timestamps_vectorized(missing)
+    return [parse_api_timestamp(value) for value in values]
+
+
+# NumPyで一括変換する形式 (YYYY-MM-DDTHH:MM:SS±HH:MM) の区切り文字の位置
+_TIMESTAMP_SEPARATORS = {4: '-', 7: '-', 10: 'T', 13: ':', 16: ':', 22: ':'}
+
+
+def _parse_timestamps_vectorized(values: List[str]):
+    """
+    時刻の文字列のエポック秒と表示の時刻をdatetime64でまとめて計算し、メモに入れる。
+    datetime自体は1件ずつ作るしかないため、最も速い fromisoformat で作る。
+    一括変換できない形式 (秒の小数部があるものなど) はメモに入れず、parse_api_timestamp の1件ずつの変換に任せる。
+    """
+    normalized = [value.replace('Z', '+00:00') for value in values]
+    try:
+        texts = numpy.array(normalized, dtype='S25')
+    except UnicodeEncodeError:
+        return
+    chars = texts.view(numpy.uint8).reshape(len(values), 25)
+    valid = (chars[:, 19] == ord('+')) | (chars[:, 19] == ord('-'))
+    for position, separator in _TIMESTAMP_SEPARATORS.items():
+        valid &= chars[:, position] == ord(separator)
+    offset_digits = chars[:, [20, 21, 23, 24]].astype(numpy.int64) - ord('0')
+    valid &= ((offset_digits >= 0) & (offset_digits <= 9)).all(axis=1)
+    try:
+        # 文字列に書かれた時刻をUTCとみなしたエポック秒 (壁時計の秒)
+        wall = texts[valid].astype('S19').astype('datetime64[s]').astype(numpy.int64)
+    except ValueError:
+        return
+
+    offset_digits = offset_digits[valid]
+    offsets = ((offset_digits[:, 0] * 10 + offset_digits[:, 1]) * 3600 + (offset_digits[:, 2] * 10 + offset_digits[:, 3]) * 60)
+    offsets = numpy.where(chars[valid, 19] == ord('-'), -offsets, offsets)
+    epochs = wall - offsets
+    wall_minutes = (wall // 60) % (24 * 60)
+
+    valid_values = [(value, text) for value, text, ok in zip(values, normalized, valid.tolist()) if ok]
+    for (value, text), epoch, minutes in zip(valid_values, epochs.tolist(), wall_minutes.tolist()):
+        _remember_timestamp(value, ApiTimestamp(datetime.fromisoformat(text), epoch, _HHMM_LABELS[minutes]))
+
+
+def iter_timestamp_batches(flights: Iterable[Dict[str, Any]], time_field: str) -> Iterator[Dict[str, Any]]:
+    """
+    フライトを TIMESTAMP_BATCH_RECORDS 件ずつ先読みし、その定刻と予定時刻をまとめて変換してから順に返す。
+    逐次パース中のイテレータでも、先読みは最大でこの件数に収まる。
+    """
+    batch: List[Dict[str, Any]] = []
+
+    def flush() -> List[Dict[str, Any]]:
+        values = []
+        for flight in batch:
+            try:
+                times = flight[time_field]
+                values.append(times['scheduled'])
+                if times.get('estimated'):
+                    values.append(times['estimated'])
+            except (KeyError, TypeError, AttributeError):
+                # 形式の誤りは集約の側で1件ずつ報告する
+                continue
+        try:
+            parse_api_timestamps(values)
+        except (ValueError, TypeError, AttributeError):
+            pass
+        return batch
+
+    for flight in flights:
+        batch.append(flight)
+        if len(batch) >= TIMESTAMP_BATCH_RECORDS:
+            yield from flush()
+            batch = []
+    if batch:
+        yield from flush()
+
+
+# --- API呼び出しとデータ処理関数 ---
+
+class ApiResponseError(Exception):
+    """AviationStack APIが200以外のステータスを返したことを表す例外"""
+
+    def __init__(self, status_code: int, text: str, retry_after: Optional[str] = None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.text = text
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    複数スレッドで共有するトークンバケット。
+    全空港のリクエストが同じバケットからトークンを取るため、合計のリクエスト数が枠内に収まる。
+    """
+
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        # これまでに払い出したトークン数 (= 実際に送ったリクエスト数)
+        self.acquired_total = 0
+
+    def acquire(self):
+        """トークンを1つ取得する。空の場合は補充されるまで待つ"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate_per_second)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.acquired_total += 1
+                    return
+                wait_seconds = (1 - self._tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+
+
+API_RATE_LIMITER = TokenBucket(API_RATE_PER_SECOND, API_RATE_BURST)
+
+
+def create_session(pool_size: int = MAX_FETCH_WORKERS) -> requests.Session:
+    """ページの並列取得で接続を使い回すための、コネクションプール付きセッションを作成する"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# --- レスポンスキャッシュ ---
+
+def cache_key(endpoint: str, params: Dict[str, Any]) -> str:
+    """エンドポイントとパラメータ (access_keyを除く) からキャッシュキーを作成する"""
+    key_params = sorted((k, str(v)) for k, v in params.items() if k != "access_key")
+    return hashlib.sha256(json.dumps([endpoint, key_params]).encode('utf-8')).hexdigest()
+
+
+def cache_path(endpoint: str, params: Dict[str, Any]) -> str:
+    return os.path.join(CACHE_DIR, cache_key(endpoint, params) + ".json")
+
+
+def read_cache(endpoint: str, params: Dict[str, Any], max_age: Optional[float] = None,
+               metrics: PipelineMetrics = NO_METRICS,
+               direction: BoardDirection = DEPARTURES) -> Optional[Tuple[Dict[str, Any], Dict[tuple, Flight], float]]:
+    """
+    キャッシュ済みのレスポンスを逐次パースして集約し、(data以外のトップレベル, 集約結果, 取得時刻) を返す。
+    max_ageを指定した場合、それより古いキャッシュは無いものとして扱う。
+    """
+    path = cache_path(endpoint, params)
+    try:
+        fetched_at = os.path.getmtime(path)
+        if max_age is not None and time.time() - fetched_at > max_age:
+            return None
+        page_info: Dict[str, Any] = {}
+        with open(path, 'rb') as f:
+            chunks = iter(lambda: f.read(STREAM_CHUNK_BYTES), b"")
+            aggregated_flights = aggregate_flights(iter_page_flights(chunks, page_info), metrics, direction)
+        return page_info, aggregated_flights, fetched_at
+    except (OSError, ValueError):
+        return None
+
+
+def open_cache_entry() -> Tuple[BinaryIO, str]:
+    """キャッシュ書き込み用の一時ファイルを開き、ファイルとそのパスを返す"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+    return os.fdopen(fd, 'wb'), tmp_path
+
+
+def commit_cache_entry(tmp_path: str, endpoint: str, params: Dict[str, Any]):
+    """書き終えた一時ファイルをキャッシュとして確定し、上限サイズを超えた分を削除する"""
+    os.replace(tmp_path, cache_path(endpoint, params))
+    evict_cache()
+
+
+def discard_cache_entry(tmp_path: str):
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+
+
+def write_cache(endpoint: str, params: Dict[str, Any], body: bytes):
+    """レスポンス本文を一時ファイル経由でキャッシュに保存する"""
+    try:
+        f, tmp_path = open_cache_entry()
+        with f:
+            f.write(body)
+        commit_cache_entry(tmp_path, endpoint, params)
+    except OSError as e:
+        print(f"キャッシュ書き込みエラー: {e}")
+
+
+def evict_cache():
+    """キャッシュの合計サイズがCACHE_MAX_BYTESに収まるまで、古いエントリから削除する"""
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            stat = os.stat(os.path.join(CACHE_DIR, name))
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total_size <= CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+        except OSError:
+            pass
+        total_size -= size
+
+
+# --- 航空会社ロゴ ---
+
+class LogoCache:
+    """
+    航空会社ロゴの内容アドレス方式のキャッシュ。
+    画像は内容のSHA-256をファイル名にして保存し、航空会社コードとの対応を index.json に記録する。
+    一度取得したロゴは再取得せず、取得できなかったコードは LOGO_RETRY_SECONDS の間は再試行しない。
+    複数の掲示板のスレッドから使えるよう、索引の読み書きはロックで保護する。
+    同じロゴを別の掲示板が取得中の場合は、重ねて取得せずにその完了を待つ。
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._index: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = threading.Lock()
+        # 取得中の航空会社コードと、取得 (と索引の更新) が終わったときにセットするイベント
+        self._inflight: Dict[str, threading.Event] = {}
+
+    def _index_path(self) -> str:
+        return os.path.join(self.cache_dir, "index.json")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest)
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        if self._index is None:
+            try:
+                with open(self._index_path(), encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _needs_fetch(self, entry: Optional[Dict[str, Any]], now: float) -> bool:
+        if entry is None:
+            return True
+        if entry.get('sha256'):
+            return not os.path.exists(self._blob_path(entry['sha256']))
+        return now - entry.get('checked_at', 0) > LOGO_RETRY_SECONDS
+
+    def fetch_logo(self, session: requests.Session, airline_code: str) -> Optional[Dict[str, Any]]:
+        """
+        ロゴを1件取得してキャッシュに保存し、索引の項目を返す。
+        ロゴが無い場合は画像の無い項目を返し、通信エラーの場合は次回に再試行するためNoneを返す。
+        """
+        try:
+            response = session.get(f"{AIRLINE_LOGO_BASE_URL}{airline_code}.png", timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            print(f"ロゴ取得エラー ({airline_code}): {e}")
+            return None
+        content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+        if response.status_code != 200 or not content_type.startswith('image/'):
+            return {'sha256': None, 'checked_at': time.time()}
+
+        digest = hashlib.sha256(response.content).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            with atomic_open(path, 'wb') as f:
+                f.write(response.content)
+        return {'sha256': digest, 'type': content_type, 'checked_at': time.time()}
+
+    def ensure(self, airline_codes: Iterable[str], session: requests.Session) -> Tuple[Dict[str, Tuple[str, bytes]], int]:
+        """
+        指定した航空会社のうちキャッシュに無いロゴを並列に取得し、
+        ({コード: (MIMEタイプ, 画像)}, 新たに取得を試みた件数) を返す。ロゴが無いコードは結果に含めない。
+        """
+        now = time.time()
+        with self._lock:
+            index = self._load_index()
+            missing = []
+            pending = []
+            for code in sorted(airline_codes):
+                if code in self._inflight:
+                    pending.append(self._inflight[code])
+                elif self._needs_fetch(index.get(code), now):
+                    self._inflight[code] = threading.Event()
+                    missing.append(code)
+
+        if missing:
+            try:
+                with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+                    entries = list(executor.map(lambda code: self.fetch_logo(session, code), missing))
+                with self._lock:
+                    index = self._load_index()
+                    index.update({code: entry for code, entry in zip(missing, entries) if entry is not None})
+                    with atomic_open(self._index_path()) as f:
+                        json.dump(index, f, indent=2, sort_keys=True)
+            finally:
+                with self._lock:
+                    for code in missing:
+                        self._inflight.pop(code).set()
+        for event in pending:
+            event.wait()
+
+        logos = {}
+        with self._lock:
+            entries = {code: self._load_index().get(code) for code in airline_codes}
+        for code, entry in entries.items():
+            if entry and entry.get('sha256'):
+                try:
+                    with open(self._blob_path(entry['sha256']), 'rb') as f:
+                        logos[code] = (entry['type'], f.read())
+                except OSError:
+                    continue
+        return logos, len(missing)
+
+
+LOGO_CACHE = LogoCache(LOGO_CACHE_DIR)
+
+
+def board_airline_codes(flights_data: List[Flight]) -> set:
+    """掲示板に表示する (運航便とコードシェア便の) 航空会社コード"""
+    codes = set()
+    for flight in flights_data:
+        codes.add(flight.airline_code)
+        codes.update(codeshare[:2].upper() for codeshare in flight.codeshares)
+    return {code for code in codes if logo_class(code)}
+
+
+def write_logo_css(path: str, airline_codes: Iterable[str], logos: Dict[str, Tuple[str, bytes]]) -> bool:
+    """
+    航空会社ごとのクラスにロゴをdata URIで埋め込んだCSSを書き出す (ページが読み込む画像は、このCSS 1つになる)。
+    キャッシュに無いロゴはCDNのURLを指定する。内容が変わらない場合は書き出さず、Falseを返す。
+    """
+    rules = []
+    for code in sorted(airline_codes):
+        if code in logos:
+            content_type, image = logos[code]
+            url = f"data:{content_type};base64,{base64.b64encode(image).decode('ascii')}"
+        else:
+            url = f"{AIRLINE_LOGO_BASE_URL}{code}.png"
+        rules.append(f'.{logo_class(code)} {{ background-image: url("{url}"); }}\n')
+    css = "".join(rules)
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            if f.read() == css:
+                return False
+    except OSError:
+        pass
+    with atomic_open(path) as f:
+        f.write(css)
+    write_precompressed(path)
+    return True
+
+
+def build_logo_assets(flights_data: List[Flight], output_path: str, session: requests.Session,
+                      metrics: PipelineMetrics = NO_METRICS):
+    """掲示板に載る航空会社のロゴを取得し、掲示板と同じディレクトリのCSSにまとめる。失敗しても掲示板の生成は続ける"""
+    airline_codes = board_airline_codes(flights_data)
+    try:
+        with metrics.stage('fetch'):
+            logos, attempted = LOGO_CACHE.ensure(airline_codes, session)
+        metrics.count('logos_fetched', attempted)
+        with metrics.stage('write'):
+            write_logo_css(logos_css_path(output_path), airline_codes, logos)
+    except OSError as e:
+        print(f"ロゴの書き出しエラー: {e}")
+
+
+# --- レスポンスの逐次パース ---
+
+_JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_JSON_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+
+def iter_page_flights(chunks: Iterable[bytes], page_info: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    レスポンス本文をチャンク単位で受け取り、data配列の要素を完成した順に1件ずつ返す。
+    data以外のトップレベルのキー (paginationなど) は page_info に格納する。
+    バッファには未処理の部分しか残さないため、メモリ使用量はチャンク1つとフライト1件分に収まる。
+    json.loads が受け付けないオブジェクト (区切りの ',' が無い、途中で切れているなど) はValueErrorにする。
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunk_iter = iter(chunks)
+    buffer = ""
+    pos = 0
+
+    def read_more() -> bool:
+        """次のチャンクをバッファに追加する。処理済みの部分はここで捨てる"""
+        nonlocal buffer, pos
+        chunk = next(chunk_iter, None)
+        if chunk is None:
+            # 途中で切れたUTF-8の文字が残っていればここでUnicodeDecodeErrorになる
+            text_decoder.decode(b'', final=True)
+            return False
+        buffer = buffer[pos:] + text_decoder.decode(chunk)
+        pos = 0
+        return True
+
+    def peek() -> str:
+        """空白を読み飛ばし、次の文字を返す (終端なら空文字)"""
+        nonlocal pos
+        while True:
+            pos = _JSON_WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read_more():
+                return ""
+
+    def decode_value() -> Any:
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not read_more():
+                    raise
+                continue
+            # 数値はチャンク境界で途切れていても先頭部分だけで解釈できてしまうため ("1." を 1 とするなど)、
+            # 数値の続きになり得る文字がバッファの終わりまで続く場合は、後続の文字が届くまで確定しない
+            if _JSON_NUMBER_TAIL.match(buffer, end).end() == len(buffer) and read_more():
+                continue
+            pos = end
+            return value
+
+    def expect(char: str):
+        nonlocal pos
+        if peek() != char:
+            raise ValueError(f"JSONの解析に失敗しました: '{char}' が必要です (位置 {pos})")
+        pos += 1
+
+    def expect_separator(closing: str) -> bool:
+        """要素の後の ',' か閉じ括弧を読む。閉じ括弧ならTrueを返す"""
+        nonlocal pos
+        char = peek()
+        if char not in (",", closing):
+            raise ValueError(f"JSONの解析に失敗しました: ',' か '{closing}' が必要です (位置 {pos})")
+        pos += 1
+        return char == closing
+
+    expect("{")
+    if peek() == "}":
+        pos += 1
+    else:
+        while True:
+            if peek() != '"':
+                raise ValueError(f"JSONの解析に失敗しました: キーの文字列が必要です (位置 {pos})")
+            key = decode_value()
+            expect(":")
+            if key != 'data' or peek() != "[":
+                page_info[key] = decode_value()
+            else:
+                pos += 1
+                if peek() == "]":
+                    pos += 1
+                else:
+                    while True:
+                        if peek() == "":
+                            raise ValueError("JSONの解析に失敗しました: data配列が途中で終わっています")
+                        yield decode_value()
+                        if expect_separator("]"):
+                            break
+            if expect_separator("}"):
+                break
+    if peek() != "":
+        raise ValueError(f"JSONの解析に失敗しました: 末尾に余分なデータがあります (位置 {pos})")
+
+
+def read_page_response(response: requests.Response, endpoint: str, page_params: Dict[str, Any],
+                       metrics: PipelineMetrics = NO_METRICS,
+                       direction: BoardDirection = DEPARTURES) -> Tuple[Dict[str, Any], Dict[tuple, Flight]]:
+    """
+    200応答の本文を集約し、(data以外のトップレベル, 集約結果) を返す。
+    STREAM_THRESHOLD_BYTES 未満の小さな応答は従来どおり一括でデコードし、
+    それ以外はダウンロードしながら逐次パースして、届いたフライトから集約していく。
+    """
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None and int(content_length) < STREAM_THRESHOLD_BYTES:
+        # 本文の受信はfetch、JSONのデコードはdecodeとして分けて計測する
+        response.content
+        with metrics.stage('decode'):
+            payload = response.json()
+        page_info = {k: v for k, v in payload.items() if k != 'data'}
+        aggregated_flights = aggregate_flights(payload.get('data', []), metrics, direction)
+        # エラー内容を含むレスポンスはキャッシュしない
+        if 'error' not in page_info:
+            write_cache(endpoint, page_params, response.content)
+        return page_info, aggregated_flights
+
+    # 受信したチャンクはパースと同時にキャッシュの一時ファイルへ書き出す
+    cache_file, tmp_path = open_cache_entry()
+    try:
+        with cache_file:
+            def iter_chunks() -> Iterator[bytes]:
+                for chunk in metrics.timed_iter('fetch', response.iter_content(STREAM_CHUNK_BYTES)):
+                    cache_file.write(chunk)
+                    yield chunk
+
+            page_info: Dict[str, Any] = {}
+            try:
+                aggregated_flights = aggregate_flights(iter_page_flights(iter_chunks(), page_info), metrics, direction)
+            except ValueError as e:
+                # 途中で切れた本文などは、一括デコード (response.json()) と同じく RequestException として送出し、
+                # 再試行と古いキャッシュでの代用の対象にする
+                raise requests.exceptions.InvalidJSONError(f"レスポンスの解析に失敗しました: {e}", response=response) from e
+    except BaseException:
+        discard_cache_entry(tmp_path)
+        raise
+
+    # エラー内容を含むレスポンスはキャッシュしない
+    if 'error' in page_info:
+        discard_cache_entry(tmp_path)
+    else:
+        try:
+            commit_cache_entry(tmp_path, endpoint, page_params)
+        except OSError as e:
+            print(f"キャッシュ書き込みエラー: {e}")
+            discard_cache_entry(tmp_path)
+    return page_info, aggregated_flights
+
+
+def request_page(session: requests.Session, endpoint: str, page_params: Dict[str, Any],
+                 metrics: PipelineMetrics = NO_METRICS,
+                 direction: BoardDirection = DEPARTURES) -> Tuple[Dict[str, Any], Dict[tuple, Flight]]:
+    """
+    1ページ分をAPIから取得して集約し、(data以外のトップレベル, 集約結果) を返す。
+    接続エラーと5xxは指数バックオフで再試行し、429などの4xxは即座にApiResponseErrorを送出する。
+    リクエスト枠の待ちと再試行の待ちもfetchの段階として計測する。
+    """
+    offset = page_params.get('offset', 0)
+
+    with metrics.stage('fetch'):
+        for attempt in range(1, FETCH_MAX_ATTEMPTS + 1):
+            # キャッシュで済まない実際のリクエストだけが共有の枠を消費する
+            API_RATE_LIMITER.acquire()
+            metrics.count('api_requests')
+            try:
+                with session.get(BASE_URL + endpoint, params=page_params, timeout=REQUEST_TIMEOUT, stream=True) as response:
+                    if response.status_code == 200:
+                        return read_page_response(response, endpoint, page_params, metrics, direction)
+
+                    if response.status_code < 500 or attempt == FETCH_MAX_ATTEMPTS:
+                        raise ApiResponseError(response.status_code, response.text, response.headers.get('Retry-After'))
+                    print(f"ページ取得エラー (offset={offset}, 試行{attempt}回目): HTTP {response.status_code}. 再試行します。")
+            except requests.exceptions.RequestException as e:
+                if attempt == FETCH_MAX_ATTEMPTS:
+                    raise
+                print(f"ページ取得エラー (offset={offset}, 試行{attempt}回目): {e}. 再試行します。")
+
+            time.sleep(FETCH_BACKOFF_SECONDS * (2 ** (attempt - 1)))
+
+    # ループ内で必ずreturnまたはraiseするためここには到達しない
+    raise RuntimeError("unreachable")
+
+
+def fetch_page(session: requests.Session, endpoint: str, params: Dict[str, Any], offset: int,
+               metrics: PipelineMetrics = NO_METRICS,
+               direction: BoardDirection = DEPARTURES) -> Tuple[Dict[str, Any], Dict[tuple, Flight], Optional[float]]:
+    """
+    指定オフセットの1ページを取得して集約し、(data以外のトップレベル, 集約結果,
+    古いキャッシュを使った場合はその取得時刻) を返す。
+    TTL内のキャッシュがあればAPIを呼ばない。APIがレート制限中や停止中の場合は、
+    TTLを過ぎていても最後に取得できたキャッシュで代用する。
+    """
+    page_params = dict(params, limit=PAGE_LIMIT, offset=offset)
+
+    cached = read_cache(endpoint, page_params, CACHE_TTL_SECONDS, metrics, direction)
+    if cached is not None:
+        metrics.count('cache_hits')
+        page_info, aggregated_flights, _ = cached
+        return page_info, aggregated_flights, None
+
+    try:
+        page_info, aggregated_flights = request_page(session, endpoint, page_params, metrics, direction)
+    except (ApiResponseError, requests.exceptions.RequestException) as e:
+        stale = read_cache(endpoint, page_params, metrics=metrics, direction=direction)
+        if stale is None:
+            raise
+        metrics.count('stale_cache_hits')
+        print(f"API取得に失敗したため、キャッシュを使用します (offset={offset}): {e}")
+        return stale
+
+    return page_info, aggregated_flights, None
+
+
+def aggregate_flights(flights: Iterable[Dict[str, Any]], metrics: PipelineMetrics = NO_METRICS,
+                      direction: BoardDirection = DEPARTURES) -> Dict[tuple, Flight]:
+    """
+    1ページ分のフライトをコードシェア単位に集約する (逐次パース中のイテレータも受け付ける)。
+    要素を取り出す時間はdecode、それ以外はaggregateの段階として計測する。
+    """
+    with metrics.stage('aggregate'), metrics.profiled():
+        aggregated_flights, counts = aggregate_flight_records(metrics.timed_iter('decode', flights), direction)
+    for name, n in counts.items():
+        metrics.count(name, n)
+    return aggregated_flights
+
+
+def aggregate_flight_records(flights: Iterable[Dict[str, Any]],
+                             direction: BoardDirection = DEPARTURES) -> Tuple[Dict[tuple, Flight], Dict[str, int]]:
+    """
+    aggregate_flightsの本体。集約結果と、入力・除外・スキップ・マージした件数を返す。
+    出発便と到着便で同じ処理を使い、時刻とゲートは direction.time_field (自空港側)、
+    相手空港は direction.place_field から読む。便は (定刻, 相手空港のIATA) で束ねる。
+    """
+    aggregated_flights: Dict[tuple, Flight] = {}
+    records_in = records_excluded = records_skipped = records_merged = 0
+    time_field = direction.time_field
+    place_field = direction.place_field
+    excluded_statuses = direction.excluded_statuses
+    if numpy is not None and TIMESTAMP_VECTORIZE_THRESHOLD > 0:
+        # 大量のフライトでは、まだ変換していない時刻をNumPyでまとめて変換しておく
+        flights = iter_timestamp_batches(flights, time_field)
+
+    for flight in flights:
+        records_in += 1
+
+        # 出発便は出発済み（active）および着陸済み（landed）、到着便は着陸済みのフライトを除外する
+        status = flight['flight_status']
+        if status in excluded_statuses:
+            records_excluded += 1
+            continue 
+        
+        try:
+            # 1. 識別キーの作成と時刻の処理
+            scheduled_time_str = flight[time_field]['scheduled']
+            estimated_time_str = flight[time_field].get('estimated')
+            
+            # ISO 8601形式文字列を変換 (同じ文字列は一度だけ変換し、結果を使い回す)
+            scheduled = parse_api_timestamp(scheduled_time_str)
+            
+            place_iata = flight[place_field].get('iata')
+            flight_key = (scheduled_time_str, place_iata)
+
+            # 2. 便名とコードシェアの処理
+            current_flight_number = flight['flight']['iata'].upper() 
+            is_operating_carrier = not flight['flight'].get('codeshared')
+            
+            if flight_key in aggregated_flights:
+                records_merged += 1
+            else:
+                
+                # 3. 行先 (到着便は出発地) 情報の処理 (IATAコード優先、無ければ都市名で解決)
+                destination_ja, destination_en, destination_zh = DESTINATION_RESOLVER.resolve(
+                    place_iata, flight[place_field].get('city'), flight[place_field].get('airport'),
+                )
+
+                # 4. 定刻と変更時刻の計算 (JSTへの変換を削除し、UTC時刻をそのまま整形)
+                
+                scheduled_time_utc = scheduled.hhmm # UTC時刻をHH:MM形式に整形
+
+                changed_time_utc = "" # 初期値は空欄
+                delay_minutes = None
+                
+                # 5. ゲート情報の取得
+                gate_number = flight[time_field].get('gate')
+                display_gate = gate_number if gate_number else "" 
+
+                # 6. ステータスと備考の処理 
+                # 到着便の掲示板に載る出発済みの便は「飛行中」と表示する
+                remark_display = "飛行中" if status == 'active' else "予定"
+                remark_type = status
+                
+                if status == 'cancelled':
+                    remark_display = "欠航"
+                    remark_type = "cancelled"
+                    
+                elif estimated_time_str:
+                    # estimated_time_strが存在する場合、UTC時刻として使用
+                    estimated = parse_api_timestamp(estimated_time_str)
+                    delay_seconds = estimated.epoch - scheduled.epoch
+                    delay_minutes = delay_seconds // 60
+                    
+                    # 定刻より5分以上遅れているか判定 (エポック秒同士で比較)
+                    if delay_seconds > 5 * 60:
+                        changed_time_utc = estimated.hhmm # UTC時刻をHH:MM形式に整形
+                        remark_display = "遅延"
+                        remark_type = "delayed"
+
+                aggregated_flights[flight_key] = Flight(
+                    flight_id=f"{scheduled_time_str}|{place_iata or ''}",
+                    sort_key=scheduled.moment,
+                    # UTC時刻を使用
+                    scheduled_time=scheduled_time_utc,
+                    changed_time=changed_time_utc,
+                    destination_ja=destination_ja,
+                    destination_en=destination_en,
+                    destination_zh=destination_zh,
+                    flight_number=current_flight_number if is_operating_carrier else 'TBD',
+                    airline_code=flight['flight']['iata'][:2].upper(),
+                    remark=remark_display,
+                    remark_type=remark_type,
+                    gate=display_gate,
+                    delay_minutes=delay_minutes,
+                )
+
+            # 既存のフライトキーの場合、コードシェア情報を追加
+            current_agg = aggregated_flights[flight_key]
+
+            # 運航会社が確定していない場合、現在の便名が運航会社であれば更新
+            if is_operating_carrier and current_agg.flight_number == 'TBD':
+                current_agg.flight_number = current_flight_number
+                current_agg.airline_code = current_flight_number[:2].upper()
+            
+            # コードシェア便名リストの収集
+            current_agg.add_codeshare(current_flight_number)
+            
+
+        except Exception as e:
+            records_skipped += 1
+            print(f"フライトデータの処理中にエラーが発生しました: {e}. スキップします。")
+            traceback.print_exc()
+            continue
+
+    return aggregated_flights, {
+        'flights_in': records_in,
+        'flights_excluded': records_excluded,
+        'flights_skipped': records_skipped,
+        'codeshares_merged': records_merged,
+    }
+
+
+def merge_aggregated_flights(aggregated_flights: Dict[tuple, Flight], page_flights: Dict[tuple, Flight],
+                             metrics: PipelineMetrics = NO_METRICS):
+    """
+    ページ単位の集約結果を全体の集約結果へマージする。
+    ページ順にマージすることで、1回のループで全件を処理した場合と同じ結果になる。
+    """
+    merged = 0
+    for flight_key, page_agg in page_flights.items():
+        current_agg = aggregated_flights.get(flight_key)
+        if current_agg is None:
+            aggregated_flights[flight_key] = page_agg
+            continue
+
+        merged += 1
+        # 先に集約された側が運航会社未確定であれば、後続ページの運航便名を採用する
+        if current_agg.flight_number == 'TBD' and page_agg.flight_number != 'TBD':
+            current_agg.flight_number = page_agg.flight_number
+            current_agg.airline_code = page_agg.airline_code
+        elif page_agg.flight_number != 'TBD':
+            current_agg.add_codeshare(page_agg.flight_number)
+
+        for codeshare in page_agg.codeshares:
+            current_agg.add_codeshare(codeshare)
+
+    # ページをまたいだコードシェア便も、ページ内と同じくマージした件数に数える
+    metrics.count('codeshares_merged', merged)
+
+
+def finalize_flights(aggregated_flights: Dict[tuple, Flight], metrics: PipelineMetrics = NO_METRICS) -> List[Flight]:
+    """集約結果のコードシェア便名を確定させ、時系列 (UTC時刻) でソートしたリストを返す"""
+    with metrics.stage('sort'):
+        flights_data = list(aggregated_flights.values())
+        for flight in flights_data:
+            flight.finalize()
+        flights_data.sort(key=attrgetter('sort_key'))
+    metrics.count('flights_out', len(flights_data))
+    return flights_data
+
+
+def fetch_all_flights(session: requests.Session, endpoint: str, params: Dict[str, Any],
+                      metrics: PipelineMetrics = NO_METRICS,
+                      direction: BoardDirection = DEPARTURES) -> Tuple[Dict[tuple, Flight], Optional[float]]:
+    """
+    先頭ページで pagination.total を確認し、残りのページを並列に取得して集約する。
+    全体の所要時間はページ数ではなく最も遅いページに依存する。
+    古いキャッシュで代用したページがあれば、その中で最も古い取得時刻も返す。
+    """
+    first_page_info, aggregated_flights, stale_since = fetch_page(session, endpoint, params, 0, metrics, direction)
+
+    pagination = first_page_info.get('pagination') or {}
+    total = pagination.get('total') or 0
+    # APIが上限を切り詰める場合に備え、実際に返されたlimitをページ幅として使う
+    page_size = pagination.get('limit') or PAGE_LIMIT
+    offsets = list(range(page_size, total, page_size))
+    metrics.count('pages', len(offsets) + 1)
+
+    if offsets:
+        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] {params.get(direction.query_param)} ({direction.name}): 全{total}件を{len(offsets) + 1}ページに分けて取得します。")
+
+        with ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS) as executor:
+            pages = executor.map(lambda offset: fetch_page(session, endpoint, params, offset, metrics, direction), offsets)
+            # mapは投入順に結果を返すため、オフセット順のマージになる
+            for _, page_flights, page_stale_since in pages:
+                with metrics.stage('aggregate'):
+                    merge_aggregated_flights(aggregated_flights, page_flights, metrics)
+                if page_stale_since is not None:
+                    stale_since = page_stale_since if stale_since is None else min(stale_since, page_stale_since)
+
+    return aggregated_flights, stale_since
+
+
+def fetch_and_generate_html(airport_code: str = AIRPORT_CODE, output_path: Optional[str] = None,
+                            session: Optional[requests.Session] = None, direction: BoardDirection = DEPARTURES):
+    """
+    AviationStack APIから指定空港のデータを取得し、HTMLファイルを生成します。
+    directionで出発便 (DEPARTURES) と到着便 (ARRIVALS) のどちらの掲示板かを指定します。
+    sessionを渡した場合はそのコネクションプールを使い回します。
+    生成に使ったフライトのリストを返します (エラーページを生成した場合はNone)。
+    段階ごとの所要時間と件数は METRICS_DIR に書き出します。
+    """
+    metrics = PipelineMetrics(airport_code, profile=PROFILE_HOT_PATHS, board=direction.name)
+    flights_data = generate_board(airport_code, output_path, session, metrics, direction)
+    metrics.finish()
+    write_metrics(metrics)
+    return flights_data
+
+
+def generate_board(airport_code: str, output_path: Optional[str], session: Optional[requests.Session],
+                   metrics: PipelineMetrics, direction: BoardDirection = DEPARTURES) -> Optional[List[Flight]]:
+    """fetch_and_generate_htmlの本体。失敗した場合はエラーページを生成し、metrics.errorに理由を記録してNoneを返す"""
+    output_path = output_path or airport_output_path(airport_code, direction)
+
+    if not AVIATION_STACK_KEY:
+        print("致命的エラー: AviationStackのAPIキーが設定されていません。")
+        metrics.error = "APIキー未設定"
+        generate_error_html("Secrets設定エラー", "APIキーが環境変数/シークレットに設定されていません。GitHub ActionsのワークフローYAMLファイルまたはシークレット設定を確認してください。", output_path)
+        return None
+
+    if session is None:
+        with create_session() as own_session:
+            return generate_board(airport_code, output_path, own_session, metrics, direction)
+
+    endpoint = "flights"
+    
+    params = {
+        "access_key": AVIATION_STACK_KEY,
+        direction.query_param: airport_code, 
+    }
+    
+    # ログ出力はJSTを維持
+    print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] AviationStackリクエスト開始: {BASE_URL + endpoint} ({metrics.label})...")
+
+    try:
+        aggregated_flights, stale_since = fetch_all_flights(session, endpoint, params, metrics, direction)
+
+        # 6. 最終リストの作成とソート
+        flights_data = finalize_flights(aggregated_flights, metrics)
+        
+        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] {metrics.label}: {len(flights_data)}件のフライト情報を取得しました。")
+        build_logo_assets(flights_data, output_path, session, metrics)
+        generate_html_file(flights_data, stale_since, airport_code, output_path, metrics, direction=direction)
+        return flights_data
+
+    except ApiResponseError as e:
+        metrics.error = f"HTTP {e.status_code}"
+        if e.status_code == 429:
+            retry_after = e.retry_after or '不明な時間'
+            error_msg = f"API制限超過 (HTTP 429)。{retry_after}後に再試行してください。\n詳細: {e.text}"
+            generate_error_html("APIレート制限エラー (429)", error_msg, output_path)
+            return None
+
+        generate_error_html(f"APIエラー: HTTP {e.status_code}", e.text, output_path)
+        return None
+
+    except requests.exceptions.RequestException as e:
+        error_trace = traceback.format_exc()
+        print(f"致命的なリクエストエラーが発生しました: {e}")
+        metrics.error = f"リクエストエラー: {e}"
+        generate_error_html("リクエスト/接続エラー", str(e) + "\n\n" + error_trace, output_path)
+        return None
+
+    except Exception as e:
+        error_trace = traceback.format_exc()
+        print(f"予期せぬエラー: {e}")
+        metrics.error = f"予期せぬエラー: {e}"
+        generate_error_html("予期せぬスクリプトエラー", str(e) + "\n\n" + error_trace, output_path)
+        return None
+
+
+def enabled_directions() -> List[BoardDirection]:
+    """BOARD_NAMES で指定された掲示板の向き (不明な名前は無視し、1つも無ければ出発便のみ)"""
+    directions = [BOARD_DIRECTIONS[name] for name in BOARD_NAMES if name in BOARD_DIRECTIONS]
+    return directions or [DEPARTURES]
+
+
+def generate_boards(airport_codes: List[str], session: Optional[requests.Session] = None,
+                    directions: Optional[List[BoardDirection]] = None) -> Dict[Tuple[str, str], Optional[List[Flight]]]:
+    """
+    複数空港・複数の向き (出発便/到着便) の掲示板を並列に生成し、(空港コード, 向きの名前) ごとのフライトのリストを返す。
+    コネクションプール、APIリクエスト枠 (API_RATE_LIMITER)、行き先の解決と時刻の変換のメモは全掲示板で共有する。
+    """
+    directions = directions or enabled_directions()
+    boards = [(airport_code, direction) for airport_code in airport_codes for direction in directions]
+    if session is None:
+        with create_session(pool_size=MAX_FETCH_WORKERS * len(boards)) as own_session:
+            return generate_boards(airport_codes, own_session, directions)
+
+    with ThreadPoolExecutor(max_workers=len(boards)) as executor:
+        futures = {
+            (airport_code, direction.name): executor.submit(fetch_and_generate_html, airport_code, None, session, direction)
+            for airport_code, direction in boards
+        }
+        return {board: future.result() for board, future in futures.items()}
+
+
+# --- 履歴の保存と集計 ---
+
+class FlightHistoryStore:
+    """
+    取得したフライトを蓄積するSQLiteのストア。
+    便は (空港, 便の識別子) で重複を除き、取得のたびに最新の状態で上書きする (行は削除しない)。
+    遅延統計は日ごとの集計表 (daily_delays) から求め、取り込みのたびに対象の日だけを集計し直す。
+    複数空港のスレッドから使えるよう、接続はロックで保護する。
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS flights (
+            airport TEXT NOT NULL,
+            flight_key TEXT NOT NULL,
+            scheduled INTEGER NOT NULL,
+            flight_number TEXT NOT NULL,
+            airline_code TEXT NOT NULL,
+            destination_iata TEXT NOT NULL,
+            destination_name TEXT NOT NULL,
+            codeshares TEXT NOT NULL,
+            status TEXT NOT NULL,
+            delay_minutes INTEGER,
+            gate TEXT NOT NULL,
+            first_seen INTEGER NOT NULL,
+            last_seen INTEGER NOT NULL,
+            PRIMARY KEY (airport, flight_key)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS flights_scheduled ON flights (scheduled);
+        CREATE INDEX IF NOT EXISTS flights_flight_number ON flights (flight_number, scheduled);
+        CREATE INDEX IF NOT EXISTS flights_destination ON flights (destination_iata, scheduled);
+        CREATE TABLE IF NOT EXISTS daily_delays (
+            airport TEXT NOT NULL,
+            day TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            label TEXT NOT NULL,
+            flights INTEGER NOT NULL,
+            delayed INTEGER NOT NULL,
+            cancelled INTEGER NOT NULL,
+            measured INTEGER NOT NULL,
+            delay_minutes_total INTEGER NOT NULL,
+            PRIMARY KEY (airport, day, dimension, value)
+        ) WITHOUT ROWID;
+    """
+    # 統計を集計する軸: 名前 -> (flightsの列, 表示名の列)
+    DIMENSIONS = {
+        'airline': ('airline_code', 'airline_code'),
+        'destination': ('destination_iata', 'MAX(destination_name)'),
+    }
+
+    def __init__(self, path: str):
+        self.path = path
+        ensure_parent_dir(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def ingest(self, airport_code: str, flights_data: List[Flight], observed_at: Optional[float] = None) -> int:
+        """
+        1空港分のフライトを1トランザクションでまとめて取り込み、取り込んだ便の日の集計を更新する。
+        取り込んだ件数を返す。
+        """
+        observed_at = int(observed_at if observed_at is not None else time.time())
+        rows = []
+        days = set()
+        for flight in flights_data:
+            days.add(flight.sort_key.date())
+            rows.append((
+                airport_code, flight.flight_id, int(flight.sort_key.timestamp()),
+                flight.flight_number, flight.airline_code, flight.flight_id.rsplit('|', 1)[-1],
+                flight.destination_ja, " ".join(flight.codeshares), flight.remark_type,
+                flight.delay_minutes, flight.gate, observed_at, observed_at,
+            ))
+
+        with self._lock, self._conn:
+            self._conn.executemany("""
+                INSERT INTO flights VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (airport, flight_key) DO UPDATE SET
+                    flight_number = excluded.flight_number, airline_code = excluded.airline_code,
+                    destination_name = excluded.destination_name, codeshares = excluded.codeshares,
+                    status = excluded.status, delay_minutes = excluded.delay_minutes,
+                    gate = excluded.gate, last_seen = excluded.last_seen
+            """, rows)
+            for day in sorted(days):
+                self._rollup_day(airport_code, day)
+        return len(rows)
+
+    def _rollup_day(self, airport_code: str, day):
+        """1日分の集計を flights から作り直す (scheduledの索引で、その日の便だけを読む)"""
+        day_start = int(datetime.combine(day, datetime.min.time(), timezone.utc).timestamp())
+        self._conn.execute("DELETE FROM daily_delays WHERE airport = ? AND day = ?", (airport_code, day.isoformat()))
+        for dimension, (column, label) in self.DIMENSIONS.items():
+            self._conn.execute(f"""
+                INSERT INTO daily_delays
+                SELECT airport, :day, :dimension, {column}, {label},
+                       COUNT(*),
+                       SUM(status = 'delayed'),
+                       SUM(status = 'cancelled'),
+                       COUNT(delay_minutes),
+                       COALESCE(SUM(MAX(delay_minutes, 0)), 0)
+                FROM flights
+                WHERE scheduled >= :start AND scheduled < :end AND airport = :airport
+                GROUP BY airport, {column}
+            """, {'day': day.isoformat(), 'dimension': dimension, 'start': day_start,
+                  'end': day_start + 24 * 60 * 60, 'airport': airport_code})
+
+    def airports(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT DISTINCT airport FROM daily_delays ORDER BY airport")]
+
+    def delay_stats(self, airport_code: str, dimension: str = 'airline', days: int = STATS_WINDOW_DAYS,
+                    now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """
+        直近days日間の遅延統計を、航空会社 (airline) または行き先 (destination) ごとに便数の多い順で返す。
+        日ごとの集計表だけを読むため、蓄積した便の数によらず速い。
+        """
+        if dimension not in self.DIMENSIONS:
+            raise ValueError(f"未対応の集計軸です: {dimension}")
+        first_day = ((now or board_now()).date() - timedelta(days=days - 1)).isoformat()
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT value, MAX(label) AS label, SUM(flights) AS flights, SUM(delayed) AS delayed,
+                       SUM(cancelled) AS cancelled, SUM(measured) AS measured,
+                       SUM(delay_minutes_total) AS delay_minutes_total
+                FROM daily_delays
+                WHERE airport = ? AND dimension = ? AND day >= ?
+                GROUP BY value
+                ORDER BY flights DESC, value
+            """, (airport_code, dimension, first_day)).fetchall()
+        return [
+            dict(row, average_delay_minutes=row['delay_minutes_total'] / row['measured'] if row['measured'] else None)
+            for row in rows
+        ]
+
+    def flights_by_number(self, flight_number: str, days: int = STATS_WINDOW_DAYS,
+                          now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """指定した運航便名の直近days日間の記録を定刻順に返す"""
+        since = int(((now or board_now()) - timedelta(days=days)).timestamp())
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT * FROM flights WHERE flight_number = ? AND scheduled >= ? ORDER BY scheduled
+            """, (flight_number.upper(), since)).fetchall()
+        return [dict(row) for row in rows]
+
+
+STATS_HTML_HEAD = """
+<!DOCTYPE html>
+<html lang="ja">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>出発便 遅延統計</title>
+    <style>
+        body { font-family: 'BIZ UDPGothic', 'Meiryo', 'ヒラギノ角ゴ Pro W3', sans-serif; margin: 0; background-color: #e6e6e6; color: #333; }
+        .board-container { background-color: #fff; padding: 20px 30px; box-shadow: 0 4px 10px rgba(0,0,0,0.2); max-width: 1000px; margin: 30px auto; border-radius: 6px; }
+        h1 { text-align: center; color: #004d99; margin-bottom: 5px; font-size: 1.8em; }
+        h2 { color: #004d99; font-size: 1.3em; margin-top: 30px; }
+        h3 { color: #666; font-size: 1.05em; }
+        table { width: 100%; border-collapse: collapse; margin-top: 10px; }
+        th, td { padding: 6px 8px; border-bottom: 1px solid #ddd; text-align: right; }
+        th:first-child, td:first-child { text-align: left; }
+        th { background-color: #f0f0f0; border-top: 2px solid #004d99; }
+        .update-info { font-size: 0.85em; text-align: right; color: #777; }
+    </style>
+</head>
+<body>
+
+<div class="board-container">
+    <h1>出発便 遅延統計</h1>
+"""
+
+STATS_HTML_TAIL = """
+</div>
+
+</body>
+</html>
+"""
+
+# 集計軸ごとの見出しと1列目の列名
+STATS_DIMENSION_LABELS = {'airline': ("航空会社別", "航空会社"), 'destination': ("行き先別", "行き先")}
+
+
+def collect_stats(store: FlightHistoryStore, days: int) -> List[Tuple[str, Dict[str, List[Dict[str, Any]]]]]:
+    """遅延統計ページに載せる集計結果 (空港ごとに、集計軸ごとの行)。日ごとの集計表だけを読む"""
+    return [
+        (airport_code, {dimension: store.delay_stats(airport_code, dimension, days) for dimension in STATS_DIMENSION_LABELS})
+        for airport_code in store.airports()
+    ]
+
+
+def stats_content_hash(stats: List[Tuple[str, Dict[str, List[Dict[str, Any]]]]], days: int) -> str:
+    """
+    遅延統計ページの内容を表すハッシュ。集計結果とテンプレートから求め、最終更新日時は含めないため、
+    集計が変わらなければ同じ値になる (掲示板の board_content_hash と同じ考え方)。
+    """
+    digest = hashlib.sha256()
+    for template in (STATS_HTML_HEAD, STATS_HTML_TAIL):
+        digest.update(template.encode('utf-8'))
+    digest.update(json.dumps([days, stats], ensure_ascii=False).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def iter_stats_html(stats: List[Tuple[str, Dict[str, List[Dict[str, Any]]]]], days: int,
+                    generated_at: Optional[float] = None) -> Iterator[str]:
+    """遅延統計ページのHTML断片を、空港・集計軸ごとに順に返す"""
+    yield STATS_HTML_HEAD
+    yield f'    <p class="update-info">直近{days}日間 / 最終更新日時: {format_jst(generated_at or time.time())}</p>\n'
+    for airport_code, dimensions in stats:
+        airport = AIRPORTS.get(airport_code)
+        yield f"    <h2>{airport['name'] if airport else airport_code} ({airport_code})</h2>\n"
+        for dimension, (heading, column_name) in STATS_DIMENSION_LABELS.items():
+            yield (f"    <h3>{heading}</h3>\n    <table>\n        <thead><tr><th>{column_name}</th><th>便数</th>"
+                   f"<th>遅延</th><th>欠航</th><th>遅延率</th><th>平均遅延 (分)</th></tr></thead>\n        <tbody>\n")
+            for row in dimensions[dimension]:
+                label = row['label'] if dimension == 'airline' else f"{row['label']} ({row['value']})"
+                average = "-" if row['average_delay_minutes'] is None else f"{row['average_delay_minutes']:.1f}"
+                yield (f"            <tr><td>{label}</td><td>{row['flights']}</td><td>{row['delayed']}</td>"
+                       f"<td>{row['cancelled']}</td><td>{row['delayed'] / row['flights']:.0%}</td><td>{average}</td></tr>\n")
+            yield "        </tbody>\n    </table>\n"
+    yield STATS_HTML_TAIL
+
+
+def update_history(results: Dict[Tuple[str, str], Optional[List[Flight]]], store: Optional[FlightHistoryStore] = None):
+    """
+    各空港の出発便の取得結果を履歴に取り込み、遅延統計ページを書き直す。
+    集計が前回と変わらない場合は、掲示板と同じく書き直さない (最終更新日時だけの差分でコミットが起きないようにする)。
+    遅延統計は出発便についてのものなので、到着便の掲示板と、エラーページを生成した掲示板 (結果がNone) は取り込まない。
+    storeを渡さない場合は HISTORY_DB_FILE を開く (空文字なら何もしない)。
+    """
+    if store is None and not HISTORY_DB_FILE:
+        return
+
+    own_store = store is None
+    try:
+        if own_store:
+            store = FlightHistoryStore(HISTORY_DB_FILE)
+        for (airport_code, board), flights_data in results.items():
+            if board == DEPARTURES.name and flights_data is not None:
+                count = store.ingest(airport_code, flights_data)
+                print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] {airport_code}: {count}便を履歴に記録しました。")
+        stats = collect_stats(store, STATS_WINDOW_DAYS)
+        content_hash = stats_content_hash(stats, STATS_WINDOW_DAYS)
+        if os.path.exists(STATS_HTML_FILE) and read_manifest(STATS_HTML_FILE).get('content_hash') == content_hash:
+            print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] 遅延統計に変更が無いため、'{STATS_HTML_FILE}' は更新しません。")
+            return
+        with atomic_open(STATS_HTML_FILE) as f:
+            f.writelines(iter_stats_html(stats, STATS_WINDOW_DAYS))
+        write_precompressed(STATS_HTML_FILE)
+        # 記録した便数 (航空会社別の便数の合計) を残す
+        write_manifest(STATS_HTML_FILE, content_hash, sum(row['flights'] for _, dimensions in stats for row in dimensions['airline']))
+    except (sqlite3.Error, OSError) as e:
+        print(f"履歴の更新エラー: {e}")
+    finally:
+        if own_store and store is not None:
+            store.close()
+
+
+# --- 常駐モード ---
+
+def board_now() -> datetime:
+    """
+    フライトの sort_key と比較できる現在時刻。
+    AviationStackの時刻は現地時刻に +00:00 が付いた形式のため、JSTの壁時計をUTCとして扱う。
+    """
+    return datetime.now(JST).replace(tzinfo=timezone.utc)
+
+
+def next_poll_interval(flights_data: List[Flight], now: datetime, requests_per_run: int,
+                       requests_used_today: int, seconds_until_day_end: float) -> float:
+    """
+    直近の便 (出発・到着) の数からポーリング間隔 (秒) を決める。
+    30分以内の出発が多いほど短く、しばらく出発が無ければ長くする。
+    ただし、その日の残りリクエスト数で日末まで回せる間隔より短くはしない。
+    """
+    busy_until = now + timedelta(minutes=DAEMON_BUSY_WINDOW_MINUTES)
+    idle_until = now + timedelta(minutes=DAEMON_IDLE_WINDOW_MINUTES)
+    upcoming = sum(1 for flight in flights_data if now <= flight.sort_key < busy_until)
+
+    if upcoming >= DAEMON_BUSY_FLIGHTS:
+        interval = DAEMON_MIN_INTERVAL_SECONDS
+    elif upcoming == 0 and not any(now <= flight.sort_key < idle_until for flight in flights_data):
+        interval = DAEMON_MAX_INTERVAL_SECONDS
+    else:
+        busy_ratio = upcoming / DAEMON_BUSY_FLIGHTS
+        interval = DAEMON_MAX_INTERVAL_SECONDS - (DAEMON_MAX_INTERVAL_SECONDS - DAEMON_MIN_INTERVAL_SECONDS) * busy_ratio
+
+    remaining_requests = DAILY_REQUEST_BUDGET - requests_used_today
+    if remaining_requests < max(requests_per_run, 1):
+        # 今日の枠を使い切ったので、日付が変わるまで待つ
+        return max(seconds_until_day_end, DAEMON_MIN_INTERVAL_SECONDS)
+
+    remaining_runs = remaining_requests / max(requests_per_run, 1)
+    return max(interval, seconds_until_day_end / remaining_runs)
+
+
+class BoardRefresher:
+    """
+    常駐モードと配信モードで共通の更新処理。全空港の (BOARD_NAMES で指定した向きの) 掲示板と履歴を更新し、
+    その日 (JST) のリクエスト数と直近の便の数から、次回の更新までの秒数を決める。
+    """
+
+    def __init__(self, airport_codes: List[str], session: requests.Session,
+                 history: Optional[FlightHistoryStore] = None):
+        self.airport_codes = airport_codes
+        self.directions = enabled_directions()
+        self.session = session
+        self.history = history
+        self.current_day = datetime.now(JST).date()
+        self.requests_used_today = 0
+
+    def boards(self) -> List[Tuple[str, BoardDirection]]:
+        """更新する掲示板 (空港コードと向きの組) の一覧"""
+        return [(airport_code, direction) for airport_code in self.airport_codes for direction in self.directions]
+
+    def refresh(self) -> Tuple[Dict[Tuple[str, str], Optional[List[Flight]]], float]:
+        """掲示板を1回更新し、((空港コード, 向き) ごとのフライトのリスト, 次回の更新までの秒数) を返す"""
+        if datetime.now(JST).date() != self.current_day:
+            self.current_day = datetime.now(JST).date()
+            self.requests_used_today = 0
+
+        requests_before = API_RATE_LIMITER.acquired_total
+        results = generate_boards(self.airport_codes, self.session, self.directions)
+        DESTINATION_RESOLVER.report_misses()
+        if self.history is not None:
+            update_history(results, self.history)
+        requests_per_run = API_RATE_LIMITER.acquired_total - requests_before
+        self.requests_used_today += requests_per_run
+
+        flights_data = [flight for flights in results.values() if flights for flight in flights]
+        now_jst = datetime.now(JST)
+        day_end = datetime.combine(now_jst.date() + timedelta(days=1), datetime.min.time(), JST)
+        interval = next_poll_interval(flights_data, board_now(), requests_per_run,
+                                      self.requests_used_today, (day_end - now_jst).total_seconds())
+
+        print(f"[{now_jst.strftime('%H:%M:%S')}] 本日のリクエスト数: {self.requests_used_today}/{DAILY_REQUEST_BUDGET}。"
+              f"次回の更新は{interval / 60:.1f}分後です。")
+        return results, interval
+
+
+def limit_cache_ttl_to_polling():
+    """更新タイミングをスケジューラが決める場合は、ポーリング間隔より長いキャッシュは使わない"""
+    global CACHE_TTL_SECONDS
+    CACHE_TTL_SECONDS = min(CACHE_TTL_SECONDS, DAEMON_MIN_INTERVAL_SECONDS - 1)
+
+
+def open_history_store() -> Optional[FlightHistoryStore]:
+    """常駐中に使い回す履歴のストアを開く (HISTORY_DB_FILE が空か、開けない場合はNone)"""
+    if not HISTORY_DB_FILE:
+        return None
+    try:
+        return FlightHistoryStore(HISTORY_DB_FILE)
+    except sqlite3.Error as e:
+        print(f"履歴データベースを開けませんでした: {e}")
+        return None
+
+
+def run_daemon(airport_codes: List[str]):
+    """
+    掲示板を常駐して更新し続ける。セッションは使い回すため、接続はウォームなまま保たれる。
+    SIGTERM / SIGINT を受け取ると、実行中の更新が終わった時点で終了する。
+    """
+    limit_cache_ttl_to_polling()
+
+    stop_event = threading.Event()
+
+    def handle_stop(signum, frame):
+        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] シグナル {signum} を受信しました。常駐モードを終了します。")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+
+    history = open_history_store()
+    with create_session(pool_size=MAX_FETCH_WORKERS * len(airport_codes) * len(enabled_directions())) as session:
+        refresher = BoardRefresher(airport_codes, session, history)
+        while not stop_event.is_set():
+            _, interval = refresher.refresh()
+            stop_event.wait(interval)
+
+    if history is not None:
+        history.close()
+
+
+# --- 配信モード ---
+
+class StaticFile:
+    """
+    メモリに保持した配信用のファイル。無圧縮・gzip・brotli の各表現と、その強いETagを持つ。
+    圧縮版は出力済みの .gz / .br が新しければそれを使い、無ければメモリ上で圧縮する。
+    """
+    __slots__ = ('mtime_ns', 'size', 'content_type', 'last_modified', 'variants')
+
+    # 圧縮して配信するContent-Type (画像は圧縮済みのため対象外)
+    COMPRESSIBLE_PREFIXES = ("text/", "application/json", "image/svg+xml")
+
+    def __init__(self, path: str, stat: os.stat_result, content_type: str):
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.content_type = content_type
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+        with open(path, 'rb') as f:
+            body = f.read()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        # 表現ごとに内容が異なるため、ETagも表現ごとに分ける
+        self.variants: Dict[str, Tuple[bytes, str]] = {'identity': (body, f'"{digest}"')}
+        if not content_type.startswith(self.COMPRESSIBLE_PREFIXES):
+            return
+        gz = self._read_precompressed(path + ".gz")
+        if gz is None:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+        self.variants['gzip'] = (gz, f'"{digest}-gz"')
+        br = self._read_precompressed(path + ".br")
+        if br is None and brotli is not None:
+            br = brotli.compress(body, quality=9)
+        if br is not None:
+            self.variants['br'] = (br, f'"{digest}-br"')
+
+    def _read_precompressed(self, path: str) -> Optional[bytes]:
+        """元のファイル以降に書き出された圧縮済みファイルを読み込む (古い、または無い場合はNone)"""
+        try:
+            if os.stat(path).st_mtime_ns < self.mtime_ns:
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def select(self, accept_encoding: str) -> Tuple[str, bytes, str]:
+        """Accept-Encodingから配信する表現を選び、(Content-Encoding, 本文, ETag) を返す"""
+        accepted = set()
+        for item in accept_encoding.split(","):
+            coding, _, params = item.strip().partition(";")
+            if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+                continue
+            accepted.add(coding.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                return (encoding,) + self.variants[encoding]
+        return ('identity',) + self.variants['identity']
+
+
+class BoardServer:
+    """
+    生成した掲示板を配信する組み込みのHTTPサーバー (asyncio)。
+    - ファイルはメモリに保持し、強いETagとIf-None-Matchによる304で応答する
+    - <名前>.events への接続には、差分ファイル (<名前>.delta.json) が更新されるたびにServer-Sent Eventsで配信する
+    - 掲示板の更新と、ファイルの読み込み・圧縮は別スレッドで実行し、その間も配信は止めない
+    """
+
+    def __init__(self, refresher: BoardRefresher, host: str = SERVE_HOST, port: int = SERVE_PORT,
+                 root: Optional[str] = None):
+        self.refresher = refresher
+        self.host = host
+        self.port = port
+        self.root = os.path.realpath(root or os.getcwd())
+        self.files: Dict[str, StaticFile] = {}
+        # 読み込み・圧縮中のファイル (同じファイルを複数の接続から同時に読み込まない)
+        self.loading: Dict[str, asyncio.Future] = {}
+        # 差分ファイルのパスごとの、最新の版と配信するイベント、購読中の画面のキュー
+        self.event_versions: Dict[str, str] = {}
+        self.event_messages: Dict[str, bytes] = {}
+        self.subscribers: Dict[str, set] = collections.defaultdict(set)
+        # 次のリクエストを待っている接続 (終了時にすぐ切断する)
+        self.idle_writers: set = set()
+        self.stopping: Optional[asyncio.Event] = None
+
+    async def run(self):
+        """更新と配信を開始し、SIGTERM / SIGINT を受け取るまで続ける"""
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self.stop, signum)
+
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port,
+                                            backlog=SERVE_BACKLOG, limit=16 * 1024)
+        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] http://{self.host}:{self.port}/ で配信を開始しました。")
+        async with server:
+            refresh_task = asyncio.create_task(self.refresh_loop())
+            await self.stopping.wait()
+            server.close()
+            # 待機中の接続と購読中の画面を切断してから、実行中の更新の完了を待つ
+            for writer in self.idle_writers:
+                writer.close()
+            for queues in self.subscribers.values():
+                for queue in list(queues):
+                    self.disconnect(queue)
+            await refresh_task
+
+    def stop(self, signum: int):
+        print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] シグナル {signum} を受信しました。配信モードを終了します。")
+        self.stopping.set()
+
+    async def refresh_loop(self):
+        """掲示板を更新し、変わった差分を購読中の画面に配信する"""
+        loop = asyncio.get_running_loop()
+        while not self.stopping.is_set():
+            _, interval = await loop.run_in_executor(None, self.refresher.refresh)
+            await self.publish_updates()
+            try:
+                await asyncio.wait_for(self.stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def publish_updates(self):
+        """各掲示板をメモリに読み込み、版が変わった差分をイベントとして配信する"""
+        pages = [path for airport_code, direction in self.refresher.boards()
+                 for path, _ in board_pages(airport_output_path(airport_code, direction))]
+        for output_path in pages:
+            # 差分を見た画面が読み直したときに新しいページを返せるよう、ページを先に読み込み終えておく
+            await self.load_file(os.path.join(self.root, output_path), wait=True)
+            delta_file = await self.load_file(os.path.join(self.root, delta_path(output_path)), wait=True)
+            if delta_file is None:
+                continue
+            delta = json.loads(delta_file.variants['identity'][0])
+            key = os.path.normpath(delta_path(output_path))
+            previous_version = self.event_versions.get(key)
+            if previous_version == delta['version']:
+                continue
+            self.event_versions[key] = delta['version']
+            data = json.dumps(delta, ensure_ascii=False, separators=(',', ':'))
+            message = f"id: {delta['version']}\nevent: delta\ndata: {data}\n\n".encode('utf-8')
+            self.event_messages[key] = message
+            if previous_version is None:
+                # 起動直後の読み込みでは、まだ購読中の画面は無い
+                continue
+
+            dropped = 0
+            for queue in list(self.subscribers[key]):
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # 前の差分もまだ送れていない画面は切断する (再接続時に最新の差分から追いつく)
+                    self.subscribers[key].discard(queue)
+                    self.disconnect(queue)
+                    dropped += 1
+            print(f"[{datetime.now(JST).strftime('%H:%M:%S')}] {output_path}: 差分を{len(self.subscribers[key])}台の画面に配信しました。"
+                  + (f" (送信が滞った{dropped}台を切断)" if dropped else ""))
+
+    @staticmethod
+    def disconnect(queue: asyncio.Queue):
+        """購読中の画面に、送信待ちの差分を捨てて切断するよう伝える"""
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    async def load_file(self, path: str, wait: bool = False) -> Optional[StaticFile]:
+        """
+        ファイルをメモリから返す (無い場合はNone)。ディスク上で更新されていれば、読み込みと圧縮を別スレッドで行い、
+        できあがった時点で差し替える。それまでは前の内容を返す (前の内容が無い場合と、waitを指定した場合は待つ)。
+        """
+        content_type = SERVE_CONTENT_TYPES.get(os.path.splitext(path)[1])
+        if content_type is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.files.pop(path, None)
+            return None
+        cached = self.files.get(path)
+        if cached is not None and cached.mtime_ns == stat.st_mtime_ns and cached.size == stat.st_size:
+            return cached
+        loading = self.loading.get(path)
+        if loading is None:
+            loading = self.loading[path] = asyncio.ensure_future(self._load_file(path, stat, content_type))
+        if cached is not None and not wait:
+            return cached
+        # 待っている接続が切れても、読み込みは他の接続のために続ける
+        return await asyncio.shield(loading)
+
+    async def _load_file(self, path: str, stat: os.stat_result, content_type: str) -> Optional[StaticFile]:
+        """ファイルの読み込みと圧縮をスレッドで行い、終わったらメモリ上のファイルを差し替える"""
+        try:
+            static = await asyncio.get_running_loop().run_in_executor(None, StaticFile, path, stat, content_type)
+        except OSError:
+            # 読み込む前に削除された
+            self.files.pop(path, None)
+            return None
+        except Exception as e:
+            print(f"配信ファイルの読み込みエラー ({path}): {e}")
+            return self.files.get(path)
+        finally:
+            self.loading.pop(path, None)
+        self.files[path] = static
+        return static
+
+    def resolve(self, url_path: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        URLのパスを配信するファイルに対応づけ、(ファイルのパス, リダイレクト先) を返す。
+        ルートディレクトリの外や、"." で始まるパス (.cache, .metrics など) は配信しない。
+        """
+        parts = [part for part in unquote(url_path).split("/") if part]
+        if any(part.startswith(".") or "\\" in part or "\0" in part for part in parts):
+            return None, None
+        path = os.path.realpath(os.path.join(self.root, *parts))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return None, None
+        if os.path.isdir(path):
+            if not url_path.endswith("/"):
+                return None, url_path + "/"
+            path = os.path.join(path, OUTPUT_HTML_FILE)
+        return path, None
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """1つの接続でリクエストを順に処理する (HTTP/1.1のキープアライブに対応)"""
+        try:
+            while not self.stopping.is_set():
+                self.idle_writers.add(writer)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), SERVE_IDLE_TIMEOUT_SECONDS)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, 431, "Request Header Fields Too Large")
+                    return
+                finally:
+                    self.idle_writers.discard(writer)
+                if not await self.handle_request(head, reader, writer):
+                    return
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """1件のリクエストに応答し、接続を続けるかどうかを返す"""
+        lines = head.decode('latin-1').split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            await self.send_error(writer, 400, "Bad Request")
+            return False
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection != 'close' if version == "HTTP/1.1" else connection == 'keep-alive'
+        if method not in ("GET", "HEAD"):
+            # 本文を読み飛ばさずに済むよう、GET/HEAD以外は応答後に切断する
+            await self.send_error(writer, 405, "Method Not Allowed", {"Allow": "GET, HEAD"})
+            return False
+
+        url_path = urlsplit(target).path
+        path, redirect = self.resolve(url_path)
+        if redirect is not None:
+            await self.send_response(writer, 301, {"Location": redirect, "Content-Length": "0"}, b"", keep_alive)
+            return keep_alive
+        if path is not None and path.endswith(".events") and method == "GET":
+            await self.serve_events(reader, writer, os.path.relpath(path[:-len(".events")] + ".delta.json", self.root), headers)
+            return False
+
+        static = await self.load_file(path) if path is not None else None
+        if static is None:
+            await self.send_error(writer, 404, "Not Found")
+            return keep_alive
+
+        encoding, body, etag = static.select(headers.get('accept-encoding', ''))
+        response_headers = {
+            "Content-Type": static.content_type,
+            "ETag": etag,
+            "Last-Modified": static.last_modified,
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != 'identity':
+            response_headers["Content-Encoding"] = encoding
+        if self.not_modified(headers, etag, static):
+            await self.send_response(writer, 304, response_headers, b"", keep_alive)
+            return keep_alive
+        response_headers["Content-Length"] = str(len(body))
+        await self.send_response(writer, 200, response_headers, b"" if method == "HEAD" else body, keep_alive)
+        return keep_alive
+
+    @staticmethod
+    def not_modified(headers: Dict[str, str], etag: str, static: StaticFile) -> bool:
+        """条件付きリクエストに304で応答できるか。If-None-MatchがあればIf-Modified-Sinceより優先する"""
+        if_none_match = headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(",")]
+            return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+        if_modified_since = headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return parsedate_to_datetime(if_modified_since).timestamp() >= static.mtime_ns // 1_000_000_000
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    async def send_response(self, writer: asyncio.StreamWriter, status: int, headers: Dict[str, str],
+                            body: bytes, keep_alive: bool):
+        reason = {200: "OK", 301: "Moved Permanently", 304: "Not Modified"}.get(status, "")
+        lines = [f"HTTP/1.1 {status} {reason}", f"Date: {formatdate(usegmt=True)}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def send_error(self, writer: asyncio.StreamWriter, status: int, reason: str,
+                         headers: Optional[Dict[str, str]] = None):
+        body = f"{status} {reason}\n".encode('ascii')
+        lines = [f"HTTP/1.1 {status} {reason}", "Content-Type: text/plain; charset=utf-8",
+                 f"Content-Length: {len(body)}"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve_events(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, key: str,
+                           headers: Dict[str, str]):
+        """
+        差分ファイルの更新をServer-Sent Eventsで配信する。
+        再接続した画面 (Last-Event-IDが最新の版と異なる) には、最新の差分をすぐに送る。
+        """
+        key = os.path.normpath(key)
+        if key not in self.event_versions:
+            await self.send_error(writer, 404, "Not Found")
+            return
+        writer.write(("HTTP/1.1 200 OK\r\n"
+                      "Content-Type: text/event-stream; charset=utf-8\r\n"
+                      "Cache-Control: no-cache\r\n"
+                      "X-Accel-Buffering: no\r\n"
+                      "Connection: keep-alive\r\n\r\n"
+                      f"retry: {SSE_RETRY_MILLISECONDS}\n\n").encode('ascii'))
+        # 送信待ちは1件まで。2件目が来ても送れていない画面は publish_updates で切断する
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        last_event_id = headers.get('last-event-id')
+        if last_event_id and last_event_id != self.event_versions[key]:
+            queue.put_nowait(self.event_messages[key])
+        self.subscribers[key].add(queue)
+        # 画面が切断したら、次の送信を待たずに購読をやめる
+        watcher = asyncio.create_task(reader.read(1))
+        watcher.add_done_callback(lambda _: self.disconnect(queue))
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    message = b": keep-alive\n\n"
+                if message is None:
+                    return
+                writer.write(message)
+                await asyncio.wait_for(writer.drain(), SSE_SEND_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.subscribers[key].discard(queue)
+            watcher.cancel()
+
+
+def run_server(airport_codes: List[str], host: str = SERVE_HOST, port: int = SERVE_PORT):
+    """
+    掲示板を常駐して更新しながら、組み込みのHTTPサーバーで配信する。
+    更新の間隔は常駐モード (--daemon) と同じく next_poll_interval で決める。
+    """
+    limit_cache_ttl_to_polling()
+    history = open_history_store()
+    with create_session(pool_size=MAX_FETCH_WORKERS * len(airport_codes) * len(enabled_directions())) as session:
+        server = BoardServer(BoardRefresher(airport_codes, session, history), host, port)
+        asyncio.run(server.run())
+
+    if history is not None:
+        history.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AviationStack APIから出発便・到着便掲示板のHTMLを生成します。")
+    parser.add_argument("airports", nargs="*", default=AIRPORT_CODES,
+                        help="掲示板を生成する空港のIATAコード (省略時は環境変数AIRPORT_CODES、未設定ならHND)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="常駐して、直近の出発便の数に応じた間隔で掲示板を更新し続ける")
+    parser.add_argument("--serve", action="store_true",
+                        help="常駐して掲示板を更新しながら、組み込みのHTTPサーバーで配信する (差分はServer-Sent Eventsで通知)")
+    parser.add_argument("--host", default=SERVE_HOST, help=f"--serve で待ち受けるアドレス (既定: {SERVE_HOST})")
+    parser.add_argument("--port", type=int, default=SERVE_PORT, help=f"--serve で待ち受けるポート (既定: {SERVE_PORT})")
+    args = parser.parse_args()
+
+    airport_codes = list(dict.fromkeys(code.upper() for code in args.airports))
+    if args.serve:
+        run_server(airport_codes, args.host, args.port)
+    elif args.daemon:
+        run_daemon(airport_codes)
+    else:
+        results = generate_boards(airport_codes)
+        DESTINATION_RESOLVER.report_misses()
+        update_history(results)
 
 
 if __name__ == "__main__":
-    fetch_and_generate_html()
+    main()
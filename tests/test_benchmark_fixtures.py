@@ -0,0 +1,33 @@
+"""ベンチマークの合成データが掲示板に載り、書き出しの計測になっていることを確かめるテスト"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+import generate_flights  # noqa: E402
+
+
+def render_bytes(count: int) -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generate_flights.generate_html_file(benchmark.make_display_flights(count),
+                                            output_path=os.path.join(tmp_dir, "index.html"))
+        return benchmark.html_output_bytes(tmp_dir)
+
+
+class BenchmarkFixturesTest(unittest.TestCase):
+    def test_payload_is_not_in_the_past(self):
+        start = generate_flights.main_window_start(generate_flights.board_now())
+        if start is None:
+            self.skipTest("ページを分割しない設定では過去の便も載る")
+        flights = benchmark.make_display_flights(100)
+        self.assertTrue(any(generate_flights.is_pending(flight, start) for flight in flights))
+
+    def test_output_grows_with_flight_count(self):
+        self.assertLess(render_bytes(50), render_bytes(500))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""fetch_page が壊れた200応答を取得の失敗として扱い、古いキャッシュで代用することを確かめるテスト"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_flights  # noqa: E402
+
+RECORD = {
+    "flight_status": "scheduled",
+    "departure": {"iata": "HND", "scheduled": "2026-01-01T10:00:00+00:00", "estimated": None, "gate": "5"},
+    "arrival": {"airport": "Itami", "city": "Itami", "iata": "ITM", "scheduled": "2026-01-01T11:05:00+00:00"},
+    "airline": {"iata": "JL"},
+    "flight": {"number": "123", "iata": "JL123", "codeshared": None},
+}
+BODY = json.dumps({"pagination": {"limit": 100, "offset": 0, "count": 1, "total": 1}, "data": [RECORD]}).encode("utf-8")
+
+
+class FakeResponse:
+    """Content-Lengthの無い (逐次パースする) 200応答"""
+    status_code = 200
+    headers = {}
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def iter_content(self, chunk_size: int):
+        for i in range(0, len(self.body), 7):
+            yield self.body[i:i + 7]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class FetchPageTest(unittest.TestCase):
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        for name, value in (("CACHE_DIR", tmp_dir.name), ("CACHE_TTL_SECONDS", 0), ("FETCH_BACKOFF_SECONDS", 0),
+                            ("API_RATE_LIMITER", generate_flights.TokenBucket(1e9, 10 ** 9))):
+            patcher = mock.patch.object(generate_flights, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.params = {"access_key": "test", "dep_iata": "HND"}
+        self.session = mock.Mock()
+        self.session.get.side_effect = lambda *args, **kwargs: FakeResponse(BODY[:-20])
+
+    def fetch(self):
+        with mock.patch("builtins.print"):
+            return generate_flights.fetch_page(self.session, "flights", self.params, 0)
+
+    def test_truncated_body_falls_back_to_stale_cache(self):
+        page_params = dict(self.params, limit=generate_flights.PAGE_LIMIT, offset=0)
+        generate_flights.write_cache("flights", page_params, BODY)
+        stale_at = os.path.getmtime(generate_flights.cache_path("flights", page_params)) - 3600
+        os.utime(generate_flights.cache_path("flights", page_params), (stale_at, stale_at))
+
+        page_info, aggregated_flights, fetched_at = self.fetch()
+
+        self.assertEqual(page_info["pagination"]["total"], 1)
+        self.assertEqual([flight.flight_number for flight in aggregated_flights.values()], ["JL123"])
+        self.assertEqual(fetched_at, stale_at)
+        # 壊れた応答は再試行し、キャッシュを上書きしない
+        self.assertEqual(self.session.get.call_count, generate_flights.FETCH_MAX_ATTEMPTS)
+        with open(generate_flights.cache_path("flights", page_params), "rb") as f:
+            self.assertEqual(f.read(), BODY)
+
+    def test_truncated_body_without_cache_is_a_request_error(self):
+        with self.assertRaises(generate_flights.requests.exceptions.RequestException):
+            self.fetch()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""iter_page_flights (レスポンスの逐次パース) を json.loads と突き合わせるテスト"""
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_flights import iter_page_flights  # noqa: E402
+
+# json.loads が受け付ける本文
+VALID_BODIES = [
+    '{}',
+    '{"data": []}',
+    '{"data": [1, 2, 3]}',
+    '  {\n  "pagination": {"limit": 100, "offset": 0, "count": 2, "total": 2},\n'
+    '  "data": [{"flight": {"iata": "JL123"}}, {"flight": {"iata": "NH456"}}]\n}\n',
+    '{"data": [{"flight": {"iata": "JL123"}}], "pagination": {"total": 1}}',
+    '{"error": {"code": "usage_limit_reached", "message": "上限に達しました"}}',
+    '{"data": [{"arrival": {"airport": "北京首都国际机场"}}, 1.5e3, -0, "a\\"b\\u00e9", true, false, null]}',
+    '{"data": [[1, 2], {"a": []}, {}], "data_count": [1 , 2]}',
+    '{"data": {"a": 1}}',
+    '{"data": 12345678901234567890}',
+]
+
+# json.loads が受け付けない本文 (区切りの欠落、途中で切れたもの、余分なデータ)
+INVALID_BODIES = [
+    '',
+    '{',
+    '{"data": [1 2]}',
+    '{"a": 1 "data": []}',
+    '{"data": [] "a": 1}',
+    '{"data": [1,, 2]}',
+    '{"data": [, 1]}',
+    '{"data": [1, ]}',
+    '{"a": 1, }',
+    '{, "a": 1}',
+    '{,}',
+    '{"a" 1}',
+    '{a: 1}',
+    '{1: 2}',
+    '{"data": [1, 2]',
+    '{"data": [1, 2',
+    '{"data": [{"flight": {"iata": "JL1',
+    '{"pagination": {"total": 1}, "data": [{"a": 1}, {"b"',
+    '{"data": [12',
+    '{"data": []}}',
+    '{"data": []} {}',
+    '{"data": []} x',
+    '{"data": [] ]',
+    '{"data": [1}',
+]
+
+
+def parse(body: bytes, chunk_size: int):
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+    page_info = {}
+    data = list(iter_page_flights(chunks, page_info))
+    return page_info, data
+
+
+class IterPageFlightsTest(unittest.TestCase):
+    CHUNK_SIZES = (1, 2, 3, 7, 64, 1 << 20)
+
+    def test_matches_json_loads(self):
+        for body in VALID_BODIES:
+            payload = json.loads(body)
+            expected_data = payload.pop('data') if isinstance(payload.get('data'), list) else []
+            for chunk_size in self.CHUNK_SIZES:
+                with self.subTest(body=body, chunk_size=chunk_size):
+                    self.assertEqual(parse(body.encode('utf-8'), chunk_size), (payload, expected_data))
+
+    def test_rejects_what_json_loads_rejects(self):
+        # 途中で切れたマルチバイト文字も json.loads と同じく不正とする
+        bodies = [body.encode('utf-8') for body in INVALID_BODIES]
+        bodies.append('{"data": []} "é"'.encode('utf-8')[:-2])
+        bodies.append('{"data": ["é"]}'.encode('utf-8')[:-5])
+        for body in bodies:
+            with self.assertRaises(ValueError):
+                json.loads(body)
+            for chunk_size in self.CHUNK_SIZES:
+                with self.subTest(body=body, chunk_size=chunk_size):
+                    with self.assertRaises(ValueError):
+                        parse(body, chunk_size)
+
+    def test_truncations_of_valid_body(self):
+        # 完全な本文のどこで切れても、json.loads と同じく失敗する
+        body = VALID_BODIES[3].encode('utf-8')
+        for end in range(len(body.rstrip())):
+            with self.subTest(end=end):
+                with self.assertRaises(ValueError):
+                    json.loads(body[:end])
+                with self.assertRaises(ValueError):
+                    parse(body[:end], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()